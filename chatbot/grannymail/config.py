@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import find_dotenv, load_dotenv
 
@@ -10,12 +11,26 @@ DEVMODE = os.environ["DEVMODE"]
 BOT_TOKEN = os.environ["BOT_TOKEN"]
 BOT_USERNAME = os.environ["BOT_USERNAME"]
 TELEGRAM_WEBHOOK_URL = os.environ["TELEGRAM_WEBHOOK_URL"]
+# updates of different chats are processed concurrently up to this limit
+TELEGRAM_MAX_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_MAX_CONCURRENT_UPDATES", 16))
 
 # Whatsapp bot
 WHATSAPP_TOKEN = os.environ["WHATSAPP_TOKEN"]
 WHATSAPP_API_VERSION = os.environ["WHATSAPP_API_VERSION"]
 WHATSAPP_PHONE_NUMBER_ID = os.environ["WHATSAPP_PHONE_NUMBER_ID"]
 WHATSAPP_VERIFY_TOKEN = os.environ["WHATSAPP_VERIFY_TOKEN"]
+# messages of different users are processed concurrently up to this limit
+WHATSAPP_MAX_CONCURRENT_MESSAGES = int(
+    os.getenv("WHATSAPP_MAX_CONCURRENT_MESSAGES", 16)
+)
+# messages of a single user that may queue up before new ones are dropped
+WHATSAPP_MAX_PENDING_MESSAGES_PER_USER = int(
+    os.getenv("WHATSAPP_MAX_PENDING_MESSAGES_PER_USER", 20)
+)
+# seconds after which the mailbox of an inactive user is evicted
+WHATSAPP_USER_IDLE_TIMEOUT = float(os.getenv("WHATSAPP_USER_IDLE_TIMEOUT", 60))
+# seconds between writes of the buffered delivery statuses
+WHATSAPP_STATUS_FLUSH_INTERVAL = float(os.getenv("WHATSAPP_STATUS_FLUSH_INTERVAL", 10))
 
 
 # Supabase
@@ -34,10 +49,21 @@ OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 
 # Google Sheets
 MESSAGES_SHEET_NAME = os.environ["MESSAGES_SHEET_COLUMN"]
+# optional local CSV that stands in for the spreadsheet, e.g. for tests and offline runs
+MESSAGES_SHEET_PATH = os.getenv("MESSAGES_SHEET_PATH", None)
+# local copy of the last fetched spreadsheet, survives restarts
+MESSAGES_SHEET_SNAPSHOT_PATH = os.getenv(
+    "MESSAGES_SHEET_SNAPSHOT_PATH",
+    os.path.join(tempfile.gettempdir(), "grannymail_messages_sheet.csv"),
+)
 
 # Sentry
 SENTRY_ENDPOINT = os.getenv("SENTRY_ENDPOINT", None)
 
+# token that admin endpoints expect in the X-Admin-Token header, they are disabled if it
+# isn't set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", None)
+
 STRIPE_API_KEY = os.environ["STRIPE_API_KEY"]
 STRIPE_ENDPOINT_SECRET = os.environ["STRIPE_ENDPOINT_SECRET"]
 
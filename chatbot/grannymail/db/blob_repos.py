@@ -1,16 +1,21 @@
+import hashlib
 from abc import ABC, abstractmethod
 
 from supabase import Client  # type: ignore
 
 import grannymail.config as cfg
-from grannymail.utils import utils
 
 
 class BlobRepositoryBase(ABC):
+    """Stores blobs under the hash of their content.
+
+    Identical content is stored once and shared by every upload of it. Blobs are never
+    deleted, so a shared blob cannot be removed while it is still referenced.
+    """
+
     blob_prefix: str
 
-    def _create_blob_path(self, user_id: str, mime_type: str) -> str:
-        file_path = f"{self.blob_prefix}/{user_id}/{utils.get_utc_timestamp()}"
+    def _create_blob_path(self, bytes: bytes, mime_type: str) -> str:
         if mime_type == "audio/ogg":
             suffix = ".ogg"
         elif mime_type == "application/pdf":
@@ -18,16 +23,28 @@ class BlobRepositoryBase(ABC):
         else:
             raise ValueError(f"mime_type {mime_type} not supported for file upload")
 
-        return file_path + suffix
+        digest = hashlib.sha256(bytes).hexdigest()
+        # the leading characters spread the blobs over folders
+        return f"{self.blob_prefix}/{digest[:2]}/{digest}{suffix}"
+
+    def upload(self, bytes: bytes, mime_type: str) -> str:
+        """Uploads the blob unless it is stored already. Returns its path."""
+        blob_path = self._create_blob_path(bytes, mime_type)
+        return self.upload_to(bytes, blob_path, mime_type)
 
     @abstractmethod
-    def upload(self, bytes: bytes, user_id: str, mime_type: str) -> str:
+    def upload_to(self, bytes: bytes, blob_path: str, mime_type: str) -> str:
+        """Uploads the blob to the given path unless it is stored already."""
         pass
 
     @abstractmethod
     def download(self, blob_path: str) -> bytes:
         pass
 
+    @abstractmethod
+    def exists(self, blob_path: str) -> bool:
+        pass
+
 
 class SupabaseBlobStorage(BlobRepositoryBase):
     def __init__(self, client: Client):
@@ -40,16 +57,24 @@ class SupabaseBlobStorage(BlobRepositoryBase):
         self.blob_prefix: str
         self.blob_manager = self.client.storage.from_(self.bucket)
 
-    def upload(self, bytes: bytes, user_id: str, mime_type: str) -> str:
-        blob_path = self._create_blob_path(user_id, mime_type)
-        self.blob_manager.upload(
-            file=bytes, path=blob_path, file_options={"content-type": mime_type}
-        )
+    def upload_to(self, bytes: bytes, blob_path: str, mime_type: str) -> str:
+        # concurrent uploads of the same content write identical bytes, so they upsert
+        if not self.exists(blob_path):
+            self.blob_manager.upload(
+                file=bytes,
+                path=blob_path,
+                file_options={"content-type": mime_type, "upsert": "true"},
+            )
         return blob_path
 
     def download(self, blob_path: str) -> bytes:
         return self.blob_manager.download(blob_path)
 
+    def exists(self, blob_path: str) -> bool:
+        folder, _, name = blob_path.rpartition("/")
+        found = self.blob_manager.list(folder, {"search": name, "limit": 100})
+        return any(x["name"] == name for x in found)
+
 
 class DraftBlobRepository(SupabaseBlobStorage):
     def __init__(self, client: Client):
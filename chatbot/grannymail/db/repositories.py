@@ -1,3 +1,4 @@
+import time
 import typing as t
 from abc import ABC, abstractmethod
 from dataclasses import asdict, fields
@@ -5,6 +6,7 @@ from typing import Generic, TypeVar
 
 import supabase
 from grannymail.domain import models as m
+from grannymail.utils import address_index, credit_balances
 from postgrest._sync.request_builder import SyncSelectRequestBuilder
 from supabase import Client  # type: ignore
 
@@ -19,6 +21,14 @@ class DuplicateEntryError(Exception):
         super().__init__(self.message)
 
 
+class LedgerIsAppendOnlyError(TypeError):
+    """Exception raised when an entry of the credit ledger is updated or deleted."""
+
+    def __init__(self, message="The credit ledger is append-only"):
+        self.message = message
+        super().__init__(self.message)
+
+
 class RepositoryBase(ABC, Generic[T]):
     @abstractmethod
     def add(self, entity: T) -> T:
@@ -70,6 +80,124 @@ class SystemsMessageRepositoryBase(RepositoryBase):
         """Retrieves the message body by its ID."""
         pass
 
+    @abstractmethod
+    def sync(self, upserts: list[m.SystemMessage], deletes: list[str]) -> None:
+        """Inserts or updates and deletes messages in a single atomic operation."""
+        pass
+
+    @abstractmethod
+    def warm_cache(self) -> int:
+        """Loads all messages into the cache. Returns the number of messages."""
+        pass
+
+
+class OrderRepositoryBase(RepositoryBase[m.Order]):
+    @abstractmethod
+    def transition_and_adjust_credits(
+        self,
+        order_id: str,
+        from_status: str,
+        to_status: str,
+        credits_added: int = 0,
+        credit_delta: int = 0,
+        stripe_event_id: str | None = None,
+    ) -> tuple[bool, int]:
+        """Atomically moves an order from one status to another and adjusts the
+        letter credits of its user.
+
+        `credits_added` is always added to the balance, `credit_delta` only if the order
+        was transitioned. Credits added with a `stripe_event_id` are only added once for
+        that event, so retried events do not credit the purchase again. The transition is skipped if the order is not in `from_status`
+        or the balance would become negative.
+
+        Returns:
+            tuple[bool, int]: Whether the order was transitioned and the new balance.
+        """
+        pass
+
+
+class CreditLedgerRepositoryBase(RepositoryBase[m.CreditLedgerEntry]):
+    @abstractmethod
+    def get_balance(self, user_id: str) -> int:
+        """Returns the letter credit balance of a user."""
+        pass
+
+    @abstractmethod
+    def compact(self) -> int:
+        """Folds the ledger entries into balance snapshots. Returns the number of users
+        whose snapshot was updated."""
+        pass
+
+
+class JobLeaseRepositoryBase(RepositoryBase[m.JobLease]):
+    @abstractmethod
+    def try_acquire(self, job_name: str, holder: str, ttl: float) -> bool:
+        """Acquires the lease of a job for `ttl` seconds unless another holder has a
+        lease that did not expire yet. Returns whether the lease was acquired."""
+        pass
+
+    @abstractmethod
+    def renew(self, job_name: str, holder: str, ttl: float) -> bool:
+        """Extends the lease of a job to `ttl` seconds from now if `holder` still has
+        it. Returns whether the lease was extended."""
+        pass
+
+
+class DeliveryStatusRepositoryBase(RepositoryBase[m.DeliveryStatus]):
+    @abstractmethod
+    def add_many(self, entities: list[m.DeliveryStatus]) -> None:
+        """Adds all statuses in one request, skipping transitions already stored."""
+        pass
+
+    @abstractmethod
+    def get_sent_messages(self, wa_mids: list[str]) -> dict[str, tuple[str, str]]:
+        """Looks up outgoing messages by their WhatsApp message id.
+
+        Returns:
+            dict[str, tuple[str, str]]: The message id and timestamp of every message
+                that was found, keyed by its WhatsApp message id.
+        """
+        pass
+
+
+class OutboxRepositoryBase(RepositoryBase[m.OutboxMessage]):
+    @abstractmethod
+    def claim(self, limit: int, lease_seconds: int) -> list[m.OutboxMessage]:
+        """Claims the oldest due message of up to `limit` recipients for sending.
+
+        Messages behind an open message of the same recipient are not claimed, and
+        claims that were not completed within `lease_seconds` can be claimed again.
+        """
+        pass
+
+
+class BroadcastRepositoryBase(RepositoryBase[m.Broadcast]):
+    @abstractmethod
+    def get_recipients(
+        self, after_user_id: str | None, limit: int
+    ) -> list[tuple[m.User, m.WhatsappMessage | m.TelegramMessage]]:
+        """Returns the next `limit` users after `after_user_id` in the order of their
+        ids, each with the latest message they sent. Users who never sent a message
+        can't be reached and are skipped."""
+        pass
+
+
+class StripeEventRepositoryBase(RepositoryBase[m.StripeEvent]):
+    @abstractmethod
+    def claim(self, event_id: str, lease_seconds: int) -> m.StripeEvent | None:
+        """Marks a due event as processing and counts the attempt. Returns None if
+        the event isn't due, e.g. because another worker claimed it.
+
+        Events are due if they were received, if they failed and their next attempt
+        is due, or if they were claimed more than `lease_seconds` ago.
+        """
+        pass
+
+    @abstractmethod
+    def get_due(self, lease_seconds: int) -> list[m.StripeEvent]:
+        """Returns the events that can be claimed, oldest first."""
+        pass
+
 
 class SupabaseRepository(RepositoryBase[T]):
     def __init__(self, client: Client):
@@ -83,7 +211,10 @@ class SupabaseRepository(RepositoryBase[T]):
         self.__id_col__: str = ""
         self.__data_type__: t.Type[T]
 
-    def _filter_data_for_class(self, data: dict, target_class: t.Type[T]) -> dict:
+    @staticmethod
+    def _filter_data_for_class(
+        data: dict, target_class: t.Type[m.AbstractDataTableClass]
+    ) -> dict:
         field_names = {f.name for f in fields(target_class)}
         return {k: v for k, v in data.items() if k in field_names}
 
@@ -229,6 +360,15 @@ class AddressRepository(SupabaseRepository[m.Address]):
         self.__id_col__: str = "address_id"
         self.__data_type__ = m.Address
 
+    def add(self, entity: m.Address) -> m.Address:
+        address = super().add(entity)
+        address_index.on_address_added(address)
+        return address
+
+    def delete(self, id: str) -> None:
+        super().delete(id)
+        address_index.on_address_deleted(id)
+
     def get_user_addresses(self, user_id: str) -> list[m.Address]:
         return self.get_all(filters={"user_id": user_id}, order={"created_at": "asc"})
 
@@ -241,13 +381,84 @@ class DraftRepository(SupabaseRepository[m.Draft]):
         self.__data_type__ = m.Draft
 
 
-class OrderRepository(SupabaseRepository[m.Order]):
+class OrderRepository(OrderRepositoryBase, SupabaseRepository[m.Order]):
     def __init__(self, client: Client):
         super().__init__(client)
         self.__table__: str = "orders"
         self.__id_col__: str = "order_id"
         self.__data_type__ = m.Order
 
+    def transition_and_adjust_credits(
+        self,
+        order_id: str,
+        from_status: str,
+        to_status: str,
+        credits_added: int = 0,
+        credit_delta: int = 0,
+        stripe_event_id: str | None = None,
+    ) -> tuple[bool, int]:
+        r = self.client.rpc(
+            "transition_order_and_adjust_credits",
+            {
+                "p_order_id": order_id,
+                "p_from_status": from_status,
+                "p_to_status": to_status,
+                "p_credits_added": credits_added,
+                "p_credit_delta": credit_delta,
+                "p_stripe_event_id": stripe_event_id,
+            },
+        ).execute()
+        result = r.data[0]
+        credit_balances.balance_cache.set(
+            result["user_id"], result["num_letter_credits"], result["last_entry_id"]
+        )
+        return result["transitioned"], result["num_letter_credits"]
+
+
+class CreditLedgerRepository(
+    CreditLedgerRepositoryBase, SupabaseRepository[m.CreditLedgerEntry]
+):
+    """Append-only ledger of letter credit changes.
+
+    Balances are served from the in-memory balance cache and fall back to the latest
+    snapshot plus the entries written after it.
+    """
+
+    def __init__(self, client: Client):
+        super().__init__(client)
+        self.__table__: str = "credit_ledger"
+        self.__id_col__: str = "entry_id"
+        self.__data_type__ = m.CreditLedgerEntry
+
+    def add(self, entity: m.CreditLedgerEntry) -> m.CreditLedgerEntry:
+        data = asdict(entity)
+        if data["entry_id"] is None:
+            # let the database assign the next entry id
+            del data["entry_id"]
+        resp = self.client.table(self.__table__).insert(data).execute()
+        credit_balances.balance_cache.invalidate(entity.user_id)
+        filtered_data = self._filter_data_for_class(resp.data[0], self.__data_type__)
+        return self.__data_type__(**filtered_data)
+
+    def update(self, entity: m.CreditLedgerEntry) -> m.CreditLedgerEntry:
+        raise LedgerIsAppendOnlyError()
+
+    def delete(self, id: str) -> None:
+        raise LedgerIsAppendOnlyError()
+
+    def get_balance(self, user_id: str) -> int:
+        balance = credit_balances.balance_cache.get(user_id)
+        if balance is not None:
+            return balance
+        r = self.client.rpc("get_credit_balance", {"p_user_id": user_id}).execute()
+        balance, last_entry_id = r.data[0]["balance"], r.data[0]["last_entry_id"]
+        credit_balances.balance_cache.set(user_id, balance, last_entry_id)
+        return balance
+
+    def compact(self) -> int:
+        r = self.client.rpc("compact_credit_ledger", {}).execute()
+        return int(t.cast(int, r.data))
+
 
 class AttachmentRepository(SupabaseRepository[m.Attachment]):
     def __init__(self, client: Client):
@@ -257,6 +468,13 @@ class AttachmentRepository(SupabaseRepository[m.Attachment]):
         self.__data_type__ = m.Attachment
 
 
+# Seconds after which the cached system messages are reloaded, picks up changes that
+# were synchronised by other workers
+SYSTEM_MESSAGE_TTL = 5 * 60
+_system_messages: dict[str, str] = {}
+_system_messages_loaded_at: float | None = None
+
+
 class SystemMessageRepository(
     SystemsMessageRepositoryBase, SupabaseRepository[m.SystemMessage]
 ):
@@ -267,4 +485,168 @@ class SystemMessageRepository(
         self.__data_type__ = m.SystemMessage
 
     def get_msg(self, message_identifier: str) -> str:
-        return self.get_one(message_identifier).message_body
+        if (
+            _system_messages_loaded_at is None
+            or time.monotonic() - _system_messages_loaded_at > SYSTEM_MESSAGE_TTL
+        ):
+            self.warm_cache()
+        message_body = _system_messages.get(message_identifier)
+        if message_body is None:
+            message_body = self.get_one(message_identifier).message_body
+            _system_messages[message_identifier] = message_body
+        return message_body
+
+    def warm_cache(self) -> int:
+        global _system_messages, _system_messages_loaded_at
+        _system_messages = {
+            msg.message_identifier: msg.message_body for msg in self.get_all()
+        }
+        _system_messages_loaded_at = time.monotonic()
+        return len(_system_messages)
+
+    def sync(self, upserts: list[m.SystemMessage], deletes: list[str]) -> None:
+        self.client.rpc(
+            "sync_system_messages",
+            {"p_upserts": [asdict(msg) for msg in upserts], "p_deletes": deletes},
+        ).execute()
+        for msg in upserts:
+            _system_messages[msg.message_identifier] = msg.message_body
+        for message_identifier in deletes:
+            _system_messages.pop(message_identifier, None)
+
+
+class JobLeaseRepository(JobLeaseRepositoryBase, SupabaseRepository[m.JobLease]):
+    def __init__(self, client: Client):
+        super().__init__(client)
+        self.__table__: str = "job_leases"
+        self.__id_col__: str = "job_name"
+        self.__data_type__ = m.JobLease
+
+    def try_acquire(self, job_name: str, holder: str, ttl: float) -> bool:
+        r = self.client.rpc(
+            "try_acquire_job_lease",
+            {"p_job_name": job_name, "p_holder": holder, "p_ttl_seconds": int(ttl)},
+        ).execute()
+        return bool(r.data)
+
+    def renew(self, job_name: str, holder: str, ttl: float) -> bool:
+        r = self.client.rpc(
+            "renew_job_lease",
+            {"p_job_name": job_name, "p_holder": holder, "p_ttl_seconds": int(ttl)},
+        ).execute()
+        return bool(r.data)
+
+
+class DeliveryStatusRepository(
+    DeliveryStatusRepositoryBase, SupabaseRepository[m.DeliveryStatus]
+):
+    def __init__(self, client: Client):
+        super().__init__(client)
+        self.__table__: str = "delivery_statuses"
+        self.__id_col__: str = "status_id"
+        self.__data_type__ = m.DeliveryStatus
+
+    def add_many(self, entities: list[m.DeliveryStatus]) -> None:
+        if not entities:
+            return
+        self.client.table(self.__table__).upsert(
+            [asdict(entity) for entity in entities],
+            on_conflict="wa_mid,status",
+            ignore_duplicates=True,
+        ).execute()
+
+    def get_sent_messages(self, wa_mids: list[str]) -> dict[str, tuple[str, str]]:
+        if not wa_mids:
+            return {}
+        r = (
+            self.client.table("messages")
+            .select("message_id, wa_mid, timestamp")
+            .in_("wa_mid", wa_mids)
+            .execute()
+        )
+        return {row["wa_mid"]: (row["message_id"], row["timestamp"]) for row in r.data}
+
+
+class OutboxRepository(OutboxRepositoryBase, SupabaseRepository[m.OutboxMessage]):
+    def __init__(self, client: Client):
+        super().__init__(client)
+        self.__table__: str = "outbox"
+        self.__id_col__: str = "outbox_id"
+        self.__data_type__ = m.OutboxMessage
+
+    def add(self, entity: m.OutboxMessage) -> m.OutboxMessage:
+        data = asdict(entity)
+        if data["seq"] is None:
+            # let the database assign the position in the outbox
+            del data["seq"]
+        resp = self.client.table(self.__table__).insert(data).execute()
+        filtered_data = self._filter_data_for_class(resp.data[0], self.__data_type__)
+        return self.__data_type__(**filtered_data)
+
+    def claim(self, limit: int, lease_seconds: int) -> list[m.OutboxMessage]:
+        r = self.client.rpc(
+            "claim_outbox_messages",
+            {"p_limit": limit, "p_lease_seconds": lease_seconds},
+        ).execute()
+        return [
+            self.__data_type__(**self._filter_data_for_class(row, self.__data_type__))
+            for row in r.data
+        ]
+
+
+class BroadcastRepository(BroadcastRepositoryBase, SupabaseRepository[m.Broadcast]):
+    def __init__(self, client: Client):
+        super().__init__(client)
+        self.__table__: str = "broadcasts"
+        self.__id_col__: str = "broadcast_id"
+        self.__data_type__ = m.Broadcast
+
+    def get_recipients(
+        self, after_user_id: str | None, limit: int
+    ) -> list[tuple[m.User, m.WhatsappMessage | m.TelegramMessage]]:
+        r = self.client.rpc(
+            "get_broadcast_recipients",
+            {"p_after_user_id": after_user_id, "p_limit": limit},
+        ).execute()
+        recipients: list[tuple[m.User, m.WhatsappMessage | m.TelegramMessage]] = []
+        for row in r.data:
+            message_type: type[m.WhatsappMessage] | type[m.TelegramMessage]
+            if row["ref_message"]["messaging_platform"] == "Telegram":
+                message_type = m.TelegramMessage
+            else:
+                message_type = m.WhatsappMessage
+            user = m.User(**self._filter_data_for_class(row["user"], m.User))
+            ref_message = message_type(
+                **self._filter_data_for_class(row["ref_message"], message_type)
+            )
+            recipients.append((user, ref_message))
+        return recipients
+
+
+class StripeEventRepository(
+    StripeEventRepositoryBase, SupabaseRepository[m.StripeEvent]
+):
+    def __init__(self, client: Client):
+        super().__init__(client)
+        self.__table__: str = "stripe_events"
+        self.__id_col__: str = "event_id"
+        self.__data_type__ = m.StripeEvent
+
+    def claim(self, event_id: str, lease_seconds: int) -> m.StripeEvent | None:
+        r = self.client.rpc(
+            "claim_stripe_event",
+            {"p_event_id": event_id, "p_lease_seconds": lease_seconds},
+        ).execute()
+        if not r.data:
+            return None
+        filtered_data = self._filter_data_for_class(r.data[0], self.__data_type__)
+        return self.__data_type__(**filtered_data)
+
+    def get_due(self, lease_seconds: int) -> list[m.StripeEvent]:
+        r = self.client.rpc(
+            "get_due_stripe_events", {"p_lease_seconds": lease_seconds}
+        ).execute()
+        return [
+            self.__data_type__(**self._filter_data_for_class(row, self.__data_type__))
+            for row in r.data
+        ]
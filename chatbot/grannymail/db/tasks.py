@@ -1,19 +1,47 @@
-import time
 import grannymail.domain.models as m
 from grannymail.logger import logger
 from grannymail.services.unit_of_work import AbstractUnitOfWork, SupabaseUnitOfWork
 from grannymail.utils.utils import get_message_spreadsheet
 
 
+def diff_system_messages(
+    current: dict[str, str], target: dict[str, str]
+) -> tuple[list[m.SystemMessage], list[str]]:
+    """Compares the messages in the database with the target messages.
+
+    Args:
+        current: Message bodies in the database by message identifier.
+        target: Message bodies that should be in the database by message identifier.
+
+    Returns:
+        tuple[list[m.SystemMessage], list[str]]: The messages that are new or changed
+        and the identifiers of the messages that should be deleted.
+    """
+    upserts = [
+        m.SystemMessage(message_identifier=identifier, message_body=body)
+        for identifier, body in target.items()
+        if current.get(identifier) != body
+    ]
+    deletes = [identifier for identifier in current if identifier not in target]
+    return upserts, deletes
+
+
 def synchronise_sheet_with_db(uow: AbstractUnitOfWork):
+    """Brings the system messages in the database in line with the spreadsheet.
+
+    Only the rows that changed are written, all in one transaction, so `get_msg`
+    keeps working while the synchronisation runs.
+    """
     column_names = list(m.SystemMessage.__annotations__.keys())
     with uow:
-        items = uow.system_messages.get_all()
-        for item in items:
-            uow.system_messages.delete(item.message_identifier)
+        current = {
+            item.message_identifier: item.message_body
+            for item in uow.system_messages.get_all()
+        }
 
-        # get data from google spreadhsheet and filter out columns that are not in the spreadsheet
-        system_message_df = get_message_spreadsheet()
+        # get data from google spreadhsheet and filter out columns that are not in the spreadsheet,
+        # syncs follow edits of the sheet, so the cached copy is checked for changes
+        system_message_df = get_message_spreadsheet(revalidate=True)
         # filter out columns that are not in the spreadsheet
         system_message_df = system_message_df[
             [col for col in column_names if col in system_message_df.columns]
@@ -27,21 +55,30 @@ def synchronise_sheet_with_db(uow: AbstractUnitOfWork):
                 f"Duplicate Entries based on 'message_identifier': {str(duplicates)}"
             )
 
-        # warn about any NA values
+        # warn about any NA values, these rows can't be stored
         na_rows = system_message_df[system_message_df.isna().any(axis=1)]
         if not na_rows.empty:
             logger.warning(f"Rows with NA values: {na_rows}")
+        system_message_df = system_message_df.dropna()
 
-        # insert all values from system_message_df into table "system_messages"
-        time.sleep(1)
-        insert_values = system_message_df.to_dict(orient="records")
-        for value_set in insert_values:
-            uow.system_messages.add(
-                m.SystemMessage(
-                    message_identifier=value_set["message_identifier"],
-                    message_body=value_set["message_body"],
-                )
+        target = dict(
+            zip(
+                system_message_df["message_identifier"],
+                system_message_df["message_body"],
             )
+        )
+        upserts, deletes = diff_system_messages(current, target)
+        if upserts or deletes:
+            uow.system_messages.sync(upserts, deletes)
+        logger.info(
+            f"Synchronised system messages: {len(upserts)} upserted, {len(deletes)} deleted"
+        )
+
+
+def compact_credit_ledger(uow: AbstractUnitOfWork):
+    with uow:
+        num_users = uow.credit_ledger.compact()
+        logger.info(f"Compacted the credit ledger of {num_users} users")
 
 
 if __name__ == "__main__":
@@ -26,7 +26,6 @@ class User(AbstractDataTableClass):
     # unique fields = "user_id", "email", "phone_number", "telegram_id"
     user_id: str
     created_at: str
-    num_letter_credits: int = 0
     first_name: str | None = field(default=None)
     last_name: str | None = field(default=None)
     email: str | None = field(default=None)
@@ -246,34 +245,63 @@ class Order(AbstractDataTableClass):
     def __hash__(self):
         return hash(self.order_id)
 
-    def dispatch(self, uow: AbstractUnitOfWork) -> bool:
-        """Dispatches the order by sending the letter through Pingen.
+    def dispatch(
+        self,
+        uow: AbstractUnitOfWork,
+        credits_added: int = 0,
+        stripe_event_id: str | None = None,
+    ) -> tuple[bool, int]:
+        """Pays for the order with one letter credit and sends the letter through Pingen.
+
+        Claiming the order and charging the credit happen in a single atomic database
+        call, so concurrent dispatches of the same order send the letter only once. If
+        sending fails, the credit is refunded and the order can be dispatched again.
 
         Args:
             uow (AbstractUnitOfWork): A unit of work handling database operations.
+            credits_added (int): Credits to add to the user's balance in the same call,
+                e.g. credits that were just bought. They are kept if sending fails.
+            stripe_event_id (str | None): The Stripe event the credits were bought
+                with. The credits are only added once per event, so retrying the
+                event does not credit the purchase again.
 
         Returns:
-            bool: True if the letter was sent successfully, False otherwise. If False is returned,
-            this indicates that the letter has already been sent once.
+            tuple[bool, int]: Whether the letter was sent and the user's new credit
+            balance. If the letter was not sent, this indicates that the order was
+            already dispatched once or the user has no credits left.
 
         Raises:
             Exception: If the letter cannot be sent.
         """
-        if self.status != "payment_pending":
-            return False
+        was_claimed, num_letter_credits = uow.orders.transition_and_adjust_credits(
+            self.order_id,
+            from_status="payment_pending",
+            to_status="paid",
+            credits_added=credits_added,
+            credit_delta=-1,
+            stripe_event_id=stripe_event_id,
+        )
+        if not was_claimed:
+            return False, num_letter_credits
         try:
             pingen_client = Pingen()
             letter_bytes = uow.drafts_blob.download(self.blob_path)
             letter_name = f"order_{self.order_id}_{utils.get_utc_timestamp()}.pdf"
             pingen_client.upload_and_send_letter(letter_bytes, file_name=letter_name)
-            self.status = "transferred_to_pingen"
-            uow.orders.update(self)
         except Exception as e:
             logger.error(f"Failed to dispatch order {self.order_id}: {e}")
+            uow.orders.transition_and_adjust_credits(
+                self.order_id,
+                from_status="paid",
+                to_status="payment_pending",
+                credit_delta=1,
+            )
             raise
+        self.status = "transferred_to_pingen"
+        uow.orders.update(self)
 
         logger.info(f"Order {self.order_id} dispatched successfully.")
-        return True
+        return True, num_letter_credits
 
 
 @dataclass
@@ -295,4 +323,112 @@ class SystemMessage(AbstractDataTableClass):
         return hash(self.message_identifier)
 
 
+@dataclass
+class CreditLedgerEntry(AbstractDataTableClass):
+    # _unique_fields: "entry_id"
+    user_id: str
+    delta: int
+    reason: str
+    created_at: str
+    order_id: str | None = None
+    # set for purchases, each Stripe event is credited only once
+    stripe_event_id: str | None = None
+    # assigned by the database, increases with every entry
+    entry_id: int | None = None
+
+    def __hash__(self):
+        return hash(self.entry_id)
+
+
+@dataclass
+class JobLease(AbstractDataTableClass):
+    # _unique_fields: "job_name"
+    job_name: str
+    holder: str
+    expires_at: str
+    acquired_at: str | None = None
+
+    def __hash__(self):
+        return hash(self.job_name)
+
+
+@dataclass
+class StripeEvent(AbstractDataTableClass):
+    # _unique_fields: "event_id"
+    event_id: str
+    type: str
+    payload: dict
+    received_at: str
+    status: t.Literal["received", "processing", "processed", "failed"] = "received"
+    processed_at: str | None = None
+    error: str | None = None
+    attempts: int = 0
+    # when the processing event was claimed, the claim expires after a lease
+    claimed_at: str | None = None
+    # when a failed event is retried, None once it was given up on
+    next_attempt_at: str | None = None
+
+    def __hash__(self):
+        return hash(self.event_id)
+
+
+@dataclass
+class DeliveryStatus(AbstractDataTableClass):
+    # _unique_fields: "status_id", ("wa_mid", "status")
+    status_id: str
+    wa_mid: str
+    status: t.Literal["sent", "delivered", "read", "failed"]
+    status_timestamp: str
+    received_at: str
+    # the outgoing message and the seconds since it was sent, if it could be found
+    message_id: str | None = None
+    latency_seconds: float | None = None
+    error: str | None = None
+
+    def __hash__(self):
+        return hash(self.status_id)
+
+
+@dataclass
+class OutboxMessage(AbstractDataTableClass):
+    # _unique_fields: "outbox_id"
+    outbox_id: str
+    ref_message_id: str
+    messaging_platform: t.Literal["WhatsApp", "Telegram"]
+    # phone number or chat id, messages to the same recipient are sent in order
+    recipient: str
+    message_body: str
+    created_at: str
+    next_attempt_at: str
+    status: t.Literal["pending", "sending", "sent", "failed"] = "pending"
+    attempts: int = 0
+    claimed_until: str | None = None
+    sent_at: str | None = None
+    last_error: str | None = None
+    # assigned by the database, increases with every message
+    seq: int | None = None
+
+    def __hash__(self):
+        return hash(self.outbox_id)
+
+
+@dataclass
+class Broadcast(AbstractDataTableClass):
+    # _unique_fields: "broadcast_id"
+    broadcast_id: str
+    # the system message that is sent to every user
+    message_identifier: str
+    created_at: str
+    updated_at: str
+    status: t.Literal["running", "completed"] = "running"
+    # checkpoint, users are broadcast to in the order of their ids
+    last_user_id: str | None = None
+    num_sent: int = 0
+    num_failed: int = 0
+    completed_at: str | None = None
+
+    def __hash__(self):
+        return hash(self.broadcast_id)
+
+
 MessageType = t.TypeVar("MessageType", bound=BaseMessage)
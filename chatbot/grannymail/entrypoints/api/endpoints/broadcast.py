@@ -0,0 +1,92 @@
+import asyncio
+import secrets
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+
+from fastapi import APIRouter, FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse
+
+import grannymail.config as cfg
+from grannymail.logger import logger
+from grannymail.services.broadcast import Broadcaster, BroadcastClaimedError
+from grannymail.services.unit_of_work import SupabaseUnitOfWork
+
+router = APIRouter()
+
+# broadcast id -> task sending it in this process
+running: dict[str, asyncio.Task] = {}
+
+
+def check_admin_token(token: str | None) -> None:
+    if cfg.ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if token is None or not secrets.compare_digest(token, cfg.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+async def run_broadcast(
+    broadcaster: Broadcaster, broadcast_id: str, message_identifier: str
+) -> None:
+    try:
+        await broadcaster.run(broadcast_id, message_identifier)
+    except BroadcastClaimedError as e:
+        logger.info(str(e))
+    except Exception as e:
+        logger.error(f"Broadcast {broadcast_id} failed: {e}")
+    finally:
+        running.pop(broadcast_id, None)
+
+
+@router.post("/{broadcast_id}", status_code=202)
+async def start_broadcast(
+    broadcast_id: str,
+    message_identifier: str,
+    x_admin_token: str | None = Header(default=None),
+):
+    """
+    Starts sending a system message to all users in the background.
+
+    Broadcasts run in the server process, so their sends share the rate limiters with
+    the replies to users, which go first. The broadcast is claimed before it starts,
+    so a broadcast that is running on any worker isn't started twice. A broadcast that
+    was interrupted, e.g. by a redeploy, is resumed by starting it again with the same
+    id.
+
+    Args:
+        broadcast_id: Identifies the broadcast to resume it.
+        message_identifier: The system message to send.
+        x_admin_token: The admin token, sent in the X-Admin-Token header.
+    """
+    check_admin_token(x_admin_token)
+    broadcaster = Broadcaster(SupabaseUnitOfWork)
+    if broadcast_id in running or not await asyncio.to_thread(
+        broadcaster.claim, broadcast_id
+    ):
+        return JSONResponse(
+            content={"status": "running", "broadcast_id": broadcast_id},
+            status_code=200,
+        )
+    running[broadcast_id] = asyncio.create_task(
+        run_broadcast(broadcaster, broadcast_id, message_identifier)
+    )
+    logger.info(f"Started broadcast {broadcast_id} of '{message_identifier}'")
+    return {"status": "started", "broadcast_id": broadcast_id}
+
+
+@router.get("/{broadcast_id}")
+def get_broadcast(broadcast_id: str, x_admin_token: str | None = Header(default=None)):
+    """Returns the progress of a broadcast."""
+    check_admin_token(x_admin_token)
+    with SupabaseUnitOfWork() as uow:
+        broadcast = uow.broadcasts.maybe_get_one(broadcast_id)
+    if broadcast is None:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return {**asdict(broadcast), "running": broadcast_id in running}
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    yield
+    # interrupted broadcasts resume from their last checkpoint when started again
+    for task in running.values():
+        task.cancel()
@@ -1,16 +1,45 @@
-import stripe
-from fastapi import APIRouter, HTTPException, Request
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import timedelta
+
+from fastapi import APIRouter, FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 
 import grannymail.config as cfg
 import grannymail.domain.models as m
 import grannymail.integrations.stripe_payments as sp
-from grannymail.integrations.messengers import telegram, whatsapp
+from grannymail.db.repositories import DuplicateEntryError
 from grannymail.logger import logger
-from grannymail.services.unit_of_work import SupabaseUnitOfWork
+from grannymail.services import outbox
+from grannymail.services.unit_of_work import AbstractUnitOfWork, SupabaseUnitOfWork
+from grannymail.utils import utils
 
 router = APIRouter()
 
+# ids of persisted events waiting to be processed by the background worker
+event_queue: asyncio.Queue[str] = asyncio.Queue()
+_queued_event_ids: set[str] = set()
+
+# seconds after which the claim of an event that is still processing expires, e.g.
+# because its worker crashed or was redeployed, and the event is processed again
+CLAIM_LEASE = 10 * 60
+MAX_ATTEMPTS = 6
+# failed events are retried after 1, 2, 4, 8 and 16 minutes to bridge outages of
+# Supabase, Pingen or OpenAI
+RETRY_BASE_BACKOFF = 60
+RETRY_MAX_BACKOFF = 60 * 60
+# seconds between checks for events that are due again
+RECOVERY_INTERVAL = 60
+
+
+def enqueue_event(event_id: str) -> None:
+    """Queues an event for the worker unless it is queued already."""
+    if event_id in _queued_event_ids:
+        return
+    _queued_event_ids.add(event_id)
+    event_queue.put_nowait(event_id)
+
 
 async def process_stripe_event(event, uow):
     """
@@ -23,8 +52,13 @@ async def process_stripe_event(event, uow):
     Raises:
         ValueError: If the item processed is not recognized.
     """
-    was_dispatched, ref_message, credits_bought, user_credits = sp.handle_event(
-        event, uow
+    if event["type"] in sp.CATALOG_EVENT_TYPES:
+        await asyncio.to_thread(sp.catalog.handle_event, event)
+        return
+
+    # dispatching the letter through Pingen is blocking
+    was_dispatched, ref_message, credits_bought, user_credits = await asyncio.to_thread(
+        sp.handle_event, event, uow
     )
 
     # fetch the response content for the user
@@ -34,15 +68,102 @@ async def process_stripe_event(event, uow):
         msg_id = "stripe_webhook-success-no_dispatch"
     msg = uow.system_messages.get_msg(msg_id).format(credits_bought, user_credits)
 
-    # Determine the messenger so we reply on the platform on which we got the message
-    if isinstance(ref_message, m.WhatsappMessage):
-        messenger = whatsapp.Whatsapp()
-        await messenger.reply_text(ref_message, msg, uow)
-    elif isinstance(ref_message, m.TelegramMessage):
-        messenger = telegram.Telegram()
-        await messenger.reply_text(ref_message, msg, uow)
-    else:
+    # The reply goes through the outbox, so that the user is still notified if the
+    # platform is unavailable. It is sent on the platform on which we got the message.
+    if not isinstance(ref_message, (m.WhatsappMessage, m.TelegramMessage)):
         raise ValueError(f"Message platform {type(ref_message)} not found")
+    outbox.enqueue_text(ref_message, msg, uow)
+
+
+async def process_stored_event(event_id: str, uow: AbstractUnitOfWork) -> None:
+    """
+    Processes a persisted Stripe event.
+
+    The event is claimed before processing, so an event that is delivered or recovered
+    more than once is only processed by the worker that claimed it. A claim expires
+    after `CLAIM_LEASE`, so an event whose worker died while processing it is
+    processed again. Stripe does not retry acknowledged events, so failed events are
+    retried with backoff until they were attempted `MAX_ATTEMPTS` times.
+
+    Args:
+        event_id: The id of the Stripe event.
+        uow: The unit of work instance for database transactions.
+    """
+    stored_event = uow.stripe_events.claim(event_id, CLAIM_LEASE)
+    if stored_event is None:
+        logger.info(f"Stripe event {event_id} is not due or was claimed, skipping")
+        return
+
+    try:
+        await process_stripe_event(stored_event.payload, uow)
+        stored_event.status = "processed"
+        stored_event.error = None
+        stored_event.next_attempt_at = None
+    except Exception as e:
+        stored_event.status = "failed"
+        stored_event.error = str(e)
+        if stored_event.attempts >= MAX_ATTEMPTS:
+            logger.error(
+                f"Giving up on Stripe event {event_id} after {stored_event.attempts} attempts: {e}"
+            )
+            stored_event.next_attempt_at = None
+        else:
+            logger.warning(f"Error processing Stripe event {event_id}, retrying: {e}")
+            delay = outbox.backoff_delay(
+                stored_event.attempts, RETRY_BASE_BACKOFF, RETRY_MAX_BACKOFF
+            )
+            stored_event.next_attempt_at = utils.get_utc_timestamp(
+                timedelta(seconds=delay)
+            )
+    stored_event.processed_at = utils.get_utc_timestamp()
+    uow.stripe_events.update(stored_event)
+
+
+async def process_events_forever() -> None:
+    """Background worker that processes the events of the queue one at a time."""
+    while True:
+        event_id = await event_queue.get()
+        _queued_event_ids.discard(event_id)
+        try:
+            with SupabaseUnitOfWork() as uow:
+                await process_stored_event(event_id, uow)
+                uow.commit()
+        except Exception as e:
+            logger.error(f"Stripe event worker failed for event {event_id}: {e}")
+        finally:
+            event_queue.task_done()
+
+
+def recover_unprocessed_events(uow: AbstractUnitOfWork) -> int:
+    """Enqueues the events that are due: events that were persisted but not processed,
+    e.g. due to a restart, failed events whose retry is due and events whose claim
+    expired."""
+    events = uow.stripe_events.get_due(CLAIM_LEASE)
+    for event in events:
+        enqueue_event(event.event_id)
+    if events:
+        logger.info(f"Recovered {len(events)} unprocessed Stripe events")
+    return len(events)
+
+
+async def recover_events_forever(interval: float = RECOVERY_INTERVAL) -> None:
+    """Recovers due events at startup and periodically in the background."""
+    while True:
+        try:
+            with SupabaseUnitOfWork() as uow:
+                await asyncio.to_thread(recover_unprocessed_events, uow)
+        except Exception as e:
+            logger.error(f"Failed to recover unprocessed Stripe events: {e}")
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    worker = asyncio.create_task(process_events_forever())
+    recovery = asyncio.create_task(recover_events_forever())
+    yield
+    recovery.cancel()
+    worker.cancel()
 
 
 @router.post("/stripe_webhook")
@@ -50,6 +171,11 @@ async def webhook(request: Request):
     """
     Endpoint to handle Stripe webhook events.
 
+    Events are verified, persisted and acknowledged right away. Processing happens in
+    a background worker so that slow letter dispatches don't cause Stripe to retry.
+    Retried deliveries of an event that was already received are acknowledged without
+    being processed again.
+
     Args:
         request: The request object containing the webhook payload and headers.
 
@@ -63,12 +189,12 @@ async def webhook(request: Request):
     sig_header = request.headers.get("stripe-signature")
 
     try:
-        event = stripe.Webhook.construct_event(
+        event = sp.stripe.Webhook.construct_event(
             payload, sig_header, cfg.STRIPE_ENDPOINT_SECRET
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except stripe.error.SignatureVerificationError as e:  # type: ignore
+    except sp.stripe.error.SignatureVerificationError as e:  # type: ignore
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error handling Stripe event: {e}")
@@ -76,18 +202,21 @@ async def webhook(request: Request):
             status_code=500, detail="An error occurred while processing the event."
         )
 
-    logger.info(f"Stripe webhook: Received event: {event['type']}")
+    logger.info(f"Stripe webhook: Received event: {event['type']} ({event['id']})")
 
+    stored_event = m.StripeEvent(
+        event_id=event["id"],
+        type=event["type"],
+        payload=json.loads(payload),
+        received_at=utils.get_utc_timestamp(),
+    )
     try:
         with SupabaseUnitOfWork() as uow:
-            await process_stripe_event(event, uow)
+            uow.stripe_events.add(stored_event)
             uow.commit()
-    except ValueError as e:
-        logger.error(f"Error processing Stripe event: {e}")
-        raise HTTPException(
-            status_code=500, detail="An error occurred while processing the event."
-        )
-
-    return JSONResponse(content={"message": "Webhook received!"}, status_code=200)
+    except DuplicateEntryError:
+        logger.info(f"Stripe webhook: Event {event['id']} was already received")
+        return JSONResponse(content={"message": "Webhook received!"}, status_code=200)
 
+    enqueue_event(stored_event.event_id)
     return JSONResponse(content={"message": "Webhook received!"}, status_code=200)
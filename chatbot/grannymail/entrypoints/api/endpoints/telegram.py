@@ -1,4 +1,4 @@
-import datetime
+import functools
 from contextlib import asynccontextmanager
 from http import HTTPStatus
 
@@ -7,59 +7,86 @@ from telegram import Update
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
-    JobQueue,
     MessageHandler,
     filters,
 )
 from telegram.ext._contexttypes import ContextTypes
 
 import grannymail.config as cfg
-import grannymail.db.tasks as db_tasks
 import grannymail.integrations.messengers.telegram as telegram
 from grannymail.logger import logger
+from grannymail.services.keyed_executor import KeyedExecutor
 from grannymail.services.message_processing_service import MessageProcessingService
 from grannymail.services.unit_of_work import SupabaseUnitOfWork
 
 router = APIRouter()
+# shutdown waits this long for updates that are still being processed
+SHUTDOWN_TIMEOUT = 30
+
+
+@functools.cache
+def get_update_executor() -> KeyedExecutor:
+    return KeyedExecutor("telegram_updates", cfg.TELEGRAM_MAX_CONCURRENT_UPDATES)
 
-# Initialize python telegram bot
-ptb = (
-    Application.builder()
-    .updater(None)
-    .token(cfg.BOT_TOKEN)
-    .read_timeout(7)
-    .get_updates_read_timeout(42)
-    .build()
-)
-job_queue: JobQueue = ptb.job_queue  # type: ignore
+
+@functools.cache
+def get_ptb() -> Application:
+    """Builds the python telegram bot application on first use.
+
+    Building it registers our handlers, which is deferred so that importing the app
+    stays cheap.
+    """
+    ptb = (
+        Application.builder()
+        .updater(None)
+        .token(cfg.BOT_TOKEN)
+        .read_timeout(7)
+        .get_updates_read_timeout(42)
+        .build()
+    )
+
+    # Register our handlers
+    ptb.add_handler(
+        MessageHandler(filters.TEXT | filters.VOICE, handle_voice_text_or_callback)
+    )
+    ptb.add_handler(CallbackQueryHandler(handle_voice_text_or_callback))
+    return ptb
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    ptb = get_ptb()
     # await ptb.bot.setWebhook(cfg.TELEGRAM_WEBHOOK_URL)
     async with ptb:
         await ptb.start()
         yield
+        await get_update_executor().shutdown(SHUTDOWN_TIMEOUT)
         await ptb.stop()
 
 
+def get_update_key(update: Update) -> int:
+    """Updates of the same chat are processed in order, e.g. so that a callback
+    never overtakes the message it refers to."""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
 @router.post("/", status_code=200)
 async def process_update(request: Request):
+    """Acknowledges the update right away and processes it in the background."""
+    ptb = get_ptb()
     req = await request.json()
     update = Update.de_json(req, ptb.bot)
-    await ptb.process_update(update)
-    return {"message": "Update processed successfully"}
-
-
-async def job_update_system_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Updates the system messages that are stored in the database.
-
-    This function is called once a day and updates the system messages that are stored in the database. This is done
-    to allow for easy customisation of the messages without having to redeploy the bot.
-    """
-    logger.info("Updating system messages")
-    with SupabaseUnitOfWork() as uow:
-        db_tasks.synchronise_sheet_with_db(uow)
+    if update is None:
+        logger.warning("Received an empty Telegram update")
+        return {"message": "Update ignored"}
+    get_update_executor().submit(
+        get_update_key(update), lambda: ptb.process_update(update)
+    )
+    return {"message": "Update received"}
 
 
 async def handle_voice_text_or_callback(
@@ -71,16 +98,3 @@ async def handle_voice_text_or_callback(
             uow, update=update, context=context, messenger=messenger
         )
         logger.info("Successfully handled query")
-
-
-# Register our handlers
-ptb.add_handler(
-    MessageHandler(filters.TEXT | filters.VOICE, handle_voice_text_or_callback)
-)
-ptb.add_handler(CallbackQueryHandler(handle_voice_text_or_callback))
-job_queue.run_once(job_update_system_messages, 0)
-job_queue.run_daily(
-    job_update_system_messages,
-    days=(0, 1, 2, 3, 4, 5, 6),
-    time=datetime.time(hour=6, minute=00, second=00),
-)
@@ -1,13 +1,72 @@
-from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+import asyncio
+import functools
+import re
+from contextlib import asynccontextmanager
 
+import orjson
+from fastapi import APIRouter, FastAPI, Header, Request, Response
+
+import grannymail.config as cfg
 import grannymail.integrations.messengers.whatsapp as whatsapp
+from grannymail.entrypoints.api.endpoints.broadcast import check_admin_token
 from grannymail.integrations.messengers.whatsapp import WebhookRequestData
 from grannymail.logger import logger
+from grannymail.services.delivery_tracker import delivery_tracker
+from grannymail.services.keyed_executor import KeyedExecutor, MailboxFullError
 from grannymail.services.message_processing_service import MessageProcessingService
 from grannymail.services.unit_of_work import SupabaseUnitOfWork
 
 router = APIRouter()
+# shutdown waits this long for messages that are still being processed
+SHUTDOWN_TIMEOUT = 30
+# cheap probes for the keys of a delivery, so that we only parse what we need. Note
+# that "messages" is also the value of a change's field.
+MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+STATUSES_KEY = re.compile(rb'"statuses"\s*:')
+
+
+@functools.cache
+def get_user_executor() -> KeyedExecutor:
+    """Processes the messages of a user one at a time, e.g. so that the confirmation
+    of an address can't race the command that created it."""
+    return KeyedExecutor(
+        "whatsapp_users",
+        cfg.WHATSAPP_MAX_CONCURRENT_MESSAGES,
+        max_mailbox_size=cfg.WHATSAPP_MAX_PENDING_MESSAGES_PER_USER,
+        idle_timeout=cfg.WHATSAPP_USER_IDLE_TIMEOUT,
+    )
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    status_flusher = asyncio.create_task(
+        delivery_tracker.flush_forever(
+            SupabaseUnitOfWork, cfg.WHATSAPP_STATUS_FLUSH_INTERVAL
+        )
+    )
+    yield
+    await get_user_executor().shutdown(SHUTDOWN_TIMEOUT)
+    status_flusher.cancel()
+    try:
+        with SupabaseUnitOfWork() as uow:
+            delivery_tracker.flush(uow)
+            uow.commit()
+    except Exception as e:
+        logger.error(f"Failed to flush delivery statuses on shutdown: {e}")
+
+
+def get_phone_number(data: WebhookRequestData) -> str:
+    values = data.entry[0]["changes"][0]["value"]
+    return values["contacts"][0]["wa_id"]
+
+
+async def process_message(data: WebhookRequestData) -> None:
+    with SupabaseUnitOfWork() as uow:
+        messenger = whatsapp.Whatsapp()
+        await MessageProcessingService().receive_and_process_message(
+            uow, data=data, messenger=messenger
+        )
+        logger.info("Successfully handled query")
 
 
 @router.get("/", status_code=200)
@@ -15,22 +74,62 @@ async def verify_route(request: Request):
     return whatsapp.fastapi_verify(request)
 
 
-@router.post("/", status_code=200)
-async def webhook_route(data: WebhookRequestData):
-    if data.entry[0].get("changes", [{}])[0].get("value", {}).get("statuses"):
-        logger.info("WA status update")
-        return JSONResponse(content="ok")
-    else:
+def submit_messages(data: WebhookRequestData) -> int:
+    """Submits every message of a delivery to the executor of its sender.
+
+    Returns:
+        int: The number of messages submitted.
+    """
+    num_submitted = 0
+    for payload in whatsapp.split_webhook_messages(data):
         try:
-            with SupabaseUnitOfWork() as uow:
-                messenger = whatsapp.Whatsapp()
-                await MessageProcessingService().receive_and_process_message(
-                    uow, data=data, messenger=messenger
-                )
-                logger.info("Successfully handled query")
-            return JSONResponse(content="ok")
+            get_user_executor().submit(
+                get_phone_number(payload),
+                functools.partial(process_message, payload),
+            )
+            num_submitted += 1
+        except MailboxFullError as e:
+            logger.error(f"Dropping WhatsApp message: {e}")
         except Exception as e:
             logger.error(f"An error occurred: {e}")
-            # we still send a 200 status code, because we don't want any retries from the Whatsapp API
-            # as this can cause unexpected issues.
-            return JSONResponse(content="ok", status_code=200)
+    return num_submitted
+
+
+def record_statuses(payload: dict) -> None:
+    """Buffers the status updates of a delivery, skipping malformed ones."""
+    for status in whatsapp.get_webhook_statuses(payload):
+        try:
+            delivery_tracker.record(status)
+        except Exception as e:
+            logger.error(f"Skipping WhatsApp status update {status}: {e}")
+
+
+def acknowledge() -> Response:
+    return Response(content=b'"ok"', media_type="application/json")
+
+
+@router.post("/", status_code=200)
+async def webhook_route(request: Request):
+    # we always send a 200 status code, because we don't want any retries from the
+    # Whatsapp API as this can cause unexpected issues.
+    body = await request.body()
+    has_messages = MESSAGES_KEY.search(body) is not None
+    has_statuses = STATUSES_KEY.search(body) is not None
+    if not has_messages and not has_statuses:
+        return acknowledge()
+    try:
+        payload = orjson.loads(body)
+        if has_messages:
+            submit_messages(WebhookRequestData.model_validate(payload))
+        # status updates are only buffered, the model is built for messages only
+        if has_statuses:
+            record_statuses(payload)
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+    return acknowledge()
+
+
+@router.get("/delivery_stats", status_code=200)
+async def delivery_stats(x_admin_token: str | None = Header(default=None)):
+    check_admin_token(x_admin_token)
+    return delivery_tracker.stats()
@@ -1,11 +1,19 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import sentry_sdk
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse
 
 import grannymail.config as cfg
+import grannymail.integrations.stripe_payments as sp
+from grannymail.services import outbox
 from grannymail.services.unit_of_work import SupabaseUnitOfWork
 from grannymail.db.tasks import synchronise_sheet_with_db
+from grannymail.integrations import http_client, rate_limiter
 
-from .endpoints import payment, telegram, whatsapp
+from . import jobs, warmup
+from .endpoints import broadcast, payment, telegram, whatsapp
 
 # setup sentry
 if cfg.SENTRY_ENDPOINT:
@@ -21,12 +29,50 @@ if cfg.SENTRY_ENDPOINT:
     )
 
 
-app = FastAPI(title="GrannyMail", lifespan=telegram.lifespan)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warms up in the background so the port is bound right away, /ready reports
+    # when the instance can take traffic
+    warm_up_task = asyncio.create_task(warmup.warm_up())
+    stripe_catalog_task = asyncio.create_task(sp.keep_catalog_warm())
+    outbox_task = asyncio.create_task(outbox.sender.run_forever())
+    async with (
+        telegram.lifespan(app),
+        whatsapp.lifespan(app),
+        payment.lifespan(app),
+        jobs.lifespan(app),
+        broadcast.lifespan(app),
+    ):
+        yield
+    outbox_task.cancel()
+    stripe_catalog_task.cancel()
+    warm_up_task.cancel()
+    await http_client.close()
+
+
+app = FastAPI(title="GrannyMail", lifespan=lifespan)
 
 # Include routers from your endpoints
 app.include_router(whatsapp.router, prefix="/api/whatsapp", tags=["whatsapp"])
 app.include_router(telegram.router, prefix="/api/telegram", tags=["telegram"])
 app.include_router(payment.router, prefix="/api/payment", tags=["payment"])
+app.include_router(broadcast.router, prefix="/api/broadcast", tags=["broadcast"])
+
+
+@app.get("/ready")
+def ready():
+    if not warmup.state.ready:
+        return JSONResponse(
+            content={"status": "warming_up", "durations": warmup.state.durations},
+            status_code=503,
+        )
+    return {"status": "ready", "durations": warmup.state.durations}
+
+
+@app.get("/rate_limits")
+def rate_limits(x_admin_token: str | None = Header(default=None)):
+    broadcast.check_admin_token(x_admin_token)
+    return {limiter.name: limiter.stats.as_dict() for limiter in rate_limiter.limiters}
 
 
 @app.get("/update_messages", status_code=200)
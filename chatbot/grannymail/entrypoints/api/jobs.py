@@ -0,0 +1,56 @@
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+import grannymail.db.tasks as db_tasks
+from grannymail.logger import logger
+from grannymail.services.scheduler import Scheduler
+from grannymail.services.unit_of_work import SupabaseUnitOfWork
+
+
+def update_system_messages() -> None:
+    with SupabaseUnitOfWork() as uow:
+        db_tasks.synchronise_sheet_with_db(uow)
+
+
+def compact_credit_ledger() -> None:
+    with SupabaseUnitOfWork() as uow:
+        db_tasks.compact_credit_ledger(uow)
+
+
+async def job_update_system_messages() -> None:
+    """Updates the system messages that are stored in the database.
+
+    This function is called once a day and updates the system messages that are stored in the database. This is done
+    to allow for easy customisation of the messages without having to redeploy the bot.
+    """
+    logger.info("Updating system messages")
+    await asyncio.to_thread(update_system_messages)
+
+
+async def job_compact_credit_ledger() -> None:
+    """Folds the credit ledger into balance snapshots once a day so that balance
+    lookups that miss the in-memory cache only sum up a day of entries."""
+    await asyncio.to_thread(compact_credit_ledger)
+
+
+scheduler = Scheduler(SupabaseUnitOfWork)
+scheduler.daily(
+    "update_system_messages",
+    datetime.time(hour=6),
+    job_update_system_messages,
+    run_at_startup=True,
+    lease_ttl=5 * 60,
+)
+scheduler.daily(
+    "compact_credit_ledger", datetime.time(hour=3), job_compact_credit_ledger
+)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    scheduler.start()
+    yield
+    scheduler.stop()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+import typing as t
+from dataclasses import dataclass, field
+
+import grannymail.config as cfg
+from grannymail.integrations import http_client
+from grannymail.integrations.pingen import Pingen
+from grannymail.logger import logger
+from grannymail.services.unit_of_work import SupabaseUnitOfWork
+from grannymail.utils import lazy
+from grannymail.utils.lazy import lazy_import
+
+pdf_gen = lazy_import("grannymail.integrations.pdf_gen")
+
+# hosts that every instance talks to through the shared http client while handling
+# messages. Supabase clients are created per unit of work and don't use this pool, the
+# system messages step runs the first Supabase query instead.
+WARM_UP_URLS = [
+    f"https://graph.facebook.com/{cfg.WHATSAPP_API_VERSION}",
+]
+
+
+@dataclass
+class WarmUpState:
+    ready: bool = False
+    # step name -> seconds it took
+    durations: dict[str, float] = field(default_factory=dict)
+    failed: list[str] = field(default_factory=list)
+
+
+state = WarmUpState()
+
+
+def _warm_system_messages() -> int:
+    with SupabaseUnitOfWork() as uow:
+        return uow.system_messages.warm_cache()
+
+
+def _warm_fonts() -> None:
+    pdf_gen.get_glyph_coverage()
+    # renders one letter so ReportLab loads its fonts and layout machinery
+    pdf_gen.create_letter_pdf_as_bytes("Warm-up")
+
+
+def _warm_pingen_token() -> None:
+    Pingen()._get_token()
+
+
+async def _run_step(name: str, step: t.Callable[[], t.Awaitable]) -> None:
+    start = time.monotonic()
+    try:
+        await step()
+    except Exception as e:
+        state.failed.append(name)
+        logger.error(f"Warm-up step '{name}' failed: {e}")
+    finally:
+        state.durations[name] = time.monotonic() - start
+        logger.info(f"Warm-up step '{name}' took {state.durations[name]:.2f}s")
+
+
+async def warm_up() -> None:
+    """Primes imports, connection pools, caches and tokens concurrently.
+
+    The instance is marked as ready once all steps finished. Steps that fail are
+    logged, the instance still becomes ready as it can serve requests without them.
+    """
+    start = time.monotonic()
+    await asyncio.gather(
+        _run_step("imports", lambda: asyncio.to_thread(lazy.preload)),
+        _run_step("http_pool", lambda: http_client.warm_up(WARM_UP_URLS)),
+        _run_step("system_messages", lambda: asyncio.to_thread(_warm_system_messages)),
+        _run_step("fonts", lambda: asyncio.to_thread(_warm_fonts)),
+        _run_step("pingen_token", lambda: asyncio.to_thread(_warm_pingen_token)),
+    )
+    state.ready = True
+    logger.info(
+        f"Warm-up finished in {time.monotonic() - start:.2f}s, failed steps: {state.failed}"
+    )
@@ -0,0 +1,51 @@
+import asyncio
+
+import httpx
+
+from grannymail.logger import logger
+
+REQUEST_TIMEOUT = 10
+# keep idle connections around long enough to be reused by the next message
+KEEPALIVE_EXPIRY = 60
+
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the HTTP client shared by all outgoing requests of the event loop.
+
+    Sharing the client keeps connections (and their TLS sessions) open between
+    requests instead of setting up a new connection pool for every message.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def warm_up(urls: list[str]) -> None:
+    """Opens a pooled connection to each of the hosts of the given urls."""
+    client = get_http_client()
+    responses = await asyncio.gather(
+        *[client.head(url) for url in urls], return_exceptions=True
+    )
+    for url, response in zip(urls, responses):
+        if isinstance(response, Exception):
+            logger.warning(f"Could not open connection to {url}: {response}")
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -2,24 +2,43 @@ import json
 import typing as t
 import uuid
 
-import httpx
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, ApplicationBuilder
 from telegram.ext._contexttypes import ContextTypes
 
 import grannymail.config as cfg
 import grannymail.constants as c
 import grannymail.domain.models as m
+from grannymail.integrations import http_client, rate_limiter
 from grannymail.services.unit_of_work import AbstractUnitOfWork
-from grannymail.utils import message_utils, utils
+from grannymail.logger import logger
+from grannymail.utils import media_cache, message_utils, utils
 
 from .base import AbstractMessenger
 
 
+T = t.TypeVar("T")
+
+
 class Telegram(AbstractMessenger):
     def _build_application(self) -> Application:
         return ApplicationBuilder().token(cfg.BOT_TOKEN).build()
 
+    async def _send(self, chat_id: int, send: t.Callable[[], t.Awaitable[T]]) -> T:
+        """Sends to a chat within Telegram's rate limits."""
+
+        async def call() -> T:
+            try:
+                return await send()
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                raise rate_limiter.RateLimited(float(retry_after))
+
+        return await rate_limiter.telegram_limiter.call(chat_id, call)
+
     def _get_message_type(self, update) -> tuple[c.types_message, str | None]:
         """
         Determines the type of message received in the update and extracts relevant information.
@@ -71,8 +90,8 @@ class Telegram(AbstractMessenger):
             bytes: The content of the downloaded file as a bytes object.
         """
         file = await context.bot.getFile(file_id)
-        async with httpx.AsyncClient() as client:
-            response = await client.get(file.file_path)  # type: ignore
+        client = http_client.get_http_client()
+        response = await client.get(file.file_path)  # type: ignore
         return response.content
 
     # async def _download_media_old(
@@ -233,7 +252,7 @@ class Telegram(AbstractMessenger):
 
         # Upload voice memo and add file record
         mime_type = "audio/ogg"
-        path = uow.files_blob.upload(voice_bytes, message.user_id, mime_type)
+        path = uow.files_blob.upload(voice_bytes, mime_type)
         file_record = m.File(
             file_id=str(uuid.uuid4()),
             message_id=message.message_id,
@@ -246,8 +265,10 @@ class Telegram(AbstractMessenger):
     async def reply_text(
         self, ref_message: m.TelegramMessage, message_body: str, uow: AbstractUnitOfWork
     ) -> m.TelegramMessage:
-        r = await self._build_application().bot.sendMessage(
-            chat_id=ref_message.tg_chat_id, text=message_body
+        bot = self._build_application().bot
+        r = await self._send(
+            ref_message.tg_chat_id,
+            lambda: bot.sendMessage(chat_id=ref_message.tg_chat_id, text=message_body),
         )
 
         response = m.TelegramMessage(
@@ -271,7 +292,10 @@ class Telegram(AbstractMessenger):
     async def reply_edit_or_text(
         self, ref_message: m.TelegramMessage, message_body: str, uow: AbstractUnitOfWork
     ) -> m.TelegramMessage:
-        r = await self.callback_query.edit_message_text(text=message_body)
+        r = await self._send(
+            ref_message.tg_chat_id,
+            lambda: self.callback_query.edit_message_text(text=message_body),
+        )
         response = m.TelegramMessage(
             message_id=str(uuid.uuid4()),
             timestamp=utils.get_utc_timestamp(),
@@ -298,9 +322,36 @@ class Telegram(AbstractMessenger):
         mime_type: str,
         uow: AbstractUnitOfWork,
     ) -> m.TelegramMessage:
-        r = await self._build_application().bot.sendDocument(
-            chat_id=ref_message.tg_chat_id, document=document_bytes, filename=filename
-        )
+        bot = self._build_application().bot
+        # a file_id refers to the document with its filename, so both make the key
+        key = media_cache.content_key(document_bytes, filename)
+        file_id = media_cache.telegram_file_ids.get(key)
+        r = None
+        if file_id is not None:
+            try:
+                r = await self._send(
+                    ref_message.tg_chat_id,
+                    lambda: bot.sendDocument(
+                        chat_id=ref_message.tg_chat_id, document=file_id
+                    ),
+                )
+            except BadRequest as e:
+                logger.warning(
+                    f"Cached file {file_id} was rejected, uploading again: {e}"
+                )
+                media_cache.telegram_file_ids.invalidate(key)
+        if r is None:
+            r = await self._send(
+                ref_message.tg_chat_id,
+                lambda: bot.sendDocument(
+                    chat_id=ref_message.tg_chat_id,
+                    document=document_bytes,
+                    filename=filename,
+                ),
+            )
+            assert r is not None
+            if r.document is not None:
+                media_cache.telegram_file_ids.set(key, r.document.file_id)
         response = m.TelegramMessage(
             message_id=str(uuid.uuid4()),
             timestamp=utils.get_utc_timestamp(),
@@ -356,10 +407,14 @@ class Telegram(AbstractMessenger):
         ]
 
         # send message
-        r = await self._build_application().bot.sendMessage(
-            chat_id=ref_message.tg_chat_id,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            text=main_msg,
+        bot = self._build_application().bot
+        r = await self._send(
+            ref_message.tg_chat_id,
+            lambda: bot.sendMessage(
+                chat_id=ref_message.tg_chat_id,
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                text=main_msg,
+            ),
         )
 
         response = m.TelegramMessage(
@@ -10,9 +10,16 @@ from tinytag import TinyTag  # mypy: ignore
 
 import grannymail.config as cfg
 import grannymail.domain.models as m
+from grannymail.integrations import http_client, rate_limiter
 from grannymail.integrations.messengers.base import AbstractMessenger
+from grannymail.services.delivery_tracker import delivery_tracker
 from grannymail.services.unit_of_work import AbstractUnitOfWork
-from grannymail.utils import message_utils, utils
+from grannymail.utils import media_cache, message_utils, utils
+
+
+# Graph API errors of a send whose media id is unknown or was deleted by WhatsApp
+MEDIA_ERROR_CODES = {131052, 131053}
+INVALID_PARAMETER_ERROR_CODE = 100
 
 
 class WebhookRequestData(BaseModel):
@@ -20,6 +27,73 @@ class WebhookRequestData(BaseModel):
     entry: list = []
 
 
+def is_invalid_media_error(e: httpx.HTTPStatusError) -> bool:
+    """Returns whether the Graph API rejected a send because its media id is invalid or
+    expired, as opposed to e.g. an invalid recipient or an outage."""
+    try:
+        error = e.response.json().get("error", {})
+    except ValueError:
+        return False
+    code = error.get("code")
+    if code in MEDIA_ERROR_CODES:
+        return True
+    # unknown media ids are rejected as an invalid parameter that names the media
+    details = error.get("error_data", {}).get("details", "")
+    description = f"{error.get('message', '')} {details}".lower()
+    return code == INVALID_PARAMETER_ERROR_CODE and "media" in description
+
+
+def split_webhook_messages(data: WebhookRequestData) -> list[WebhookRequestData]:
+    """
+    Splits a webhook delivery into one payload per message.
+
+    Meta may batch several entries, changes and messages into a single delivery, while
+    the rest of the code base expects exactly one message per payload. Every returned
+    payload keeps the metadata of its change and only the contact that sent the message.
+    Status updates are skipped.
+
+    Args:
+        data (WebhookRequestData): The webhook delivery.
+
+    Returns:
+        list[WebhookRequestData]: The payloads of all messages in delivery order.
+    """
+    payloads = []
+    for entry in data.entry:
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            contacts = value.get("contacts", [])
+            for message in value.get("messages", []):
+                contact = next(
+                    (c for c in contacts if c.get("wa_id") == message.get("from")),
+                    contacts[0] if contacts else {"wa_id": message.get("from")},
+                )
+                single_value = {k: v for k, v in value.items() if k != "statuses"}
+                single_value.update(contacts=[contact], messages=[message])
+                payloads.append(
+                    WebhookRequestData(
+                        object=data.object,
+                        entry=[
+                            {
+                                **entry,
+                                "changes": [{**change, "value": single_value}],
+                            }
+                        ],
+                    )
+                )
+    return payloads
+
+
+def get_webhook_statuses(payload: dict) -> list[dict]:
+    """Returns the status updates of all entries and changes of a webhook delivery."""
+    return [
+        status
+        for entry in payload.get("entry", [])
+        for change in entry.get("changes", [])
+        for status in change.get("value", {}).get("statuses", [])
+    ]
+
+
 def fastapi_verify(request: Request):
     """
     On webook verification VERIFY_TOKEN has to match the token at the
@@ -65,10 +139,20 @@ class Whatsapp(AbstractMessenger):
         headers = {"Authorization": f"Bearer {cfg.WHATSAPP_TOKEN}"}
         if data:
             headers["Content-Type"] = "application/json"
-        async with httpx.AsyncClient(timeout=10) as client:
+        client = http_client.get_http_client()
+
+        async def post():
             response = await client.post(url, json=data, headers=headers, files=files)
-            response.content
-            response.raise_for_status()
+            if response.status_code == 429:
+                raise rate_limiter.RateLimited(
+                    rate_limiter.retry_after_seconds(response.headers)
+                )
+            return response
+
+        # messages count towards the limits of their recipient, media uploads don't
+        recipient = data.get("to") if data else None
+        response = await rate_limiter.whatsapp_limiter.call(recipient, post)
+        response.raise_for_status()
 
         r = response.json()
         if data and (
@@ -100,14 +184,14 @@ class Whatsapp(AbstractMessenger):
         endpoint = f"https://graph.facebook.com/{self.WHATSAPP_API_VERSION}/{media_id}"
         headers = {"Authorization": f"Bearer {self.WHATSAPP_TOKEN}"}
 
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(url=endpoint, headers=headers)
-            response.raise_for_status()
-            download_url = response.json()["url"]
+        client = http_client.get_http_client()
+        response = await client.get(url=endpoint, headers=headers)
+        response.raise_for_status()
+        download_url = response.json()["url"]
 
-            response = await client.get(download_url, headers=headers)
-            response.raise_for_status()
-            return response.content
+        response = await client.get(download_url, headers=headers)
+        response.raise_for_status()
+        return response.content
 
     def _get_audio_duration(self, audio_bytes: bytes) -> float:
         """
@@ -286,9 +370,7 @@ class Whatsapp(AbstractMessenger):
 
         # Upload file bytes and add file record
         assert message.attachment_mime_type is not None
-        path = uow.files_blob.upload(
-            media_bytes, message.user_id, message.attachment_mime_type
-        )
+        path = uow.files_blob.upload(media_bytes, message.attachment_mime_type)
         file_record = m.File(
             file_id=str(uuid.uuid4()),
             message_id=message.message_id,
@@ -383,6 +465,7 @@ class Whatsapp(AbstractMessenger):
             response_to=ref_message.message_id,
             wa_mid=r["messages"][0]["id"],
         )
+        delivery_tracker.track_sent(response)
         return uow.wa_messages.add(response)
 
     async def reply_document(
@@ -405,16 +488,38 @@ class Whatsapp(AbstractMessenger):
         Returns:
             dict: The JSON content of the response from the WhatsApp API.
         """
-        media_id = (await self._upload_media(file_data, filename, mime_type))["id"]
-        data = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": ref_message.phone_number,
-            "type": "document",
-            "document": {"filename": filename, "id": media_id},
-        }
         endpoint = f"https://graph.facebook.com/{self.WHATSAPP_API_VERSION}/{self.WHATSAPP_PHONE_NUMBER_ID}/messages"
-        r = await self._post_httpx_request(url=endpoint, data=data)
+
+        async def send(media_id: str) -> dict:
+            data = {
+                "messaging_product": "whatsapp",
+                "recipient_type": "individual",
+                "to": ref_message.phone_number,
+                "type": "document",
+                "document": {"filename": filename, "id": media_id},
+            }
+            return await self._post_httpx_request(url=endpoint, data=data)
+
+        # the same document is only uploaded once while WhatsApp keeps the media
+        key = media_cache.content_key(file_data)
+        media_id = media_cache.whatsapp_media_ids.get(key)
+        r = None
+        if media_id is not None:
+            try:
+                r = await send(media_id)
+            except httpx.HTTPStatusError as e:
+                if not is_invalid_media_error(e):
+                    raise
+                logging.warning(
+                    f"Cached media {media_id} was rejected, uploading again: {e}"
+                )
+                media_cache.whatsapp_media_ids.invalidate(key)
+        if r is None:
+            upload = await self._upload_media(file_data, filename, mime_type)
+            uploaded_id: str = upload["id"]
+            media_cache.whatsapp_media_ids.set(key, uploaded_id)
+            r = await send(uploaded_id)
+            media_id = uploaded_id
         response = m.WhatsappMessage(
             message_id=str(uuid.uuid4()),
             timestamp=utils.get_utc_timestamp(),
@@ -430,6 +535,7 @@ class Whatsapp(AbstractMessenger):
             wa_mid=r["messages"][0]["id"],
             wa_media_id=media_id,
         )
+        delivery_tracker.track_sent(response)
         return uow.wa_messages.add(response)
 
     async def reply_buttons(
@@ -487,6 +593,7 @@ class Whatsapp(AbstractMessenger):
             response_to=ref_message.message_id,
             wa_mid=r["messages"][0]["id"],
         )
+        delivery_tracker.track_sent(response)
         return uow.wa_messages.add(response)
 
     async def reply_edit_or_text(
@@ -1,9 +1,14 @@
+import hashlib
+import json
+from functools import lru_cache
 from io import BytesIO
 from uuid import uuid4
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import inch, mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
 
 from grannymail.domain.models import Address
@@ -18,6 +23,8 @@ PAGE_NUMBER_OFFSET = 0.75 * inch
 DEFAULT_FONT = "Times-Roman"
 DEFAULT_FONT_SIZE = 11
 PARAGRAPH_SPACING = 4 * mm
+# bump when the layout changes, so that letters rendered before are rendered again
+TEMPLATE_VERSION = 1
 
 # Get the default style sheet
 styles = getSampleStyleSheet()
@@ -26,6 +33,52 @@ normal_style.fontName = DEFAULT_FONT
 normal_style.fontSize = DEFAULT_FONT_SIZE
 
 
+class GlyphCoverage:
+    """Index of all characters a ReportLab font can render.
+
+    The index is built once from the font itself: the cmap of TrueType fonts or the
+    encoding and glyph widths of the standard Type 1 fonts, including the fonts
+    ReportLab substitutes for characters missing in them (e.g. Symbol for Greek).
+    """
+
+    # characters that never end up as glyphs in the letter
+    ALWAYS_SUPPORTED = "\n\r"
+
+    def __init__(self, font_name: str):
+        self.font_name = font_name
+        font = pdfmetrics.getFont(font_name)
+        codepoints: set[int] = {ord(c) for c in self.ALWAYS_SUPPORTED}
+        for f in [font, *getattr(font, "substitutionFonts", [])]:
+            codepoints |= self._font_codepoints(f)
+        self.codepoints = frozenset(codepoints)
+        # used with str.translate to drop all supported characters in a single pass
+        self._deletion_table: dict[int, None] = dict.fromkeys(self.codepoints)
+
+    @staticmethod
+    def _font_codepoints(font) -> set[int]:
+        if isinstance(font, TTFont):
+            return set(font.face.charToGlyph.keys())
+        codec = font.encoding.name.replace("Encoding", "").lower()
+        codepoints = set()
+        for code, width in enumerate(font.widths):
+            if not width:
+                continue
+            try:
+                codepoints.add(ord(bytes([code]).decode(codec)))
+            except (UnicodeDecodeError, TypeError):
+                continue
+        return codepoints
+
+    def find_unsupported(self, text: str) -> set[str]:
+        """Returns all characters in the text the font can't render."""
+        return set(text.translate(self._deletion_table))
+
+
+@lru_cache(maxsize=None)
+def get_glyph_coverage(font_name: str = DEFAULT_FONT) -> GlyphCoverage:
+    return GlyphCoverage(font_name)
+
+
 def draw_address(canvas, address):
     """Draws the address on the canvas at the specified y_position."""
     address_lines = address.to_address_lines(include_country=False)
@@ -56,34 +109,62 @@ def my_later_pages(canvas, doc):
     canvas.restoreState()
 
 
-def create_letter_pdf_as_bytes(
-    input_text: str, address: Address | None = None
-) -> bytes:
-    """Generates a PDF letter from input text and optional address."""
-    # Create a file-like buffer to receive PDF data
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
+class LetterLayout:
+    """Lays out the paragraphs of a letter as they become available.
+
+    Parsing paragraphs into flowables can start while the letter text is still
+    being generated, so that only the final page build is left once the text is
+    complete.
+    """
 
-    # Create a list to hold the PDF elements
-    story = [Spacer(1, ADDRESS_Y_OFFSET + ADDRESS_TO_TEXT_GAP)]
+    def __init__(self):
+        self.story: list = [Spacer(1, ADDRESS_Y_OFFSET + ADDRESS_TO_TEXT_GAP)]
 
-    # Split the input text into paragraphs and add them to the story
-    for paragraph_text in input_text.split("\n"):
+    def add_paragraph(self, paragraph_text: str) -> None:
         paragraph = Paragraph(paragraph_text, normal_style)
-        story.extend([paragraph, Spacer(1, PARAGRAPH_SPACING)])
+        self.story.extend([paragraph, Spacer(1, PARAGRAPH_SPACING)])
 
-    # Build the PDF document
-    doc.build(
-        story,
-        onFirstPage=lambda canvas, doc: my_first_page(canvas, doc, address),
-        onLaterPages=my_later_pages,
-    )
+    def add_text(self, input_text: str) -> None:
+        """Splits the text into paragraphs and adds them to the letter."""
+        for paragraph_text in input_text.split("\n"):
+            self.add_paragraph(paragraph_text)
+
+    def build(self, address: Address | None = None) -> bytes:
+        """Builds the PDF from the paragraphs added so far."""
+        # Create a file-like buffer to receive PDF data
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4)
+
+        # Build the PDF document
+        doc.build(
+            list(self.story),
+            onFirstPage=lambda canvas, doc: my_first_page(canvas, doc, address),
+            onLaterPages=my_later_pages,
+        )
 
-    # Retrieve the PDF data and close the buffer
-    pdf_data = buffer.getvalue()
-    buffer.close()
+        # Retrieve the PDF data and close the buffer
+        pdf_data = buffer.getvalue()
+        buffer.close()
 
-    return pdf_data
+        return pdf_data
+
+
+def letter_render_key(input_text: str, address: Address | None = None) -> str:
+    """Returns a key that is the same for all letters that render identically."""
+    address_lines = None
+    if address is not None and address.is_complete_address():
+        address_lines = address.to_address_lines(include_country=False)
+    content = json.dumps([TEMPLATE_VERSION, input_text, address_lines])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def create_letter_pdf_as_bytes(
+    input_text: str, address: Address | None = None
+) -> bytes:
+    """Generates a PDF letter from input text and optional address."""
+    layout = LetterLayout()
+    layout.add_text(input_text)
+    return layout.build(address)
 
 
 def create_and_save_letter(
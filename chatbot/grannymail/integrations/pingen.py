@@ -1,12 +1,20 @@
 import datetime
 import json
 import logging
+import threading
 import uuid
 
 import requests
 
 import grannymail.config as cfg
 
+# seconds before the token expires at which it is renewed
+TOKEN_EXPIRY_MARGIN = 60
+
+# (endpoint, client_id, scopes) -> (access token, expiry)
+_tokens: dict[tuple, tuple[str, datetime.datetime]] = {}
+_token_lock = threading.Lock()
+
 
 class Pingen:
     """Class to handle the Pingen API
@@ -36,23 +44,25 @@ class Pingen:
         self.client_secret = client_secret
         self.organisation_uuid = organisation_uuid
         self.scopes = scopes
-        self.credentials_timeout = None
+        self.credentials_timeout: datetime.datetime | None = None
 
     def _get_token(self) -> str:
         """Quick way to either return the current token or to fetch a new one.
 
         Gets the token from the API. If the token is still valid, then it will return the current token. If the token is not valid, then it will fetch a new one.
+        Tokens are shared by all instances with the same credentials, so a new instance per letter does not fetch a new token.
 
         Returns:
             str: the bearer access token required for other requests. Needs to be concatenated to 'Bearer: token' for the header.
         """
-        # condition to check whether credentials are still valid, if true then nothing to do
-        if (
-            self.credentials_timeout is not None
-            and self.credentials_timeout > datetime.datetime.utcnow()
-        ):
-            return self.access_token
-        else:
+        cache_key = (self.endpoint, self.client_id, tuple(self.scopes))
+        with _token_lock:
+            # condition to check whether credentials are still valid, if true then nothing to do
+            cached = _tokens.get(cache_key)
+            if cached is not None and cached[1] > datetime.datetime.utcnow():
+                self.access_token, self.credentials_timeout = cached
+                return self.access_token
+
             endpoint_access = f"{self.endpoint}/auth/access-tokens"
             content = {"Content-Type": "application/x-www-form-urlencoded"}
             data = {
@@ -66,10 +76,12 @@ class Pingen:
             )
             assert response.status_code == 200, "Could not get credentials"
             response_dict = response.json()
-            self.timeout = datetime.datetime.utcnow() + datetime.timedelta(
-                seconds=response_dict["expires_in"]
+            # renew the token a bit before it expires so it doesn't expire mid-request
+            self.credentials_timeout = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=response_dict["expires_in"] - TOKEN_EXPIRY_MARGIN
             )
             self.access_token = response_dict["access_token"]
+            _tokens[cache_key] = (self.access_token, self.credentials_timeout)
             return self.access_token
 
     def _fetch_letter_upload_url(self) -> tuple[str, str]:
@@ -0,0 +1,219 @@
+import asyncio
+import contextlib
+import contextvars
+import enum
+import time
+import typing as t
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+from grannymail.logger import logger
+
+T = t.TypeVar("T")
+
+# seconds a bulk send waits before checking again whether interactive sends are done
+BULK_YIELD_INTERVAL = 0.05
+MAX_TRACKED_KEYS = 10_000
+MAX_RETRIES = 3
+# used if the platform asks us to slow down without saying for how long
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "send_priority", default=Priority.INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def priority(value: Priority) -> t.Iterator[None]:
+    """Sends made within the context (and the tasks it creates) use the priority,
+    e.g. broadcasts send with `Priority.BULK` so that replies to users go first."""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average and bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_available(self, now: float) -> float:
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+@dataclass
+class RateLimiterStats:
+    sends: int = 0
+    bulk_sends: int = 0
+    delayed_sends: int = 0
+    # seconds spent waiting for tokens, summed over all sends
+    total_wait: float = 0.0
+    retry_afters: int = 0
+
+    def as_dict(self) -> dict[str, t.Any]:
+        return asdict(self)
+
+
+class RateLimited(Exception):
+    """Raised by a send that the platform rejected because of its rate limits."""
+
+    def __init__(self, retry_after: float | None = None):
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+
+
+class RateLimiter:
+    """Limits the outbound sends to a platform globally and per chat.
+
+    Every send takes a token from the global bucket and from the bucket of its chat.
+    Bulk sends only take a global token while no interactive send is waiting for one,
+    so replies to users are not queued behind broadcasts. Interactive sends that wait
+    for their chat's bucket or a pause don't hold bulk sends back. When the platform responds
+    with a Retry-After, the chat (or the whole platform) is paused for that long.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        global_rate: float,
+        global_burst: float,
+        per_key_rate: float,
+        per_key_burst: float,
+    ):
+        self.name = name
+        self.per_key_rate = per_key_rate
+        self.per_key_burst = per_key_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._keys: OrderedDict[t.Hashable, TokenBucket] = OrderedDict()
+        self._blocked_until: dict[t.Hashable | None, float] = {}
+        # interactive sends that wait for a token of the global bucket
+        self._waiting_global = 0
+        self.stats = RateLimiterStats()
+
+    def _key_bucket(self, key: t.Hashable) -> TokenBucket:
+        bucket = self._keys.pop(key, None)
+        if bucket is None:
+            bucket = TokenBucket(self.per_key_rate, self.per_key_burst)
+        self._keys[key] = bucket
+        if len(self._keys) > MAX_TRACKED_KEYS:
+            # the least recently used bucket is full again by now
+            self._keys.popitem(last=False)
+        return bucket
+
+    def _time_until_allowed(
+        self, key: t.Hashable | None, prio: Priority
+    ) -> tuple[float, bool]:
+        """Takes the tokens and returns 0 if the send is allowed, otherwise returns
+        the seconds to wait before trying again. Also returns whether the send only
+        waits for the global bucket."""
+        now = time.monotonic()
+        blocked = max(self._blocked_until.get(None, 0), self._blocked_until.get(key, 0))
+        if blocked > now:
+            return blocked - now, False
+        if prio == Priority.BULK and self._waiting_global:
+            return BULK_YIELD_INTERVAL, False
+        key_bucket = self._key_bucket(key) if key is not None else None
+        if key_bucket is not None and (wait := key_bucket.time_until_available(now)):
+            return wait, False
+        if wait := self._global.time_until_available(now):
+            return wait, True
+        self._global.take()
+        if key_bucket is not None:
+            key_bucket.take()
+        return 0, False
+
+    async def acquire(self, key: t.Hashable | None = None) -> None:
+        """Waits until a send to the chat `key` is allowed. Sends without a chat, e.g.
+        media uploads, only count towards the global limit."""
+        prio = _priority.get()
+        start = time.monotonic()
+        delayed = False
+        waiting_global = False
+        try:
+            while True:
+                wait, on_global = self._time_until_allowed(key, prio)
+                if prio == Priority.INTERACTIVE and on_global != waiting_global:
+                    self._waiting_global += 1 if on_global else -1
+                    waiting_global = on_global
+                if wait <= 0:
+                    break
+                delayed = True
+                await asyncio.sleep(wait)
+        finally:
+            if waiting_global:
+                self._waiting_global -= 1
+        self.stats.sends += 1
+        self.stats.bulk_sends += prio == Priority.BULK
+        if delayed:
+            self.stats.delayed_sends += 1
+            self.stats.total_wait += time.monotonic() - start
+
+    def block(self, seconds: float, key: t.Hashable | None = None) -> None:
+        """Pauses all sends to the chat `key`, or to the platform if key is None."""
+        now = time.monotonic()
+        # drops the pauses that are over, so chats that were paused once don't pile up
+        self._blocked_until = {k: v for k, v in self._blocked_until.items() if v > now}
+        self._blocked_until[key] = max(self._blocked_until.get(key, 0), now + seconds)
+        self.stats.retry_afters += 1
+        logger.warning(f"{self.name}: rate limited, pausing {key or 'all'} {seconds}s")
+
+    async def call(
+        self,
+        key: t.Hashable | None,
+        send: t.Callable[[], t.Awaitable[T]],
+        max_retries: int = MAX_RETRIES,
+    ) -> T:
+        """Sends once allowed and retries sends that the platform rate limited."""
+        for attempt in range(max_retries + 1):
+            await self.acquire(key)
+            try:
+                return await send()
+            except RateLimited as e:
+                if attempt == max_retries:
+                    raise
+                self.block(e.retry_after or DEFAULT_RETRY_AFTER, key)
+        raise AssertionError("unreachable")
+
+
+def retry_after_seconds(headers: t.Mapping[str, str]) -> float | None:
+    """Parses the Retry-After header of a response given in seconds."""
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Telegram allows about 30 messages per second overall and one per second per chat,
+# short bursts within a chat are tolerated
+telegram_limiter = RateLimiter(
+    "telegram", global_rate=30, global_burst=30, per_key_rate=1, per_key_burst=3
+)
+# WhatsApp's default throughput is 80 messages per second per business number, and a
+# user can receive about one message every 6 seconds with bursts of up to 45
+whatsapp_limiter = RateLimiter(
+    "whatsapp", global_rate=80, global_burst=80, per_key_rate=1 / 6, per_key_burst=45
+)
+limiters = [telegram_limiter, whatsapp_limiter]
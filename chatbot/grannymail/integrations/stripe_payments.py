@@ -1,13 +1,19 @@
+import asyncio
+import threading
 import typing as t
 
-import stripe
-
 import grannymail.config as cfg
 import grannymail.domain.models as m
 from grannymail.logger import logger
 from grannymail.services.unit_of_work import AbstractUnitOfWork
+from grannymail.utils.lazy import lazy_import
+
+
+def _configure_stripe(module) -> None:
+    module.api_key = cfg.STRIPE_API_KEY
 
-stripe.api_key = cfg.STRIPE_API_KEY
+
+stripe = lazy_import("stripe", on_load=_configure_stripe)
 
 
 def get_formatted_stripe_link(num_credits: int, client_reference_id: str) -> str:
@@ -69,13 +75,7 @@ def handle_event(
     if payment_link_id is None:
         raise ValueError("No payment link found in checkout info")
     order = uow.orders.get_one(client_reference_id)
-    credits_bought = _get_credits_bought(payment_link_id)
-
-    # update user's number of credits
-    user = uow.users.get_one(order.user_id)
-    user.num_letter_credits += credits_bought
-    user = uow.users.update(user)
-    logger.info(f"Payment received for {credits_bought} credit(s) by user: {user}")
+    credits_bought = catalog.get_credits(payment_link_id)
 
     # get original message - we don't know what the platform is, so we need to check first and retrieve a second time
     # this could/should be edited in the uow repository but this is the only occurrence in the codebase so far.
@@ -90,38 +90,131 @@ def handle_event(
             f"Unsupported message platform: {og_message_base.messaging_platform}"
         )
 
-    # dispatch letter
-    was_dispatched = order.dispatch(uow)
+    # add the credits bought and dispatch the letter in one atomic call, retries of
+    # the event don't add the credits again
+    was_dispatched, num_letter_credits = order.dispatch(
+        uow, credits_added=credits_bought, stripe_event_id=stripe_event["id"]
+    )
+    logger.info(
+        f"Payment received for {credits_bought} credit(s) by user: {order.user_id}"
+    )
 
-    if was_dispatched:
-        user.num_letter_credits -= 1
-        user = uow.users.update(user)
     # return the messaging platform of the original request and the number of credits
-    return was_dispatched, og_message, credits_bought, user.num_letter_credits
+    return was_dispatched, og_message, credits_bought, num_letter_credits
 
 
-def _get_credits_bought(payment_link_id: str) -> int:
+class StripeCatalog:
     """
-    Retrieves the number of credits bought through a payment link.
-
-    Args:
-        payment_link_id (str): The payment link ID from which to retrieve the credits bought.
+    Caches the products of our payment links and the letter credits they grant.
 
-    Returns:
-        int: The total number of credits bought.
+    Resolving the credits of a payment link requires listing its line items and
+    retrieving every product, which are blocking requests to Stripe. The catalog is
+    warmed with the configured payment links at startup, refreshed periodically and
+    on `product.updated` events, so that the webhook can resolve credits without any
+    round-trips to Stripe.
     """
-    logger.info("Payment link used to retrieve credits: " + payment_link_id)
-    items_bought = stripe.PaymentLink.list_line_items(payment_link_id)["data"]
-    total_credits = 0
-    for item in items_bought:
-        item_dict = t.cast(dict[str, t.Any], item)
-        product_id = item_dict["price"]["product"]
-        product = stripe.Product.retrieve(product_id)
-        letter_credits = product["metadata"]["letter_credits"]
-        total_credits += int(letter_credits)
-    return total_credits
+
+    def __init__(self, payment_link_urls: list[str]):
+        self.payment_link_urls = payment_link_urls
+        self._lock = threading.Lock()
+        # payment link id -> product ids of its line items
+        self._link_products: dict[str, list[str]] = {}
+        # product id -> letter credits
+        self._product_credits: dict[str, int] = {}
+
+    @staticmethod
+    def _credits_of_product(product: t.Mapping[str, t.Any]) -> int:
+        return int(product["metadata"]["letter_credits"])
+
+    def _fetch_link_products(self, payment_link_id: str) -> list[str]:
+        items_bought = stripe.PaymentLink.list_line_items(payment_link_id)["data"]
+        return [
+            t.cast(dict[str, t.Any], item)["price"]["product"] for item in items_bought
+        ]
+
+    def _fetch_product_credits(self, product_ids: t.Iterable[str]) -> dict[str, int]:
+        return {
+            product_id: self._credits_of_product(stripe.Product.retrieve(product_id))
+            for product_id in set(product_ids)
+        }
+
+    def warm(self) -> None:
+        """(Re-)loads the products of all configured payment links from Stripe."""
+        link_products: dict[str, list[str]] = {}
+        for link in stripe.PaymentLink.list(active=True, limit=100).auto_paging_iter():
+            if link["url"] in self.payment_link_urls:
+                link_products[link["id"]] = self._fetch_link_products(link["id"])
+        product_credits = self._fetch_product_credits(
+            [p for products in link_products.values() for p in products]
+        )
+        with self._lock:
+            self._link_products.update(link_products)
+            self._product_credits.update(product_credits)
+        logger.info(
+            f"Stripe catalog warmed with {len(link_products)} payment links and {len(product_credits)} products"
+        )
+
+    def handle_event(self, stripe_event: t.Mapping[str, t.Any]) -> None:
+        """Updates the catalog from a product or payment link event."""
+        stripe_object = stripe_event["data"]["object"]
+        if stripe_event["type"] == "product.updated":
+            if "letter_credits" not in stripe_object.get("metadata", {}):
+                return
+            with self._lock:
+                self._product_credits[stripe_object["id"]] = self._credits_of_product(
+                    stripe_object
+                )
+        elif stripe_event["type"] == "payment_link.updated":
+            with self._lock:
+                self._link_products.pop(stripe_object["id"], None)
+            self.get_credits(stripe_object["id"])
+        else:
+            raise ValueError(f"Invalid catalog event type: {stripe_event['type']}")
+
+    def get_credits(self, payment_link_id: str) -> int:
+        """Returns the letter credits granted by a payment link.
+
+        Payment links missing from the catalog are fetched from Stripe and cached.
+        """
+        with self._lock:
+            product_ids = self._link_products.get(payment_link_id)
+            if product_ids is not None and all(
+                p in self._product_credits for p in product_ids
+            ):
+                return sum(self._product_credits[p] for p in product_ids)
+
+        logger.info(f"Stripe catalog miss for payment link: {payment_link_id}")
+        product_ids = self._fetch_link_products(payment_link_id)
+        with self._lock:
+            missing = [p for p in product_ids if p not in self._product_credits]
+        product_credits = self._fetch_product_credits(missing)
+        with self._lock:
+            self._link_products[payment_link_id] = product_ids
+            self._product_credits.update(product_credits)
+            return sum(self._product_credits[p] for p in product_ids)
+
+
+catalog = StripeCatalog(
+    [
+        cfg.STRIPE_LINK_SINGLE_PAYMENT,
+        cfg.STRIPE_LINK_5_CREDITS,
+        cfg.STRIPE_LINK_10_CREDITS,
+    ]
+)
+CATALOG_EVENT_TYPES = ["product.updated", "payment_link.updated"]
+CATALOG_REFRESH_INTERVAL = 60 * 60
+
+
+async def keep_catalog_warm(interval: float = CATALOG_REFRESH_INTERVAL) -> None:
+    """Warms the catalog and refreshes it periodically in the background."""
+    while True:
+        try:
+            await asyncio.to_thread(catalog.warm)
+        except Exception as e:
+            logger.error(f"Failed to refresh Stripe catalog: {e}")
+        await asyncio.sleep(interval)
 
 
 if __name__ == "__main__":
     plink = "plink_1Oo9zHLuDIWxSZxaQAbFlPrQ"
-    print(_get_credits_bought(plink))
+    print(catalog.get_credits(plink))
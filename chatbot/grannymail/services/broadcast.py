@@ -0,0 +1,213 @@
+import asyncio
+import os
+import socket
+import time
+import typing as t
+import uuid
+
+import grannymail.domain.models as m
+from grannymail.integrations import rate_limiter
+from grannymail.integrations.messengers import telegram, whatsapp
+from grannymail.integrations.messengers.base import AbstractMessenger
+from grannymail.logger import logger
+from grannymail.services.unit_of_work import AbstractUnitOfWork
+from grannymail.utils import utils
+
+PAGE_SIZE = 200
+# messages that are sent at the same time, the rate limiters of the platforms bound
+# the throughput further
+CONCURRENCY = 20
+# seconds a worker claims a broadcast for, the claim is renewed after every page
+CLAIM_LEASE = 5 * 60
+
+Recipient = tuple[m.User, m.WhatsappMessage | m.TelegramMessage]
+
+
+class BroadcastClaimedError(Exception):
+    """Raised if a broadcast is run by another worker."""
+
+
+def render(template: str, user: m.User) -> str:
+    """Fills the placeholders `{first_name}` and `{last_name}` of a broadcast."""
+    return template.format(
+        first_name=user.first_name or "", last_name=user.last_name or ""
+    )
+
+
+class Broadcaster:
+    """Sends a system message to every user who can be reached.
+
+    Users are streamed in pages ordered by their id, and the next page is fetched while
+    the current one is sent. Sends run concurrently with bulk priority, so the rate
+    limiters of the platforms let replies to users go first. The broadcast row records
+    the last user of every page that was sent, so a broadcast that was interrupted
+    resumes after it and re-sends at most one page.
+
+    Broadcasts run in the server process, started through the broadcast endpoint, as
+    the rate limiters only see the sends of their own process. A broadcast is claimed
+    with a job lease while it runs, so that it runs on only one worker at a time.
+
+    WhatsApp only delivers free-form messages to users who wrote to us within the last
+    24 hours, sends to other users are counted as failed.
+    """
+
+    def __init__(
+        self,
+        uow_factory: t.Callable[[], AbstractUnitOfWork],
+        page_size: int = PAGE_SIZE,
+        concurrency: int = CONCURRENCY,
+    ):
+        self.uow_factory = uow_factory
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def get_lease_name(broadcast_id: str) -> str:
+        return f"broadcast:{broadcast_id}"
+
+    def claim(self, broadcast_id: str) -> bool:
+        """Claims the broadcast for `CLAIM_LEASE` seconds, or renews the claim if this
+        broadcaster has it already. Returns whether the broadcast is claimed."""
+        lease_name = self.get_lease_name(broadcast_id)
+        with self.uow_factory() as uow:
+            return uow.job_leases.try_acquire(
+                lease_name, self.holder, CLAIM_LEASE
+            ) or uow.job_leases.renew(lease_name, self.holder, CLAIM_LEASE)
+
+    def release(self, broadcast_id: str) -> None:
+        # a lease that expires now can be acquired right away
+        with self.uow_factory() as uow:
+            uow.job_leases.renew(self.get_lease_name(broadcast_id), self.holder, 0)
+
+    def get_messenger(self, platform: str) -> AbstractMessenger:
+        if platform == "WhatsApp":
+            return whatsapp.Whatsapp()
+        elif platform == "Telegram":
+            return telegram.Telegram()
+        raise ValueError(f"Unsupported message platform: {platform}")
+
+    def get_template(self, message_identifier: str) -> str:
+        with self.uow_factory() as uow:
+            return uow.system_messages.get_msg(message_identifier)
+
+    def get_or_create(self, broadcast_id: str, message_identifier: str) -> m.Broadcast:
+        with self.uow_factory() as uow:
+            broadcast = uow.broadcasts.maybe_get_one(broadcast_id)
+            if broadcast is None:
+                now = utils.get_utc_timestamp()
+                broadcast = uow.broadcasts.add(
+                    m.Broadcast(
+                        broadcast_id=broadcast_id,
+                        message_identifier=message_identifier,
+                        created_at=now,
+                        updated_at=now,
+                    )
+                )
+                uow.commit()
+        if broadcast.message_identifier != message_identifier:
+            raise ValueError(
+                f"Broadcast {broadcast_id} sends '{broadcast.message_identifier}', not '{message_identifier}'"
+            )
+        return broadcast
+
+    def get_recipients(self, after_user_id: str | None) -> list[Recipient]:
+        with self.uow_factory() as uow:
+            return uow.broadcasts.get_recipients(after_user_id, self.page_size)
+
+    def checkpoint(self, broadcast: m.Broadcast) -> None:
+        broadcast.updated_at = utils.get_utc_timestamp()
+        with self.uow_factory() as uow:
+            uow.broadcasts.update(broadcast)
+            uow.commit()
+
+    async def send(self, recipient: Recipient, template: str) -> bool:
+        """Sends the broadcast to a user. Returns whether it was sent."""
+        user, ref_message = recipient
+        try:
+            messenger = self.get_messenger(ref_message.messaging_platform)
+            with self.uow_factory() as uow:
+                await messenger.reply_text(ref_message, render(template, user), uow)
+                uow.commit()
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to send broadcast to user {user.user_id}: {e}")
+            return False
+
+    async def send_page(self, recipients: list[Recipient], template: str) -> int:
+        """Sends the broadcast to a page of users. Returns the number of sends that
+        succeeded."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(recipient: Recipient) -> bool:
+            async with semaphore:
+                return await self.send(recipient, template)
+
+        with rate_limiter.priority(rate_limiter.Priority.BULK):
+            results = await asyncio.gather(*[send(x) for x in recipients])
+        return sum(results)
+
+    async def run(self, broadcast_id: str, message_identifier: str) -> m.Broadcast:
+        """Runs a broadcast until every user was sent to, resuming it if it was
+        started before.
+
+        Raises:
+            BroadcastClaimedError: If the broadcast is run by another worker.
+        """
+        if not await asyncio.to_thread(self.claim, broadcast_id):
+            raise BroadcastClaimedError(f"Broadcast {broadcast_id} is already running")
+        try:
+            return await self._run(broadcast_id, message_identifier)
+        finally:
+            await asyncio.to_thread(self.release, broadcast_id)
+
+    async def _run(self, broadcast_id: str, message_identifier: str) -> m.Broadcast:
+        template = await asyncio.to_thread(self.get_template, message_identifier)
+        # fail before sending anything if the template has unknown placeholders
+        render(template, m.User(user_id="", created_at=""))
+        broadcast = await asyncio.to_thread(
+            self.get_or_create, broadcast_id, message_identifier
+        )
+        if broadcast.status == "completed":
+            logger.info(f"Broadcast {broadcast_id} was already completed")
+            return broadcast
+        logger.info(
+            f"Starting broadcast {broadcast_id} after user {broadcast.last_user_id}"
+        )
+
+        start = time.monotonic()
+        num_attempted = 0
+        recipients = await asyncio.to_thread(
+            self.get_recipients, broadcast.last_user_id
+        )
+        while recipients:
+            last_user_id = recipients[-1][0].user_id
+            next_page = asyncio.create_task(
+                asyncio.to_thread(self.get_recipients, last_user_id)
+            )
+            num_sent = await self.send_page(recipients, template)
+
+            num_attempted += len(recipients)
+            broadcast.num_sent += num_sent
+            broadcast.num_failed += len(recipients) - num_sent
+            broadcast.last_user_id = last_user_id
+            await asyncio.to_thread(self.checkpoint, broadcast)
+            if not await asyncio.to_thread(self.claim, broadcast_id):
+                next_page.cancel()
+                raise BroadcastClaimedError(
+                    f"Broadcast {broadcast_id} was claimed by another worker"
+                )
+            elapsed = time.monotonic() - start
+            logger.info(
+                f"Broadcast {broadcast_id}: {broadcast.num_sent} sent, {broadcast.num_failed} failed, "
+                f"{num_attempted / elapsed:.1f} messages/s"
+            )
+            recipients = await next_page
+
+        broadcast.status = "completed"
+        broadcast.completed_at = utils.get_utc_timestamp()
+        await asyncio.to_thread(self.checkpoint, broadcast)
+        logger.info(
+            f"Completed broadcast {broadcast_id} in {time.monotonic() - start:.0f}s"
+        )
+        return broadcast
@@ -0,0 +1,217 @@
+import asyncio
+import bisect
+import typing as t
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import grannymail.domain.models as m
+from grannymail.logger import logger
+from grannymail.services.unit_of_work import AbstractUnitOfWork
+from grannymail.utils import utils
+
+# upper bounds of the latency buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 5 * 60, 30 * 60, float("inf"))
+TRACKED_STATUSES = ("sent", "delivered", "read", "failed")
+
+
+def _parse_timestamp(timestamp: str) -> datetime:
+    """Parses our ISO timestamps, which are in UTC even if they carry no offset."""
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class LatencyHistogram:
+    """Counts latencies in fixed buckets so that percentiles can be read cheaply."""
+
+    def __init__(self, buckets: t.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+
+    def observe(self, latency: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, latency)] += 1
+        self.total += 1
+
+    def percentile(self, q: float) -> float | None:
+        """Returns the upper bound of the bucket holding the q-th percentile or None
+        if nothing was observed yet."""
+        if self.total == 0:
+            return None
+        rank = q / 100 * self.total
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def as_dict(self) -> dict[str, t.Any]:
+        return {
+            "total": self.total,
+            "buckets": {
+                f"le_{bound:g}": count
+                for bound, count in zip(self.buckets, self.counts)
+            },
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class DeliveryTracker:
+    """Correlates WhatsApp status callbacks with the messages we sent.
+
+    Sent messages are kept in a bounded in-memory index keyed by their WhatsApp
+    message id. Status callbacks are only buffered when they arrive, so acknowledging
+    them stays cheap. Flushing resolves the messages of the buffered statuses, looking
+    up the ones that were sent by another worker in a single query, records the
+    delivery latencies in histograms and writes all statuses in one request.
+    """
+
+    def __init__(self, max_tracked_messages: int = 10_000, max_buffered: int = 5_000):
+        self.max_tracked_messages = max_tracked_messages
+        self.max_buffered = max_buffered
+        # wa_mid -> (message_id, sent timestamp)
+        self._sent: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._buffer: dict[tuple[str, str], m.DeliveryStatus] = {}
+        self.histograms = {
+            status: LatencyHistogram() for status in ("delivered", "read")
+        }
+        self.counts = {status: 0 for status in TRACKED_STATUSES}
+        self.num_dropped = 0
+
+    def __len__(self) -> int:
+        """Returns the number of buffered statuses."""
+        return len(self._buffer)
+
+    def track_sent(self, message: m.WhatsappMessage) -> None:
+        if message.wa_mid is None:
+            return
+        self._sent[message.wa_mid] = (message.message_id, message.timestamp)
+        if len(self._sent) > self.max_tracked_messages:
+            self._sent.popitem(last=False)
+
+    def record(self, wa_status: dict[str, t.Any]) -> None:
+        """Buffers a status object of a WhatsApp webhook delivery."""
+        status = wa_status.get("status")
+        if status not in TRACKED_STATUSES:
+            return
+        key = (wa_status["id"], status)
+        if key in self._buffer:
+            # WhatsApp retries callbacks
+            return
+        if len(self._buffer) >= self.max_buffered:
+            self.num_dropped += 1
+            return
+        errors = wa_status.get("errors")
+        self._buffer[key] = m.DeliveryStatus(
+            status_id=str(uuid.uuid4()),
+            wa_mid=wa_status["id"],
+            status=status,
+            status_timestamp=datetime.fromtimestamp(
+                int(wa_status["timestamp"]), timezone.utc
+            ).isoformat(),
+            received_at=utils.get_utc_timestamp(),
+            error=str(errors) if errors else None,
+        )
+
+    def drain(self) -> tuple[list[m.DeliveryStatus], dict[str, tuple[str, str]]]:
+        """Empties the buffer. Returns the buffered statuses and the sent messages
+        they refer to that are in the index."""
+        statuses = list(self._buffer.values())
+        self._buffer = {}
+        sent = {
+            x.wa_mid: self._sent[x.wa_mid] for x in statuses if x.wa_mid in self._sent
+        }
+        return statuses, sent
+
+    def requeue(self, statuses: list[m.DeliveryStatus]) -> None:
+        """Puts drained statuses that could not be written back into the buffer. Statuses
+        that don't fit into it anymore are dropped."""
+        for status in statuses:
+            key = (status.wa_mid, status.status)
+            if key in self._buffer:
+                continue
+            if len(self._buffer) >= self.max_buffered:
+                self.num_dropped += 1
+                continue
+            self._buffer[key] = status
+
+    def write(
+        self,
+        statuses: list[m.DeliveryStatus],
+        sent: dict[str, tuple[str, str]],
+        uow: AbstractUnitOfWork,
+    ) -> int:
+        """Writes drained statuses and records their latencies once they were written.
+        Doesn't touch the buffer or the index, so it can run in a thread. Returns the
+        number of statuses written."""
+        if not statuses:
+            return 0
+        missing = list({x.wa_mid for x in statuses if x.wa_mid not in sent})
+        sent = {**uow.delivery_statuses.get_sent_messages(missing), **sent}
+        for status in statuses:
+            if status.wa_mid not in sent:
+                continue
+            status.message_id, sent_at = sent[status.wa_mid]
+            status.latency_seconds = max(
+                0.0,
+                (
+                    _parse_timestamp(status.status_timestamp)
+                    - _parse_timestamp(sent_at)
+                ).total_seconds(),
+            )
+
+        uow.delivery_statuses.add_many(statuses)
+
+        # counted after the write, so that statuses that are written again after a
+        # failed flush are only counted once
+        for status in statuses:
+            self.counts[status.status] += 1
+            if status.status == "failed":
+                logger.error(
+                    f"WhatsApp message {status.wa_mid} failed to deliver: {status.error}"
+                )
+            if status.latency_seconds is not None and status.status in self.histograms:
+                self.histograms[status.status].observe(status.latency_seconds)
+        return len(statuses)
+
+    def flush(self, uow: AbstractUnitOfWork) -> int:
+        """Writes the buffered statuses. Returns the number of statuses written."""
+        return self.write(*self.drain(), uow)
+
+    def stats(self) -> dict[str, t.Any]:
+        return {
+            "counts": self.counts,
+            "buffered": len(self),
+            "dropped": self.num_dropped,
+            "latency_seconds": {
+                status: histogram.as_dict()
+                for status, histogram in self.histograms.items()
+            },
+        }
+
+    async def flush_forever(
+        self,
+        uow_factory: t.Callable[[], AbstractUnitOfWork],
+        interval: float,
+    ) -> None:
+        """Flushes the buffer periodically in the background. Statuses of a flush that
+        failed are buffered again and written with the next one."""
+        while True:
+            await asyncio.sleep(interval)
+            statuses, sent = self.drain()
+            if not statuses:
+                continue
+            try:
+                with uow_factory() as uow:
+                    await asyncio.to_thread(self.write, statuses, sent, uow)
+                    uow.commit()
+            except Exception as e:
+                logger.error(f"Failed to flush delivery statuses: {e}")
+                self.requeue(statuses)
+
+
+delivery_tracker = DeliveryTracker()
@@ -0,0 +1,132 @@
+import asyncio
+import typing as t
+from dataclasses import dataclass, field
+
+from grannymail.logger import logger
+
+Job = t.Callable[[], t.Awaitable[t.Any]]
+
+
+class MailboxFullError(Exception):
+    pass
+
+
+@dataclass
+class _Mailbox:
+    queue: asyncio.Queue[Job]
+    # set whenever a job is submitted, so an idle worker can wake up
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+    worker: asyncio.Task | None = None
+
+
+class KeyedExecutor:
+    """Runs jobs concurrently across keys but strictly in order within a key.
+
+    Every key gets a mailbox, a FIFO queue that is drained by its own worker task, so
+    jobs of the same key (e.g. the messages of one user) never overtake each other
+    while jobs of different keys run in parallel. A semaphore caps the number of jobs
+    that run at the same time across all keys.
+
+    Mailboxes hold at most `max_mailbox_size` pending jobs and are evicted once their
+    worker has been idle for `idle_timeout` seconds, so only recently active keys
+    hold any state.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_mailbox_size: int = 0,
+        idle_timeout: float = 0,
+    ):
+        self.name = name
+        self.max_mailbox_size = max_mailbox_size
+        self.idle_timeout = idle_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._mailboxes: dict[t.Hashable, _Mailbox] = {}
+        # number of submitted jobs that are not done yet
+        self._pending = 0
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+
+    def __len__(self) -> int:
+        """Returns the number of keys with a live mailbox."""
+        return len(self._mailboxes)
+
+    def submit(self, key: t.Hashable, job: Job) -> None:
+        """Enqueues a job behind all jobs submitted earlier for the same key.
+
+        Raises:
+            MailboxFullError: If the key already has `max_mailbox_size` pending jobs.
+        """
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            mailbox = _Mailbox(asyncio.Queue(self.max_mailbox_size))
+            self._mailboxes[key] = mailbox
+        try:
+            mailbox.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise MailboxFullError(f"{self.name}: mailbox of key {key} is full")
+        self._job_added()
+        mailbox.wakeup.set()
+        if mailbox.worker is None:
+            mailbox.worker = asyncio.create_task(self._work(key, mailbox))
+
+    async def _work(self, key: t.Hashable, mailbox: _Mailbox) -> None:
+        try:
+            while True:
+                while not mailbox.queue.empty():
+                    job = mailbox.queue.get_nowait()
+                    try:
+                        async with self._semaphore:
+                            await job()
+                    except Exception as e:
+                        logger.error(f"{self.name}: job for key {key} failed: {e}")
+                    finally:
+                        self._jobs_done(1)
+                if not await self._wait_for_job(mailbox):
+                    break
+        finally:
+            # no await between the empty check and the eviction, so no job can be
+            # submitted to a mailbox whose worker is about to exit
+            del self._mailboxes[key]
+            # jobs that are left over when the worker was cancelled are dropped
+            self._jobs_done(mailbox.queue.qsize())
+
+    def _job_added(self) -> None:
+        self._pending += 1
+        self._all_done.clear()
+
+    def _jobs_done(self, num_jobs: int) -> None:
+        self._pending -= num_jobs
+        if self._pending == 0:
+            self._all_done.set()
+
+    async def _wait_for_job(self, mailbox: _Mailbox) -> bool:
+        """Waits for a new job up to the idle timeout. Returns False if none came."""
+        if self.idle_timeout <= 0:
+            return not mailbox.queue.empty()
+        mailbox.wakeup.clear()
+        try:
+            await asyncio.wait_for(mailbox.wakeup.wait(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            pass
+        return not mailbox.queue.empty()
+
+    def _workers(self) -> list[asyncio.Task]:
+        return [m.worker for m in self._mailboxes.values() if m.worker is not None]
+
+    async def join(self) -> None:
+        """Waits until all submitted jobs are done."""
+        await self._all_done.wait()
+
+    async def shutdown(self, timeout: float | None = None) -> None:
+        """Waits for pending jobs up to the timeout and cancels all workers."""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name}: cancelling {len(self)} unfinished workers")
+        workers = self._workers()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -2,15 +2,19 @@ import uuid
 from difflib import get_close_matches
 
 import grannymail.domain.models as m
-import grannymail.integrations.pdf_gen as pdf_gen
 import grannymail.integrations.stripe_payments as stripe_payments
 import grannymail.utils.message_utils as msg_utils
 from grannymail.domain import models as m
 from grannymail.integrations.messengers import telegram, whatsapp
 from grannymail.integrations.messengers.base import AbstractMessenger
 from grannymail.logger import logger
+from grannymail.services import outbox
+from grannymail.services.render_cache import render_cache
 from grannymail.services.unit_of_work import AbstractUnitOfWork
 from grannymail.utils import utils
+from grannymail.utils.lazy import lazy_import
+
+pdf_gen = lazy_import("grannymail.integrations.pdf_gen")
 
 
 class NoTranscriptFound(Exception):
@@ -19,6 +23,15 @@ class NoTranscriptFound(Exception):
 
 
 class MessageProcessingService:
+    """Routes incoming messages to the handler of their command.
+
+    Text replies are added to the outbox, which sends them right after they were
+    enqueued and retries them if the platform is unavailable. Documents, buttons and
+    edits are sent inline, as their message ids are needed for callbacks. Texts that
+    precede a document of the same reply, e.g. the confirmation that a voice memo is
+    being processed, are sent inline as well, so that they can't arrive after it.
+    """
+
     def __init__(self):
         self.command_handlers = [
             method for method in dir(self) if method.startswith("handle_")
@@ -58,7 +71,7 @@ class MessageProcessingService:
         message: m.MessageType,
         messenger: AbstractMessenger,
         uow: AbstractUnitOfWork,
-    ) -> m.MessageType:
+    ) -> m.OutboxMessage:
         """We want to run a fuzzy search through all commands and respond with a message
         guiding the user to fix their mistake
         """
@@ -73,7 +86,7 @@ class MessageProcessingService:
             msg_body = uow.system_messages.get_msg("unknown_command-success").format(
                 closest_match
             )
-        return await messenger.reply_text(message, msg_body, uow)
+        return outbox.enqueue_text(message, msg_body, uow)
 
     async def _process_message(
         self,
@@ -99,9 +112,9 @@ class MessageProcessingService:
         ref_message: m.MessageType,
         uow: AbstractUnitOfWork,
         messenger: AbstractMessenger,
-    ) -> m.MessageType:
+    ) -> m.OutboxMessage:
         msg_body = uow.system_messages.get_msg("help-success")
-        return await messenger.reply_text(ref_message, msg_body, uow)
+        return outbox.enqueue_text(ref_message, msg_body, uow)
 
     def _is_message_empty(self, message: m.BaseMessage) -> bool:
         if message.message_body is None or message.message_body.replace(" ", "") == "":
@@ -121,7 +134,7 @@ class MessageProcessingService:
             else "report_bug-success"
         )
         msg_body = uow.system_messages.get_msg(msg_id)
-        await messenger.reply_text(ref_message, msg_body, uow)
+        outbox.enqueue_text(ref_message, msg_body, uow)
 
     async def handle_edit_prompt(
         self,
@@ -140,7 +153,7 @@ class MessageProcessingService:
             msg_body = uow.system_messages.get_msg("edit_prompt-success").format(
                 new_prompt
             )
-        await messenger.reply_text(ref_message, msg_body, uow)
+        outbox.enqueue_text(ref_message, msg_body, uow)
 
     async def handle_voice(
         self,
@@ -184,25 +197,25 @@ class MessageProcessingService:
             voice_bytes, ref_message.memo_duration
         )
 
+        # the letter is streamed and laid out paragraph by paragraph while it is generated
+        layout = pdf_gen.LetterLayout()
         try:
             letter_text = await msg_utils.transcript_to_letter_text(
-                ref_message.transcript, ref_message.user_id, uow
+                ref_message.transcript, ref_message.user_id, uow, layout=layout
             )
         except msg_utils.CharactersNotSupported as e:
             # send a message back to the user
             error_msg = uow.system_messages.get_msg(
                 "voice-error-characters_not_supported"
             )
-            await messenger.reply_text(ref_message, error_msg, uow)
+            outbox.enqueue_text(ref_message, error_msg, uow)
             return None
 
-        draft_bytes = pdf_gen.create_letter_pdf_as_bytes(letter_text)
+        draft_bytes = layout.build()
 
         ##############
         # 1. Upload file to blob storage
-        blob_path = uow.drafts_blob.upload(
-            draft_bytes, ref_message.user_id, "application/pdf"
-        )
+        blob_path = uow.drafts_blob.upload(draft_bytes, "application/pdf")
 
         # 2. Register the draft in the DB
         draft = m.Draft(
@@ -222,7 +235,7 @@ class MessageProcessingService:
         await messenger.reply_document(
             ref_message, draft_bytes, "draft.pdf", "application/pdf", uow
         )
-        await messenger.reply_text(ref_message, msg_body, uow)
+        outbox.enqueue_text(ref_message, msg_body, uow)
 
     async def handle_edit(
         self,
@@ -232,7 +245,7 @@ class MessageProcessingService:
     ):
         if self._is_message_empty(ref_message):
             msg_body = uow.system_messages.get_msg("edit-error-msg_empty")
-            await messenger.reply_text(ref_message, msg_body, uow)
+            outbox.enqueue_text(ref_message, msg_body, uow)
             return None
 
         # fetch the last draft that we're editing
@@ -244,7 +257,7 @@ class MessageProcessingService:
         # If we find no previous draft we respond with an error
         if len(old_drafts) == 0:
             error_msg = uow.system_messages.get_msg("edit-error-no_draft_found")
-            await messenger.reply_text(ref_message, error_msg, uow)
+            outbox.enqueue_text(ref_message, error_msg, uow)
             return None
 
         old_draft = old_drafts[0]
@@ -258,9 +271,7 @@ class MessageProcessingService:
         new_draft_bytes = pdf_gen.create_letter_pdf_as_bytes(new_letter_content)
 
         # 1. Upload file to blob storage
-        full_path = uow.drafts_blob.upload(
-            new_draft_bytes, ref_message.user_id, "application/pdf"
-        )
+        full_path = uow.drafts_blob.upload(new_draft_bytes, "application/pdf")
 
         # 2. Register the draft in the DB
         draft = m.Draft(
@@ -284,7 +295,7 @@ class MessageProcessingService:
             uow=uow,
         )
         msg_body = uow.system_messages.get_msg("edit-success")
-        await messenger.reply_text(ref_message, msg_body, uow)
+        outbox.enqueue_text(ref_message, msg_body, uow)
 
     async def handle_show_address_book(
         self,
@@ -301,7 +312,7 @@ class MessageProcessingService:
             error_message = uow.system_messages.get_msg(
                 "show_address_book-error-user_has_no_addresses"
             )
-            return await messenger.reply_text(ref_message, error_message, uow)
+            return outbox.enqueue_text(ref_message, error_message, uow)
         else:
             # Format and send the address book
             formatted_address_book = msg_utils.format_address_book(address_book)
@@ -310,7 +321,7 @@ class MessageProcessingService:
             success_message = uow.system_messages.get_msg(
                 "show_address_book-success"
             ).format(formatted_address_book, first_name)
-            return await messenger.reply_text(ref_message, success_message, uow)
+            return outbox.enqueue_text(ref_message, success_message, uow)
 
     async def handle_add_address(
         self,
@@ -319,7 +330,7 @@ class MessageProcessingService:
         messenger: AbstractMessenger,
     ):
         if self._is_message_empty(ref_message):
-            await messenger.reply_text(ref_message, "add_address-error-msg_empty", uow)
+            outbox.enqueue_text(ref_message, "add_address-error-msg_empty", uow)
             return None
 
         user_error_message = msg_utils.error_in_address(
@@ -327,7 +338,7 @@ class MessageProcessingService:
         )
         if user_error_message:
             error_msg = user_error_message
-            await messenger.reply_text(ref_message, error_msg, uow)
+            outbox.enqueue_text(ref_message, error_msg, uow)
             return None
 
         # Parse the message and add the address to the database
@@ -392,9 +403,7 @@ class MessageProcessingService:
             follow_up_address_book_msg = uow.system_messages.get_msg(
                 "add_address_callback-success-follow_up"
             ).format(formatted_address_book)
-            return await messenger.reply_text(
-                ref_message, follow_up_address_book_msg, uow
-            )
+            return outbox.enqueue_text(ref_message, follow_up_address_book_msg, uow)
         else:
             return None
 
@@ -407,7 +416,7 @@ class MessageProcessingService:
         # check msg not empty
         if ref_message.safe_message_body == "":
             msg_body = uow.system_messages.get_msg("delete_address-error-msg_empty")
-            await messenger.reply_text(ref_message, msg_body, uow)
+            outbox.enqueue_text(ref_message, msg_body, uow)
             return None
 
         # We first try to convert the message to an integer. If this fails, we try to find the closest match via fuzzy search
@@ -416,7 +425,7 @@ class MessageProcessingService:
         )
         if len(address_book) == 0:
             msg_body = uow.system_messages.get_msg("delete_address-error-no_addresses")
-            await messenger.reply_text(ref_message, msg_body, uow)
+            outbox.enqueue_text(ref_message, msg_body, uow)
             return None
 
         try:
@@ -434,14 +443,14 @@ class MessageProcessingService:
 
         if not 0 < reference_idx <= len(address_book):
             msg_body = uow.system_messages.get_msg("delete_address-error-invalid_idx")
-            await messenger.reply_text(ref_message, msg_body, uow)
+            outbox.enqueue_text(ref_message, msg_body, uow)
             return None
 
         address_to_delete = address_book[reference_idx - 1]
         uow.addresses.delete(address_to_delete.address_id)
         # Let the user know that the address was deleted
         msg_body = uow.system_messages.get_msg("delete_address-success")
-        await messenger.reply_text(ref_message, msg_body, uow)
+        outbox.enqueue_text(ref_message, msg_body, uow)
 
         # Show the updated address book to the user
         unformatted_address_book = uow.addresses.get_all(
@@ -451,7 +460,7 @@ class MessageProcessingService:
         message_new_adressbook = uow.system_messages.get_msg(
             "delete_address-success-follow_up"
         ).format(formatted_address_book)
-        await messenger.reply_text(ref_message, message_new_adressbook, uow)
+        outbox.enqueue_text(ref_message, message_new_adressbook, uow)
 
     async def handle_send(
         self,
@@ -472,7 +481,7 @@ class MessageProcessingService:
         )
         if not all_drafts:
             msg_body = uow.system_messages.get_msg("send-error-no_draft")
-            await messenger.reply_text(ref_message, msg_body, uow)
+            outbox.enqueue_text(ref_message, msg_body, uow)
             return None
 
         # 2. Does the user have any addresses saved?
@@ -481,7 +490,7 @@ class MessageProcessingService:
         )
         if address_book == []:
             msg_body = uow.system_messages.get_msg("send-error-user_has_no_addresses")
-            await messenger.reply_text(ref_message, msg_body, uow)
+            outbox.enqueue_text(ref_message, msg_body, uow)
             return None
         elif len(address_book) == 1:
             address = address_book[0]
@@ -491,7 +500,7 @@ class MessageProcessingService:
             if self._is_message_empty(ref_message):
                 # if yes, then tell user that he needs to specify addressee
                 msg_body = uow.system_messages.get_msg("send-error-msg_empty")
-                await messenger.reply_text(ref_message, msg_body, uow)
+                outbox.enqueue_text(ref_message, msg_body, uow)
                 return None
             else:
                 # if not find address match
@@ -503,17 +512,17 @@ class MessageProcessingService:
                     msg_body = uow.system_messages.get_msg(
                         "send-error-no_good_address_match"
                     ).format(formatted_address_book)
-                    await messenger.reply_text(ref_message, msg_body, uow)
+                    outbox.enqueue_text(ref_message, msg_body, uow)
                     return None
                 address = address_book[address_idx]
 
-        # Create a letter with the address and the draft text
+        # Create a letter with the address and the draft text, unless the same letter
+        # was rendered before
         last_draft = all_drafts[0]
-        draft_bytes = pdf_gen.create_letter_pdf_as_bytes(
-            last_draft.text, address  # type: ignore
-        )
         # 1. Upload file to blob storage
-        full_path = uow.drafts_blob.upload(draft_bytes, user.user_id, "application/pdf")
+        full_path, draft_bytes = render_cache.get_or_render(
+            last_draft.text, address, uow.drafts_blob  # type: ignore
+        )
 
         # 2. Register the draft in the DB
         draft = m.Draft(
@@ -530,7 +539,8 @@ class MessageProcessingService:
         # update the user message in the DB with the draft id so we can retrieve the draft
         # later in the callback response without ambuiguity
 
-        payment_type = "credits" if user.num_letter_credits > 0 else "direct"
+        num_letter_credits = uow.credit_ledger.get_balance(user.user_id)
+        payment_type = "credits" if num_letter_credits > 0 else "direct"
         order = m.Order(
             order_id=str(uuid.uuid4()),
             user_id=draft.user_id,
@@ -562,7 +572,7 @@ class MessageProcessingService:
             )
             msg_body = uow.system_messages.get_msg("send-success-credits").format(
                 user_first_name,
-                user.num_letter_credits,
+                num_letter_credits,
                 address.format_address_as_string(),
             )
             option_confirm = uow.system_messages.get_msg("send-option-confirm_sending")
@@ -588,7 +598,7 @@ class MessageProcessingService:
             msg_body = uow.system_messages.get_msg("send-success-one_off").format(
                 stripe_link_single_credit, stripe_5_credit_link, stripe_10_credit_link
             )
-            return await messenger.reply_text(ref_message, msg_body, uow)
+            return outbox.enqueue_text(ref_message, msg_body, uow)
         else:
             raise ValueError(f"Payment type {payment_type} not recognized")
 
@@ -609,12 +619,9 @@ class MessageProcessingService:
             order: m.Order = uow.orders.get_one(
                 response_to_og_send_message.order_referenced
             )
-            was_dispatched = order.dispatch(uow=uow)
+            # charges the user's credit in the same atomic call
+            was_dispatched, _ = order.dispatch(uow=uow)
             if was_dispatched:
-                # reduce users credit count
-                user = uow.users.get_one(order.user_id)
-                user.num_letter_credits -= 1
-                uow.users.update(user)
                 msg_body = uow.system_messages.get_msg("send_callback-confirm")
             else:
                 # not sure how this might happen
@@ -633,4 +640,4 @@ class MessageProcessingService:
         messenger: AbstractMessenger,
     ):
         msg_body = uow.system_messages.get_msg("commmand_not_recognised-success")
-        await messenger.reply_text(ref_message, msg_body, uow)
+        outbox.enqueue_text(ref_message, msg_body, uow)
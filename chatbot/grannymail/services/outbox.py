@@ -0,0 +1,188 @@
+import asyncio
+import random
+import typing as t
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+import grannymail.domain.models as m
+from grannymail.integrations.messengers import telegram, whatsapp
+from grannymail.integrations.messengers.base import AbstractMessenger
+from grannymail.logger import logger
+from grannymail.services.unit_of_work import AbstractUnitOfWork, SupabaseUnitOfWork
+from grannymail.utils import utils
+
+BATCH_SIZE = 50
+# seconds after which a claimed message that was not sent can be claimed again
+CLAIM_LEASE = 60
+MAX_ATTEMPTS = 6
+BASE_BACKOFF = 2
+MAX_BACKOFF = 5 * 60
+# seconds between polls when no message was enqueued by this worker
+POLL_INTERVAL = 5
+# messages that are sent at the same time per platform. This bounds concurrency, not
+# throughput: the messages per second are bounded by the rate limiters of the messengers
+PLATFORM_CONCURRENCY: dict[str, int] = {"WhatsApp": 10, "Telegram": 10}
+
+
+def get_recipient(message: m.BaseMessage) -> str:
+    if isinstance(message, m.TelegramMessage):
+        return str(message.tg_chat_id)
+    if message.phone_number is None:
+        raise ValueError(f"Message {message.message_id} has no recipient")
+    return message.phone_number
+
+
+def backoff_delay(
+    attempts: int, base: float = BASE_BACKOFF, maximum: float = MAX_BACKOFF
+) -> float:
+    """Exponential backoff with jitter, so that retries of many messages that failed
+    together (e.g. during an outage) are spread out."""
+    delay = min(maximum, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+class OutboxSender:
+    """Delivers the messages of the outbox.
+
+    Messages are claimed in batches and sent concurrently across recipients, up to a
+    per-platform limit. A message that fails is retried with backoff until it was
+    attempted `MAX_ATTEMPTS` times. As only the oldest open message of a recipient
+    can be claimed, messages to one recipient never overtake each other. Every worker
+    runs a sender, claims make sure each message is sent by one of them.
+    """
+
+    def __init__(
+        self,
+        uow_factory: t.Callable[[], AbstractUnitOfWork],
+        batch_size: int = BATCH_SIZE,
+        platform_concurrency: dict[str, int] = PLATFORM_CONCURRENCY,
+    ):
+        self.uow_factory = uow_factory
+        self.batch_size = batch_size
+        self._semaphores = {
+            platform: asyncio.Semaphore(limit)
+            for platform, limit in platform_concurrency.items()
+        }
+        self._wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        """Wakes the sender up, e.g. after a message was enqueued."""
+        self._wakeup.set()
+
+    def get_messenger(self, platform: str) -> AbstractMessenger:
+        if platform == "WhatsApp":
+            return whatsapp.Whatsapp()
+        elif platform == "Telegram":
+            return telegram.Telegram()
+        raise ValueError(f"Unsupported message platform: {platform}")
+
+    async def send(self, message: m.OutboxMessage, uow: AbstractUnitOfWork) -> None:
+        ref_message: m.WhatsappMessage | m.TelegramMessage
+        if message.messaging_platform == "WhatsApp":
+            ref_message = uow.wa_messages.get_one(message.ref_message_id)
+        else:
+            ref_message = uow.tg_messages.get_one(message.ref_message_id)
+        messenger = self.get_messenger(message.messaging_platform)
+        await messenger.reply_text(ref_message, message.message_body, uow)
+
+    async def deliver(self, message: m.OutboxMessage) -> bool:
+        """Sends a claimed message and records the outcome. Returns whether it was
+        sent."""
+        async with self._semaphores[message.messaging_platform]:
+            with self.uow_factory() as uow:
+                try:
+                    await self.send(message, uow)
+                    message.status = "sent"
+                    message.sent_at = utils.get_utc_timestamp()
+                    message.last_error = None
+                except Exception as e:
+                    message.last_error = str(e)
+                    if message.attempts >= MAX_ATTEMPTS:
+                        logger.error(
+                            f"Giving up on outbox message {message.outbox_id} after {message.attempts} attempts: {e}"
+                        )
+                        message.status = "failed"
+                    else:
+                        logger.warning(
+                            f"Failed to send outbox message {message.outbox_id}, retrying: {e}"
+                        )
+                        message.status = "pending"
+                        message.next_attempt_at = utils.get_utc_timestamp(
+                            timedelta(seconds=backoff_delay(message.attempts))
+                        )
+                message.claimed_until = None
+                uow.outbox.update(message)
+                uow.commit()
+        return message.status == "sent"
+
+    async def run_once(self) -> int:
+        """Claims and delivers one batch. Returns the number of claimed messages."""
+        with self.uow_factory() as uow:
+            messages = await asyncio.to_thread(
+                uow.outbox.claim, self.batch_size, CLAIM_LEASE
+            )
+        by_platform: dict[str, int] = defaultdict(int)
+        for message in messages:
+            by_platform[message.messaging_platform] += 1
+        if messages:
+            logger.info(f"Sending outbox messages: {dict(by_platform)}")
+        results = await asyncio.gather(
+            *[self.deliver(x) for x in messages], return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Failed to record outbox delivery: {result}")
+        return len(messages)
+
+    async def run_forever(self, interval: float = POLL_INTERVAL) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                num_claimed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Outbox sender failed: {e}")
+                num_claimed = 0
+            if num_claimed == self.batch_size:
+                # there is probably more to send
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+sender = OutboxSender(SupabaseUnitOfWork)
+
+
+def enqueue_text(
+    ref_message: m.BaseMessage, message_body: str, uow: AbstractUnitOfWork
+) -> m.OutboxMessage:
+    """
+    Adds a text reply to the outbox instead of sending it right away.
+
+    The reply is stored with the rest of the unit of work and delivered by the outbox
+    sender, which retries it if the platform is unavailable.
+
+    Args:
+        ref_message (m.BaseMessage): The message that is replied to.
+        message_body (str): The text of the reply.
+        uow (AbstractUnitOfWork): The unit of work to store the reply with.
+
+    Returns:
+        m.OutboxMessage: The stored outbox message.
+    """
+    now = utils.get_utc_timestamp()
+    message = uow.outbox.add(
+        m.OutboxMessage(
+            outbox_id=str(uuid.uuid4()),
+            ref_message_id=ref_message.message_id,
+            messaging_platform=ref_message.messaging_platform,
+            recipient=get_recipient(ref_message),
+            message_body=message_body,
+            created_at=now,
+            next_attempt_at=now,
+        )
+    )
+    sender.notify()
+    return message
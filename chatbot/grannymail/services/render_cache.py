@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+import grannymail.domain.models as m
+from grannymail.db.blob_repos import BlobRepositoryBase
+from grannymail.logger import logger
+from grannymail.utils.lazy import lazy_import
+
+pdf_gen = lazy_import("grannymail.integrations.pdf_gen")
+
+# letters are about 50KB, so the rendered letters kept in memory take a few MB
+MAX_CACHED_LETTERS = 128
+RENDERS_FOLDER = "renders"
+
+
+class RenderCache:
+    """Letters that were rendered before, so that identical letters render only once.
+
+    Letters are keyed by their text, the address lines printed on them and the
+    template version. Recently rendered letters are kept in memory. Every rendered
+    letter is stored in blob storage under its key, which makes it available to all
+    workers and after restarts: a letter missing from memory is looked up there
+    before it is rendered.
+    """
+
+    def __init__(self, max_letters: int = MAX_CACHED_LETTERS):
+        self.max_letters = max_letters
+        self._lock = threading.Lock()
+        # render key -> letter
+        self._letters: OrderedDict[str, bytes] = OrderedDict()
+        self.stats = {"memory_hits": 0, "blob_hits": 0, "renders": 0}
+
+    def _get(self, key: str) -> bytes | None:
+        with self._lock:
+            letter = self._letters.get(key)
+            if letter is not None:
+                self._letters.move_to_end(key)
+            return letter
+
+    def _set(self, key: str, letter: bytes) -> None:
+        with self._lock:
+            self._letters[key] = letter
+            self._letters.move_to_end(key)
+            if len(self._letters) > self.max_letters:
+                self._letters.popitem(last=False)
+
+    def get_or_render(
+        self, text: str, address: m.Address, blobs: BlobRepositoryBase
+    ) -> tuple[str, bytes]:
+        """Returns the blob path and the bytes of the letter, rendering and uploading
+        it only if it was never rendered before."""
+        key = pdf_gen.letter_render_key(text, address)
+        blob_path = f"{blobs.blob_prefix}/{RENDERS_FOLDER}/{key}.pdf"
+        letter = self._get(key)
+        if letter is not None:
+            self.stats["memory_hits"] += 1
+        elif blobs.exists(blob_path):
+            self.stats["blob_hits"] += 1
+            letter = blobs.download(blob_path)
+        else:
+            self.stats["renders"] += 1
+            logger.info(f"Rendering letter {key}")
+            letter = pdf_gen.create_letter_pdf_as_bytes(text, address)
+        # only uploads if the letter isn't stored, e.g. if it was rendered in memory
+        # before its upload failed
+        blobs.upload_to(letter, blob_path, "application/pdf")
+        self._set(key, letter)
+        return blob_path, letter
+
+
+render_cache = RenderCache()
@@ -0,0 +1,129 @@
+import asyncio
+import datetime
+import os
+import socket
+import typing as t
+import uuid
+from dataclasses import dataclass
+
+from grannymail.logger import logger
+from grannymail.services.unit_of_work import AbstractUnitOfWork
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    func: t.Callable[[], t.Awaitable[None]]
+    # exactly one of interval and daily_at is set
+    interval: datetime.timedelta | None = None
+    daily_at: datetime.time | None = None
+    run_at_startup: bool = False
+    # seconds for which a run blocks the job on all other workers
+    lease_ttl: float = 60
+
+    def seconds_until_next_run(self, now: datetime.datetime) -> float:
+        if self.interval is not None:
+            return self.interval.total_seconds()
+        assert self.daily_at is not None
+        next_run = datetime.datetime.combine(
+            now.date(), self.daily_at, tzinfo=datetime.timezone.utc
+        )
+        if next_run <= now:
+            next_run += ONE_DAY
+        return (next_run - now).total_seconds()
+
+
+class Scheduler:
+    """Runs periodic jobs on exactly one of several workers.
+
+    Every worker runs the same schedule, but before a job runs the worker has to
+    acquire the job's lease in the database. The first worker wins the lease and
+    runs the job, the others skip this run. Leases are not released after a run but
+    expire after `lease_ttl`, which also covers small clock differences between
+    workers. The ttl should thus be shorter than the job's interval.
+    """
+
+    def __init__(self, uow_factory: t.Callable[[], AbstractUnitOfWork]):
+        self.uow_factory = uow_factory
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: list[ScheduledJob] = []
+        self._tasks: list[asyncio.Task] = []
+
+    def every(
+        self,
+        name: str,
+        interval: datetime.timedelta,
+        func: t.Callable[[], t.Awaitable[None]],
+        run_at_startup: bool = False,
+        lease_ttl: float | None = None,
+    ) -> None:
+        self.jobs.append(
+            ScheduledJob(
+                name=name,
+                func=func,
+                interval=interval,
+                run_at_startup=run_at_startup,
+                lease_ttl=lease_ttl or interval.total_seconds() / 2,
+            )
+        )
+
+    def daily(
+        self,
+        name: str,
+        at: datetime.time,
+        func: t.Callable[[], t.Awaitable[None]],
+        run_at_startup: bool = False,
+        lease_ttl: float = 60 * 60,
+    ) -> None:
+        """Runs the job every day at the given UTC time."""
+        self.jobs.append(
+            ScheduledJob(
+                name=name,
+                func=func,
+                daily_at=at,
+                run_at_startup=run_at_startup,
+                lease_ttl=lease_ttl,
+            )
+        )
+
+    async def run_job(self, job: ScheduledJob, lease_name: str | None = None) -> bool:
+        """Runs the job if this worker acquires its lease. Returns whether it ran."""
+        lease_name = lease_name or job.name
+        with self.uow_factory() as uow:
+            acquired = await asyncio.to_thread(
+                uow.job_leases.try_acquire, lease_name, self.holder, job.lease_ttl
+            )
+        if not acquired:
+            logger.info(f"Skipping job '{job.name}', another worker holds the lease")
+            return False
+        logger.info(f"Running job '{job.name}'")
+        try:
+            await job.func()
+        except Exception as e:
+            logger.error(f"Job '{job.name}' failed: {e}")
+        return True
+
+    async def _run_forever(self, job: ScheduledJob) -> None:
+        if job.run_at_startup:
+            # separate lease so that a deploy does not skip the next scheduled run
+            await self._try_run(job, lease_name=f"{job.name}:startup")
+        while True:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            await asyncio.sleep(job.seconds_until_next_run(now))
+            await self._try_run(job)
+
+    async def _try_run(self, job: ScheduledJob, lease_name: str | None = None) -> None:
+        try:
+            await self.run_job(job, lease_name)
+        except Exception as e:
+            logger.error(f"Could not run job '{job.name}': {e}")
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run_forever(job)) for job in self.jobs]
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
@@ -22,9 +22,15 @@ class AbstractUnitOfWork(abc.ABC):
     files: repos.RepositoryBase[m.File]
     addresses: repos.RepositoryBase[m.Address]
     drafts: repos.RepositoryBase[m.Draft]
-    orders: repos.RepositoryBase[m.Order]
+    orders: repos.OrderRepositoryBase
     attachments: repos.RepositoryBase[m.Attachment]
+    credit_ledger: repos.CreditLedgerRepositoryBase
     system_messages: repos.SystemsMessageRepositoryBase
+    stripe_events: repos.StripeEventRepositoryBase
+    job_leases: repos.JobLeaseRepositoryBase
+    delivery_statuses: repos.DeliveryStatusRepositoryBase
+    outbox: repos.OutboxRepositoryBase
+    broadcasts: repos.BroadcastRepositoryBase
     drafts_blob: blob_repos.BlobRepositoryBase
     files_blob: blob_repos.BlobRepositoryBase
 
@@ -80,7 +86,13 @@ class SupabaseUnitOfWork(AbstractUnitOfWork):
         self.drafts = repos.DraftRepository(client)
         self.orders = repos.OrderRepository(client)
         self.attachments = repos.AttachmentRepository(client)
+        self.credit_ledger = repos.CreditLedgerRepository(client)
         self.system_messages = repos.SystemMessageRepository(client)
+        self.stripe_events = repos.StripeEventRepository(client)
+        self.job_leases = repos.JobLeaseRepository(client)
+        self.delivery_statuses = repos.DeliveryStatusRepository(client)
+        self.outbox = repos.OutboxRepository(client)
+        self.broadcasts = repos.BroadcastRepository(client)
         self.drafts_blob = blob_repos.DraftBlobRepository(client)
         self.files_blob = blob_repos.FilesBlobRepository(client)
         return super().__enter__()
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+
+import grannymail.domain.models as m
+from grannymail.utils.lazy import lazy_import
+
+fuzz = lazy_import("rapidfuzz.fuzz")
+process = lazy_import("rapidfuzz.process")
+utils = lazy_import("rapidfuzz.utils")
+
+# Scores are between 0 and 100, matches at or below this score are ignored
+MIN_MATCH_SCORE = 50
+MAX_CACHED_USERS = 1024
+
+
+def serialise_address(address: m.Address) -> str:
+    """Serialises and normalises an address for fuzzy matching."""
+    values = [
+        address.addressee,
+        address.address_line1,
+        address.address_line2,
+        address.city,
+        address.zip,
+        address.country,
+    ]
+    return utils.default_process(" ".join([x for x in values if x is not None]))
+
+
+class AddressSearchIndex:
+    """Fuzzy search index over the address book of a single user.
+
+    Stores the normalised serialisation of every address so that a lookup is a
+    single batched rapidfuzz call instead of serialising and scoring every address
+    in Python.
+    """
+
+    def __init__(self):
+        # address_id -> normalised serialised address, in address book order
+        self._choices: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._choices)
+
+    def add(self, address: m.Address) -> None:
+        self._choices[address.address_id] = serialise_address(address)
+
+    def remove(self, address_id: str) -> None:
+        self._choices.pop(address_id, None)
+
+    def sync(self, address_book: list[m.Address]) -> None:
+        """Incrementally brings the index in line with the given address book.
+
+        Only addresses that were added or deleted since the last sync are touched,
+        e.g. because they were changed by another worker.
+        """
+        book_ids = [address.address_id for address in address_book]
+        if list(self._choices) == book_ids:
+            return
+        current_ids = set(book_ids)
+        for address_id in [x for x in self._choices if x not in current_ids]:
+            self.remove(address_id)
+        if list(self._choices) != [x for x in book_ids if x in self._choices]:
+            # the order of the address book changed, rebuild to match it
+            self._choices = {}
+        for address in address_book:
+            if address.address_id not in self._choices:
+                self.add(address)
+
+    def search(self, query: str) -> str | None:
+        """Returns the id of the best matching address or None if nothing matches well."""
+        # the choices are normalised already, so only the query needs processing
+        match = process.extractOne(
+            utils.default_process(query),
+            self._choices,
+            scorer=fuzz.partial_ratio,
+            score_cutoff=MIN_MATCH_SCORE,
+        )
+        if match is None:
+            return None
+        _, score, address_id = match
+        return address_id if score > MIN_MATCH_SCORE else None
+
+
+_indices: OrderedDict[str, AddressSearchIndex] = OrderedDict()
+
+
+def get_user_index(user_id: str) -> AddressSearchIndex:
+    """Returns the cached index of a user, evicting the least recently used one."""
+    index = _indices.pop(user_id, None)
+    if index is None:
+        index = AddressSearchIndex()
+    _indices[user_id] = index
+    if len(_indices) > MAX_CACHED_USERS:
+        _indices.popitem(last=False)
+    return index
+
+
+def on_address_added(address: m.Address) -> None:
+    index = _indices.get(address.user_id)
+    if index is not None:
+        index.add(address)
+
+
+def on_address_deleted(address_id: str) -> None:
+    for index in _indices.values():
+        index.remove(address_id)
@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds after which a cached balance is re-read, picks up writes of other workers
+BALANCE_TTL = 60
+MAX_CACHED_USERS = 4096
+
+
+class CreditBalanceCache:
+    """In-memory materialised letter credit balances of the most recent users.
+
+    Balances are written by the calls that change them, so a read is a dictionary
+    lookup. Every balance remembers the last ledger entry it includes, which keeps an
+    older result that arrives late from overwriting a newer one.
+    """
+
+    def __init__(self, ttl: float = BALANCE_TTL, max_users: int = MAX_CACHED_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # user_id -> (balance, last_entry_id, time cached)
+        self._balances: OrderedDict[str, tuple[int, int, float]] = OrderedDict()
+
+    def get(self, user_id: str) -> int | None:
+        with self._lock:
+            cached = self._balances.get(user_id)
+            if cached is None:
+                return None
+            balance, _, cached_at = cached
+            if time.monotonic() - cached_at > self.ttl:
+                return None
+            self._balances.move_to_end(user_id)
+            return balance
+
+    def set(self, user_id: str, balance: int, last_entry_id: int) -> None:
+        with self._lock:
+            cached = self._balances.get(user_id)
+            if cached is not None and cached[1] > last_entry_id:
+                return
+            self._balances[user_id] = (balance, last_entry_id, time.monotonic())
+            self._balances.move_to_end(user_id)
+            if len(self._balances) > self.max_users:
+                self._balances.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._balances.pop(user_id, None)
+
+
+balance_cache = CreditBalanceCache()
@@ -0,0 +1,183 @@
+import asyncio
+import time
+import typing as t
+from collections import deque
+from dataclasses import asdict, dataclass
+
+from grannymail.logger import logger
+
+T = t.TypeVar("T")
+
+
+@dataclass
+class HedgeStats:
+    """Counters describing how a hedge policy behaved so far."""
+
+    calls: int = 0
+    hedges_fired: int = 0
+    hedges_won: int = 0
+    timeouts: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class HedgePolicy:
+    """Latency-aware timeouts and request hedging for one kind of request.
+
+    The policy keeps a rolling window of observed latencies. Once enough samples
+    were collected, a duplicate request is fired when the original one takes longer
+    than the rolling p95 and the overall timeout is derived from the rolling p99.
+    Until then the configured defaults are used.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        default_timeout: float,
+        window_size: int = 200,
+        min_samples: int = 20,
+        hedge_percentile: float = 95,
+        timeout_percentile: float = 99,
+        timeout_multiplier: float = 2.0,
+        min_timeout: float = 5.0,
+        max_timeout: float = 60.0,
+    ):
+        self.name = name
+        self.default_timeout = default_timeout
+        self.min_samples = min_samples
+        self.hedge_percentile = hedge_percentile
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.latencies: deque[float] = deque(maxlen=window_size)
+        self.stats = HedgeStats()
+
+    def observe(self, latency: float) -> None:
+        self.latencies.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        """Returns the q-th percentile of the observed latencies (nearest rank) or
+        None if not enough samples were collected yet."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+        return ordered[rank]
+
+    @property
+    def hedge_delay(self) -> float | None:
+        """Seconds after which a duplicate request is fired, None disables hedging."""
+        return self.percentile(self.hedge_percentile)
+
+    @property
+    def timeout(self) -> float:
+        """Overall timeout for a (possibly hedged) request in seconds."""
+        p = self.percentile(self.timeout_percentile)
+        if p is None:
+            return self.default_timeout
+        return max(self.min_timeout, min(self.max_timeout, p * self.timeout_multiplier))
+
+
+async def hedged_request(
+    request_factory: t.Callable[[float], t.Awaitable[T]],
+    policy: HedgePolicy,
+    on_discard: t.Callable[[T], t.Awaitable[None]] | None = None,
+) -> T:
+    """Runs a request and fires one duplicate if it exceeds the policy's hedge delay.
+
+    Whichever request finishes successfully first wins, the other one is cancelled.
+
+    Args:
+        request_factory: Creates a new request, receives the timeout in seconds that
+            should be handed to the underlying client.
+        policy: The hedge policy of this kind of request.
+        on_discard: Releases the result of a request that finished successfully in the
+            same round as the winner, e.g. closes its stream.
+
+    Returns:
+        The result of the first successful request.
+
+    Raises:
+        asyncio.TimeoutError: If no request finished within the policy's timeout.
+        Exception: The error of the last request that failed.
+    """
+    timeout = policy.timeout
+    hedge_delay = policy.hedge_delay
+    policy.stats.calls += 1
+
+    start = time.monotonic()
+    primary = asyncio.ensure_future(request_factory(timeout))
+    pending: set[asyncio.Future] = {primary}
+    hedge: asyncio.Future | None = None
+    error: BaseException | None = None
+
+    try:
+        while pending:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            wait_for = remaining
+            if hedge is None and hedge_delay is not None:
+                wait_for = min(
+                    remaining, max(0.0, hedge_delay - (time.monotonic() - start))
+                )
+            done, pending = await asyncio.wait(
+                pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            winner: asyncio.Future | None = None
+            for task in done:
+                if task is primary:
+                    policy.observe(time.monotonic() - start)
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task
+            if winner is not None:
+                if winner is hedge:
+                    policy.stats.hedges_won += 1
+                    logger.info(
+                        f"Hedged request won for '{policy.name}': {policy.stats.as_dict()}"
+                    )
+                losers = [x for x in done if x is not winner and x.exception() is None]
+                for task in losers:
+                    await _discard(task.result(), on_discard)
+                return winner.result()
+
+            if not done and hedge is None and hedge_delay is not None:
+                policy.stats.hedges_fired += 1
+                logger.info(
+                    f"Request for '{policy.name}' exceeded p{policy.hedge_percentile} "
+                    f"latency of {hedge_delay:.1f}s, firing hedge: {policy.stats.as_dict()}"
+                )
+                hedge = asyncio.ensure_future(
+                    request_factory(timeout - (time.monotonic() - start))
+                )
+                pending.add(hedge)
+    finally:
+        if primary in pending:
+            # The primary request took at least this long. Recording the lower bound
+            # keeps cancelled slow requests from dragging the percentiles down.
+            policy.observe(time.monotonic() - start)
+        for task in pending:
+            task.cancel()
+
+    if error is not None:
+        raise error
+    policy.stats.timeouts += 1
+    raise asyncio.TimeoutError(
+        f"Request for '{policy.name}' did not finish within {timeout:.1f}s"
+    )
+
+
+async def _discard(
+    result: T, on_discard: t.Callable[[T], t.Awaitable[None]] | None
+) -> None:
+    if on_discard is None:
+        return
+    try:
+        await on_discard(result)
+    except Exception as e:
+        logger.warning(f"Failed to release the result of a discarded request: {e}")
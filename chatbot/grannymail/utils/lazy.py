@@ -0,0 +1,68 @@
+import importlib
+import threading
+import time
+import types
+import typing as t
+
+from grannymail.logger import logger
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is only imported on first attribute access.
+
+    Keeps heavy dependencies out of the import of the app, so that cold starts only
+    pay for what a request actually uses.
+    """
+
+    def __init__(
+        self, name: str, on_load: t.Callable[[types.ModuleType], None] | None = None
+    ):
+        super().__init__(name)
+        self._on_load = on_load
+        self._module: types.ModuleType | None = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> types.ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self.__name__)
+                    if self._on_load is not None:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr: str) -> t.Any:
+        return getattr(self._load(), attr)
+
+    def __dir__(self) -> list[str]:
+        return dir(self._load())
+
+
+_lazy_modules: dict[str, LazyModule] = {}
+
+
+def lazy_import(
+    name: str, on_load: t.Callable[[types.ModuleType], None] | None = None
+) -> t.Any:
+    """Returns a module that is imported on first use.
+
+    Args:
+        name: The absolute name of the module.
+        on_load: Called with the module once it was imported, e.g. to configure it.
+    """
+    if name not in _lazy_modules:
+        _lazy_modules[name] = LazyModule(name, on_load)
+    return _lazy_modules[name]
+
+
+def preload() -> None:
+    """Imports all lazy modules, e.g. in the background once the app is up."""
+    for name, module in list(_lazy_modules.items()):
+        start = time.monotonic()
+        try:
+            module._load()
+        except Exception as e:
+            logger.error(f"Failed to preload {name}: {e}")
+            continue
+        logger.info(f"Preloaded {name} in {time.monotonic() - start:.2f}s")
@@ -0,0 +1,64 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# WhatsApp deletes uploaded media after 30 days, ids are dropped a day earlier so that
+# a message is never sent with media that expires while it is delivered
+WHATSAPP_MEDIA_TTL = 29 * 24 * 60 * 60
+# Telegram keeps file_ids valid for as long as the file is stored, which isn't
+# guaranteed, so they are refreshed every 30 days as well
+TELEGRAM_FILE_ID_TTL = 30 * 24 * 60 * 60
+MAX_CACHED_MEDIA = 4096
+
+
+def content_key(data: bytes, *extra: str) -> str:
+    """Returns the key of a document, `extra` distinguishes identical bytes that are
+    sent differently, e.g. under another filename."""
+    digest = hashlib.sha256(data)
+    for value in extra:
+        digest.update(b"\0" + value.encode())
+    return digest.hexdigest()
+
+
+class MediaIdCache:
+    """Remembers the ids under which documents were uploaded to a messaging platform.
+
+    Documents are keyed by the hash of their content, so sending the same document
+    again, e.g. after a retried `/send`, references the uploaded media instead of
+    uploading it again. Ids expire before the platform deletes the media.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = MAX_CACHED_MEDIA):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # content key -> (media id, time uploaded)
+        self._ids: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            cached = self._ids.get(key)
+            if cached is None:
+                return None
+            media_id, uploaded_at = cached
+            if time.monotonic() - uploaded_at > self.ttl:
+                del self._ids[key]
+                return None
+            self._ids.move_to_end(key)
+            return media_id
+
+    def set(self, key: str, media_id: str) -> None:
+        with self._lock:
+            self._ids[key] = (media_id, time.monotonic())
+            self._ids.move_to_end(key)
+            if len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._ids.pop(key, None)
+
+
+whatsapp_media_ids = MediaIdCache(ttl=WHATSAPP_MEDIA_TTL)
+telegram_file_ids = MediaIdCache(ttl=TELEGRAM_FILE_ID_TTL)
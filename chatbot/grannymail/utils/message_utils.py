@@ -1,16 +1,50 @@
+from __future__ import annotations
+
+import asyncio
+import functools
 import io
+import re
 import typing as t
 from uuid import uuid4
 
-import numpy as np
-from openai import AsyncOpenAI
-from rapidfuzz import fuzz
-
 import grannymail.domain.models as m
 from grannymail.logger import logger
 from grannymail.services.unit_of_work import AbstractUnitOfWork
-
-openai_client = AsyncOpenAI()
+from grannymail.utils import address_index
+from grannymail.utils.hedging import HedgePolicy, hedged_request
+from grannymail.utils.lazy import lazy_import
+
+if t.TYPE_CHECKING:
+    import openai
+    from openai import AsyncStream
+    from openai.types.chat import ChatCompletionChunk
+
+    import grannymail.integrations.pdf_gen as pdf_gen
+else:
+    openai = lazy_import("openai")
+    pdf_gen = lazy_import("grannymail.integrations.pdf_gen")
+
+
+@functools.cache
+def get_openai_client() -> openai.AsyncOpenAI:
+    return openai.AsyncOpenAI()
+
+
+# Latency-aware hedging policies for the chat completions we run. The defaults are
+# used until enough latencies were observed to derive percentiles.
+letter_generation_policy = HedgePolicy("transcript_to_letter_text", default_timeout=30)
+# streamed letters are hedged on the time until their first chunk arrives
+letter_first_chunk_policy = HedgePolicy(
+    "transcript_to_letter_text_first_chunk", default_timeout=30
+)
+letter_edit_policy = HedgePolicy("implement_letter_edits", default_timeout=30)
+letter_section_policy = HedgePolicy("letter_section", default_timeout=30)
+letter_stitch_policy = HedgePolicy("letter_stitch", default_timeout=15)
+
+# Transcripts longer than this (in characters) are turned into a letter section by
+# section instead of in a single completion. ~4 characters make up one token.
+LONG_TRANSCRIPT_THRESHOLD = 6000
+TRANSCRIPT_SEGMENT_LENGTH = 3000
 
 # General stuff
 
@@ -113,37 +147,26 @@ def fetch_closest_address_index(
 ) -> int:
     """Returns the entry in the address book that is closest to the name supplied using fuzzy matching
 
+    The search runs on the cached address search index of the user, which is brought
+    in line with the address book before searching.
+
     Args:
         fuzzy_string (str): search query term supplied by the user
-        phone_number (str): phone number of the user whose address book should be searched
+        address_book (list[m.Address]): the address book of the user that should be searched
 
     Returns:
-        int: Returns the index of the closest match
+        int: Returns the index of the closest match or -1 if there is no good match
     """
-
-    def serialise_address(address: m.Address) -> str:
-        values = [
-            address.addressee,
-            address.address_line1,
-            address.address_line2,
-            address.city,
-            address.zip,
-            address.country,
-        ]
-        values_subset = [x for x in values if x is not None]
-        out = " ".join(values_subset)
-        return out
-
-    # get the closest match
-    serialised_addresses = [serialise_address(ad) for ad in address_book]
-    # get the closest match using the fuzzywuzzy package
-    matching_scores = [
-        fuzz.partial_ratio(fuzzy_string, ad) for ad in serialised_addresses
-    ]
-    if max(matching_scores) > 50:
-        return int(np.argmax(matching_scores))
-    else:
+    if not address_book:
         return -1
+    index = address_index.get_user_index(address_book[0].user_id)
+    index.sync(address_book)
+    address_id = index.search(fuzzy_string)
+    if address_id is None:
+        return -1
+    return next(
+        idx for idx, ad in enumerate(address_book) if ad.address_id == address_id
+    )
 
 
 # AI Stuff
@@ -166,7 +189,7 @@ async def transcribe_voice_memo(voice_bytes: bytes, duration: float) -> str:
     # Use an in-memory bytes buffer to avoid writing to disk
     buffer = io.BytesIO(voice_bytes)
     buffer.name = "temp_file.ogg"
-    transcript = await openai_client.audio.transcriptions.create(
+    transcript = await get_openai_client().audio.transcriptions.create(
         model="whisper-1",
         file=buffer,
         # response_format="text",
@@ -177,10 +200,10 @@ async def transcribe_voice_memo(voice_bytes: bytes, duration: float) -> str:
     return transcript.text
 
 
-def _check_supported_by_times_new_roman(s):
+def _check_supported_by_times_new_roman(s: str) -> None:
     """
-    Checks if all characters in the string are likely to be supported by Times New Roman.
-    This function checks against a broad approximation of character ranges known to be supported.
+    Checks if all characters in the string can be rendered with the font of the letter.
+    The check uses the glyph coverage index built from the font that ReportLab embeds.
 
     Parameters:
     - s: A string to be checked.
@@ -188,36 +211,282 @@ def _check_supported_by_times_new_roman(s):
     Raises:
         CharactersNotSupported: If the string contains characters not supported by Times New Roman
     """
-    supported_ranges = [
-        ("\u0020", "\u007E"),  # Basic ASCII
-        ("\u00A0", "\u00FF"),  # Latin-1 Supplement
-        ("\u0100", "\u017F"),  # Latin Extended-A
-        ("\u0180", "\u024F"),  # Latin Extended-B (partial)
-        ("\u0370", "\u03FF"),  # Greek and Coptic
-        ("\u0400", "\u04FF"),  # Cyrillic
-        # Add more ranges as needed
+    unsupported_characters = pdf_gen.get_glyph_coverage().find_unsupported(s)
+    if len(unsupported_characters) > 0:
+        raise CharactersNotSupported(
+            f"Following characters are not supported: {unsupported_characters}"
+        )
+
+
+async def _create_chat_completion(
+    messages: list[dict[str, str]], policy: HedgePolicy, model: str = "gpt-3.5-turbo"
+) -> str:
+    """Runs a chat completion hedged according to the given policy
+
+    Args:
+        messages (list[dict[str, str]]): The messages passed to the model
+        policy (HedgePolicy): The hedge policy deciding on timeouts and duplicates
+        model (str): The model to use
+
+    Returns:
+        str: The content of the first completion that finished
+    """
+
+    async def request(timeout: float) -> str:
+        completion = await get_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,  # type: ignore
+            timeout=timeout,
+        )
+        assert completion.choices is not None
+        assert completion.choices[0].message.content is not None
+        return completion.choices[0].message.content
+
+    return await hedged_request(request, policy)
+
+
+async def _stream_chat_completion(
+    messages: list[dict[str, str]],
+    policy: HedgePolicy,
+    layout: pdf_gen.LetterLayout,
+    model: str = "gpt-3.5-turbo",
+) -> str:
+    """Runs a streamed chat completion and lays out paragraphs as they arrive
+
+    The time until the first chunk arrives is hedged according to the policy, once a
+    stream delivered its first chunk the other one is closed. Every chunk is checked
+    for characters the letter font can't render so that we can abort early instead of
+    waiting for the full completion.
+
+    Args:
+        messages (list[dict[str, str]]): The messages passed to the model
+        policy (HedgePolicy): The hedge policy of the time to the first chunk
+        layout (pdf_gen.LetterLayout): Receives every completed paragraph
+        model (str): The model to use
+
+    Returns:
+        str: The full content of the completion
+
+    Raises:
+        CharactersNotSupported: As soon as a chunk contains unsupported characters
+    """
+
+    async def open_stream(
+        timeout: float,
+    ) -> tuple[
+        AsyncStream[ChatCompletionChunk],
+        t.AsyncIterator[ChatCompletionChunk],
+        ChatCompletionChunk | None,
+    ]:
+        stream = t.cast(
+            "AsyncStream[ChatCompletionChunk]",
+            await get_openai_client().chat.completions.create(
+                model=model,
+                messages=messages,  # type: ignore
+                timeout=timeout,
+                stream=True,
+            ),
+        )
+        chunks = aiter(stream)
+        try:
+            first_chunk = await anext(chunks, None)
+        except BaseException:
+            # also closes the stream of a request that lost the race
+            await stream.close()
+            raise
+        return stream, chunks, first_chunk
+
+    async def close_stream(
+        opened: tuple[
+            AsyncStream[ChatCompletionChunk],
+            t.AsyncIterator[ChatCompletionChunk],
+            ChatCompletionChunk | None,
+        ]
+    ) -> None:
+        # both requests delivered their first chunk at the same time
+        await opened[0].close()
+
+    stream, chunks, chunk = await hedged_request(
+        open_stream, policy, on_discard=close_stream
+    )
+    content = ""
+    pending_paragraph = ""
+    try:
+        while chunk is not None:
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                delta = chunk.choices[0].delta.content
+                _check_supported_by_times_new_roman(delta)
+                content += delta
+                *paragraphs, pending_paragraph = (pending_paragraph + delta).split("\n")
+                for paragraph in paragraphs:
+                    layout.add_paragraph(paragraph)
+            chunk = await anext(chunks, None)
+    finally:
+        await stream.close()
+    layout.add_paragraph(pending_paragraph)
+    return content
+
+
+def _letter_prompt(transcript: str, optional_user_prompt: str) -> str:
+    return f"Instructions: Turn the transcript below into a letter. Correct mistakes that my have arisen from a (faulty) transcription of the audio. \n\n {optional_user_prompt}\n\nTranscript of the message: \n{transcript} \n\nYour letter:\n"
+
+
+def _split_transcript(transcript: str, max_length: int) -> list[str]:
+    """Splits a transcript into segments of at most max_length characters
+
+    Segments are only cut at sentence boundaries, unless a single sentence is longer
+    than max_length.
+
+    Args:
+        transcript (str): The transcript
+        max_length (int): The maximum number of characters per segment
+
+    Returns:
+        list[str]: The segments in their original order
+    """
+    sentences = re.split(r"(?<=[.!?])\s+", transcript.strip())
+    segments: list[str] = []
+    current = ""
+    for sentence in sentences:
+        while len(sentence) > max_length:
+            if current:
+                segments.append(current)
+                current = ""
+            segments.append(sentence[:max_length])
+            sentence = sentence[max_length:]
+        if current and len(current) + 1 + len(sentence) > max_length:
+            segments.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+async def _single_shot_letter_text(
+    transcript: str,
+    system_msg: str,
+    optional_user_prompt: str,
+    layout: pdf_gen.LetterLayout | None = None,
+) -> str:
+    messages = [
+        {"role": "system", "content": system_msg},
+        {"role": "user", "content": _letter_prompt(transcript, optional_user_prompt)},
     ]
 
-    s = s.replace("\n", "")
-    unsupported_characters = set()
+    # feed into gpt:
+    if layout is not None:
+        # the stream is checked for unsupported characters while it arrives
+        return await _stream_chat_completion(
+            messages, letter_first_chunk_policy, layout
+        )
+
+    letter = await _create_chat_completion(messages, letter_generation_policy)
+    # check whether we only have latin letters
+    _check_supported_by_times_new_roman(letter)
+    return letter
 
-    for c in s:
-        if not any(start <= c <= end for start, end in supported_ranges):
-            unsupported_characters.add(c)
 
-    if len(unsupported_characters) > 0:
-        raise CharactersNotSupported(
-            "Following characters are not supported: {unsupported_characters}"
+async def _map_reduce_letter_text(
+    transcript: str,
+    system_msg: str,
+    optional_user_prompt: str,
+    layout: pdf_gen.LetterLayout | None = None,
+) -> str:
+    """Turns a long transcript into a letter by generating its sections concurrently
+
+    The transcript is split into segments which are turned into letter sections in
+    parallel. A cheap stitching pass then rewrites the opening paragraph of every
+    section but the first so that it flows on from the previous one.
+
+    Args:
+        transcript (str): The transcript
+        system_msg (str): The system prompt used for all completions
+        optional_user_prompt (str): Additional instructions by the user
+        layout (pdf_gen.LetterLayout | None): If provided, receives the final letter
+
+    Returns:
+        str: The letter text
+    """
+    segments = _split_transcript(transcript, TRANSCRIPT_SEGMENT_LENGTH)
+    logger.info(f"Generating letter from {len(segments)} transcript segments")
+
+    def section_prompt(idx: int, segment: str) -> str:
+        if idx == 0:
+            position = "This is the beginning of the letter. Start with a greeting but don't sign off."
+        elif idx == len(segments) - 1:
+            position = "This is the end of the letter. Don't greet the reader again but end with a sign-off."
+        else:
+            position = "This is the middle of the letter. Neither greet the reader nor sign off."
+        return (
+            f"Instructions: The transcript below is part {idx + 1} of {len(segments)} of a longer voice message. "
+            f"Turn it into the corresponding section of a letter. {position} Correct mistakes that my have arisen "
+            f"from a (faulty) transcription of the audio. \n\n {optional_user_prompt}\n\n"
+            f"Transcript of this part of the message: \n{segment} \n\nYour letter section:\n"
+        )
+
+    sections = await asyncio.gather(
+        *[
+            _create_chat_completion(
+                [
+                    {"role": "system", "content": system_msg},
+                    {"role": "user", "content": section_prompt(idx, segment)},
+                ],
+                letter_section_policy,
+            )
+            for idx, segment in enumerate(segments)
+        ]
+    )
+    sections = [section.strip() for section in sections]
+
+    async def stitch(previous_section: str, section: str) -> str:
+        previous_paragraph = previous_section.split("\n")[-1]
+        opening_paragraph, _, rest = section.partition("\n")
+        prompt = (
+            "Instructions: Below are the last paragraph of one section of a letter and the first paragraph "
+            "of the following section. Rewrite the first paragraph of the following section so that it "
+            "flows on naturally from the previous one. Don't add a greeting and keep its content and "
+            "language. Only return the rewritten paragraph.\n\n"
+            f"Last paragraph of the previous section:\n{previous_paragraph}\n\n"
+            f"First paragraph of the following section:\n{opening_paragraph}\n\nRewritten paragraph:\n"
+        )
+        rewritten = await _create_chat_completion(
+            [
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": prompt},
+            ],
+            letter_stitch_policy,
         )
+        return "\n".join(x for x in [rewritten.strip(), rest] if x)
+
+    stitched = await asyncio.gather(
+        *[stitch(sections[idx - 1], sections[idx]) for idx in range(1, len(sections))]
+    )
+    letter = "\n".join([sections[0], *stitched])
+    # check whether we only have latin letters
+    _check_supported_by_times_new_roman(letter)
+    if layout is not None:
+        layout.add_text(letter)
+    return letter
 
 
 async def transcript_to_letter_text(
-    transcript: str, user_id: str, uow: AbstractUnitOfWork
+    transcript: str,
+    user_id: str,
+    uow: AbstractUnitOfWork,
+    layout: pdf_gen.LetterLayout | None = None,
 ) -> str:
     """Converts a transcript to a letter text
 
+    Transcripts longer than LONG_TRANSCRIPT_THRESHOLD are converted section by
+    section, see `_map_reduce_letter_text`.
+
     Args:
         transcript (str): The transcript
+        user_id (str): The id of the user whose prompt should be used
+        uow (AbstractUnitOfWork): The unit of work
+        layout (pdf_gen.LetterLayout | None): If provided, the letter's paragraphs
+            are laid out as they arrive
 
     Returns:
         str: The letter text
@@ -226,27 +495,15 @@ async def transcript_to_letter_text(
     user = uow.users.get_one(user_id)
     optional_user_prompt = ""
     if user.prompt:
-        optional_user_prompt = "Additional user instructions: {retrieved_user.prompt}"
-
-    final_prompt = f"Instructions: Turn the transcript below into a letter. Correct mistakes that my have arisen from a (faulty) transcription of the audio. \n\n {optional_user_prompt}\n\nTranscript of the message: \n{transcript} \n\nYour letter:\n"
+        optional_user_prompt = f"Additional user instructions: {user.prompt}"
 
-    # feed into gpt:
-    completion = await openai_client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": final_prompt},
-        ],
-        # 5 tokens per second, assumed mean character length of 4 per token
-        timeout=30,  # len(final_prompt)/(4*5),
+    if len(transcript) > LONG_TRANSCRIPT_THRESHOLD:
+        return await _map_reduce_letter_text(
+            transcript, system_msg, optional_user_prompt, layout
+        )
+    return await _single_shot_letter_text(
+        transcript, system_msg, optional_user_prompt, layout
     )
-    assert completion.choices is not None
-    assert completion.choices[0].message.content is not None
-    transcript = completion.choices[0].message.content
-    # check whether we only have latin letters
-    _check_supported_by_times_new_roman(transcript)
-
-    return transcript  # type: ignore
 
 
 async def implement_letter_edits(
@@ -266,12 +523,10 @@ async def implement_letter_edits(
     system_message = uow.system_messages.get_msg("edit-prompt-system_message")
     full_prompt = edit_prompt.format(old_content, edit_instructions)
     # feed into gpt:
-    completion = await openai_client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
+    return await _create_chat_completion(
+        [
             {"role": "system", "content": system_message},
             {"role": "user", "content": full_prompt},
         ],
+        letter_edit_policy,
     )
-    out: str = completion.choices[0].message.content  # type: ignore
-    return out
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import typing as t
+
+import httpx
+
+from grannymail.logger import logger
+from grannymail.utils.lazy import lazy_import
+
+if t.TYPE_CHECKING:
+    import pandas as pd
+else:
+    pd = lazy_import("pandas")
+
+# Seconds during which lookups are served from memory without asking for changes
+REVALIDATE_INTERVAL = 30
+REQUEST_TIMEOUT = 10
+
+
+class SheetFetcher:
+    """Fetches a CSV export of a spreadsheet and keeps it indexed in memory.
+
+    The sheet is revalidated at most every `revalidate_interval` seconds with a
+    conditional request (ETag/Last-Modified). It is only parsed again if the content
+    actually changed, and the last version is stored as a local snapshot that is used
+    after a restart or if the sheet can't be reached. If `local_path` is set, the CSV
+    file at that path stands in for the spreadsheet.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        local_path: str | None = None,
+        snapshot_path: str | None = None,
+        revalidate_interval: float = REVALIDATE_INTERVAL,
+    ):
+        self.url = url
+        self.local_path = local_path
+        self.snapshot_path = snapshot_path
+        self.revalidate_interval = revalidate_interval
+        self._lock = threading.Lock()
+        self._df: pd.DataFrame | None = None
+        # message_identifier -> row positions in the dataframe
+        self._index: dict[str, list[int]] = {}
+        self._content_hash: str | None = None
+        self._etag: str | None = None
+        self._last_modified: str | None = None
+        self._checked_at: float | None = None
+
+    def get_dataframe(self) -> pd.DataFrame:
+        """Returns a copy of the current sheet."""
+        with self._lock:
+            self._maybe_refresh()
+            assert self._df is not None
+            return self._df.copy()
+
+    def get_value(self, identifier: str, column: str) -> str:
+        """Looks up a cell by the row's message identifier and the column name.
+
+        Raises:
+            ValueError: If there is no or more than one row with this identifier.
+        """
+        with self._lock:
+            self._maybe_refresh()
+            assert self._df is not None
+            rows = self._index.get(identifier, [])
+            if len(rows) == 0:
+                raise ValueError(f"Could not find prompt {identifier} in spreadsheet")
+            elif len(rows) > 1:
+                raise ValueError(
+                    f"Found multiple prompts with name {identifier} in spreadsheet"
+                )
+            return self._df[column].iloc[rows[0]]
+
+    def invalidate(self) -> None:
+        """Makes the next lookup check the sheet for changes."""
+        with self._lock:
+            self._checked_at = None
+
+    def _maybe_refresh(self) -> None:
+        now = time.monotonic()
+        if (
+            self._df is not None
+            and self._checked_at is not None
+            and now - self._checked_at < self.revalidate_interval
+        ):
+            return
+        if self._df is None:
+            self._load_snapshot()
+        try:
+            self._refresh()
+        except (httpx.HTTPError, OSError) as e:
+            if self._df is None:
+                raise
+            logger.warning(f"Could not refresh sheet, using the last version: {e}")
+        self._checked_at = now
+
+    def _refresh(self) -> None:
+        if self.local_path is not None:
+            with open(self.local_path, "rb") as f:
+                self._load(f.read())
+            return
+
+        headers = {}
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified is not None:
+            headers["If-Modified-Since"] = self._last_modified
+        r = httpx.get(
+            self.url, headers=headers, timeout=REQUEST_TIMEOUT, follow_redirects=True
+        )
+        if r.status_code == httpx.codes.NOT_MODIFIED and self._df is not None:
+            return
+        r.raise_for_status()
+        self._etag = r.headers.get("ETag")
+        self._last_modified = r.headers.get("Last-Modified")
+        if self._load(r.content):
+            self._save_snapshot(r.content)
+
+    def _load(self, content: bytes) -> bool:
+        """Parses and indexes the content unless it is unchanged. Returns whether the
+        content changed."""
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == self._content_hash:
+            return False
+        df = pd.read_csv(io.BytesIO(content))
+        index: dict[str, list[int]] = {}
+        if "message_identifier" in df.columns:
+            for position, identifier in enumerate(df["message_identifier"]):
+                index.setdefault(identifier, []).append(position)
+        self._df, self._index, self._content_hash = df, index, content_hash
+        logger.info(f"Loaded sheet with {len(df)} rows")
+        return True
+
+    def _save_snapshot(self, content: bytes) -> None:
+        if self.snapshot_path is None:
+            return
+        try:
+            with open(self.snapshot_path, "wb") as f:
+                f.write(content)
+            with open(self.snapshot_path + ".json", "w") as f:
+                json.dump({"etag": self._etag, "last_modified": self._last_modified}, f)
+        except OSError as e:
+            logger.warning(f"Could not store sheet snapshot: {e}")
+
+    def _load_snapshot(self) -> None:
+        if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                self._load(f.read())
+            with open(self.snapshot_path + ".json") as f:
+                meta = json.load(f)
+            self._etag, self._last_modified = meta["etag"], meta["last_modified"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load sheet snapshot: {e}")
@@ -1,9 +1,13 @@
+from __future__ import annotations
+
 import typing as t
 from datetime import datetime, timedelta, timezone
 
-import pandas as pd
-
 import grannymail.config as cfg
+from grannymail.utils.sheet_fetcher import SheetFetcher
+
+if t.TYPE_CHECKING:
+    import pandas as pd
 
 
 def get_utc_timestamp(delta: t.Optional[timedelta] = None) -> str:
@@ -13,27 +17,28 @@ def get_utc_timestamp(delta: t.Optional[timedelta] = None) -> str:
     return now_utc.isoformat()
 
 
-def get_message_spreadsheet() -> pd.DataFrame:
-    # these are ok to be public.
-    spreadsheet_key = "1FnY5mVvY48nvtMz8mi9rUq7gKLyJ-TpYc-ANAOwdu-0"
-    sheet_name = "messages"
+# these are ok to be public.
+SPREADSHEET_KEY = "1FnY5mVvY48nvtMz8mi9rUq7gKLyJ-TpYc-ANAOwdu-0"
+SHEET_NAME = "messages"
+# Construct the URL to retrieve data from Google Sheets
+SHEET_URL = f"https://docs.google.com/spreadsheets/d/{SPREADSHEET_KEY}/gviz/tq?tqx=out:csv&sheet={SHEET_NAME}"
+
+message_sheet = SheetFetcher(
+    SHEET_URL,
+    local_path=cfg.MESSAGES_SHEET_PATH,
+    snapshot_path=cfg.MESSAGES_SHEET_SNAPSHOT_PATH,
+)
 
-    # Construct the URL to retrieve data from Google Sheets
-    url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_key}/gviz/tq?tqx=out:csv&sheet={sheet_name}"
 
-    # Read the Google Spreadsheet into a Pandas DataFrame
-    return pd.read_csv(url)
+def get_message_spreadsheet(revalidate: bool = False) -> pd.DataFrame:
+    """Returns the message sheet, checking it for changes first if `revalidate` is
+    set instead of serving a copy that may be up to a revalidation interval old."""
+    if revalidate:
+        message_sheet.invalidate()
+    return message_sheet.get_dataframe()
 
 
 def get_prompt_from_sheet(
     prompt_name: str, version: str = cfg.MESSAGES_SHEET_NAME
 ) -> str:
-    df = get_message_spreadsheet()
-    df_subset = df[df["message_identifier"] == prompt_name][version]
-    if df_subset.shape[0] == 0:
-        raise ValueError(f"Could not find prompt {prompt_name} in spreadsheet")
-    elif df_subset.shape[0] > 1:
-        raise ValueError(
-            f"Found multiple prompts with name {prompt_name} in spreadsheet"
-        )
-    return df_subset.iloc[0]
+    return message_sheet.get_value(prompt_name, version)
@@ -0,0 +1,50 @@
+"""Compares the latency of single-shot and map-reduce letter generation.
+
+Run from the chatbot directory with `python -m scripts.benchmark_letter_generation`.
+Requires a valid OPENAI_API_KEY as all completions are real requests.
+"""
+
+import asyncio
+import statistics
+import time
+
+from grannymail.utils import message_utils
+from grannymail.utils.utils import get_prompt_from_sheet
+
+NUM_RUNS = 3
+# the example transcript is repeated to simulate a very long voice memo
+TRANSCRIPT_REPETITIONS = 6
+
+
+async def time_run(fn, transcript: str, system_msg: str) -> tuple[float, int]:
+    start = time.monotonic()
+    letter = await fn(transcript, system_msg, "")
+    return time.monotonic() - start, len(letter)
+
+
+async def main():
+    system_msg = get_prompt_from_sheet("system-prompt-letter_prompt")
+    with open("tests/test_data/example_transcript.txt") as f:
+        transcript = " ".join([f.read().strip()] * TRANSCRIPT_REPETITIONS)
+    print(
+        f"Transcript length: {len(transcript)} characters "
+        f"(threshold: {message_utils.LONG_TRANSCRIPT_THRESHOLD})"
+    )
+
+    for name, fn in [
+        ("single-shot", message_utils._single_shot_letter_text),
+        ("map-reduce", message_utils._map_reduce_letter_text),
+    ]:
+        durations = []
+        for _ in range(NUM_RUNS):
+            duration, letter_length = await time_run(fn, transcript, system_msg)
+            durations.append(duration)
+            print(f"{name}: {duration:.1f}s ({letter_length} characters)")
+        print(
+            f"{name}: mean {statistics.mean(durations):.1f}s, "
+            f"max {max(durations):.1f}s over {NUM_RUNS} runs\n"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""Measures how long importing the FastAPI app takes, i.e. the cold start of a container.
+
+Run from the chatbot directory with `python -m scripts.benchmark_startup`. Every run
+imports the app in a fresh interpreter with `python -X importtime` and the script
+exits with a non-zero status if the median exceeds the import-time budget or one of
+the deferred dependencies was imported eagerly.
+"""
+
+import statistics
+import subprocess
+import sys
+
+APP_MODULE = "grannymail.entrypoints.api.fastapi"
+NUM_RUNS = 5
+NUM_SLOWEST_MODULES = 15
+# seconds, measured on a laptop; containers are slower so keep some headroom
+IMPORT_BUDGET = 1.5
+# heavy dependencies that must only be imported on first use
+DEFERRED_MODULES = ["pandas", "numpy", "reportlab", "stripe", "openai", "rapidfuzz"]
+
+
+def import_times() -> dict[str, int]:
+    """Imports the app in a fresh interpreter and returns the cumulative import time
+    of every module in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {APP_MODULE}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit():
+            times[module.strip()] = int(cumulative)
+    return times
+
+
+def main() -> int:
+    runs = [import_times() for _ in range(NUM_RUNS)]
+    totals = [run[APP_MODULE] / 1e6 for run in runs]
+    median = statistics.median(totals)
+
+    print(f"Import of {APP_MODULE} over {NUM_RUNS} runs:")
+    print(f"  median {median:.2f}s, min {min(totals):.2f}s, max {max(totals):.2f}s")
+    print(f"  budget {IMPORT_BUDGET:.2f}s\n")
+
+    print("Slowest imports including their dependencies (last run):")
+    last_run = runs[-1]
+    modules = {k: v for k, v in last_run.items() if k != APP_MODULE}
+    for module, micros in sorted(modules.items(), key=lambda x: -x[1])[
+        :NUM_SLOWEST_MODULES
+    ]:
+        print(f"  {micros / 1e3:8.1f}ms  {module}")
+
+    eager = [m for m in DEFERRED_MODULES if m in last_run]
+    if eager:
+        print(f"\nDeferred modules imported eagerly: {', '.join(eager)}")
+    if median > IMPORT_BUDGET or eager:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
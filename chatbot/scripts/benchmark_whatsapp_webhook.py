@@ -0,0 +1,98 @@
+"""Measures how many status-only deliveries per second the WhatsApp webhook handles.
+
+Run from the chatbot directory with `python -m scripts.benchmark_whatsapp_webhook`.
+Requests go through the full ASGI stack in-process, so the numbers exclude network
+and server overhead. For comparison the script also times validating the same
+payload with the pydantic model, which the webhook did for every delivery before.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+
+from grannymail.entrypoints.api.fastapi import app
+from grannymail.integrations.messengers.whatsapp import WebhookRequestData
+
+NUM_REQUESTS = 5000
+CONCURRENCY = 50
+NUM_STATUSES = 3
+
+STATUS_PAYLOAD = {
+    "object": "whatsapp_business_account",
+    "entry": [
+        {
+            "id": "206144975918077",
+            "changes": [
+                {
+                    "value": {
+                        "messaging_product": "whatsapp",
+                        "metadata": {
+                            "display_phone_number": "15551291301",
+                            "phone_number_id": "196914110180497",
+                        },
+                        "statuses": [
+                            {
+                                "id": f"wamid.{i}",
+                                "status": "delivered",
+                                "timestamp": "1706312529",
+                                "recipient_id": "4915159922222",
+                                "conversation": {
+                                    "id": "c3ab5c1e0b1b4e2e9a3c7f0d8e6b2a1f",
+                                    "origin": {"type": "service"},
+                                },
+                                "pricing": {
+                                    "billable": True,
+                                    "pricing_model": "CBP",
+                                    "category": "service",
+                                },
+                            }
+                            for i in range(NUM_STATUSES)
+                        ],
+                    },
+                    "field": "messages",
+                }
+            ],
+        }
+    ],
+}
+
+
+async def status_flood(body: bytes) -> float:
+    """Posts the body NUM_REQUESTS times and returns the requests per second."""
+    transport = httpx.ASGITransport(app=app)  # type: ignore
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+        async def post():
+            async with semaphore:
+                response = await client.post("/api/whatsapp/", content=body)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[post() for _ in range(NUM_REQUESTS)])
+        return NUM_REQUESTS / (time.perf_counter() - start)
+
+
+def model_validation_rate(body: bytes) -> float:
+    """Returns how many times per second the body can be validated into the model."""
+    start = time.perf_counter()
+    for _ in range(NUM_REQUESTS):
+        WebhookRequestData.model_validate_json(body)
+    return NUM_REQUESTS / (time.perf_counter() - start)
+
+
+def main():
+    # httpx logs every request, which would dominate the measurement
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    body = json.dumps(STATUS_PAYLOAD).encode()
+    print(f"Payload: {len(body)} bytes with {NUM_STATUSES} statuses")
+    print(f"Webhook: {asyncio.run(status_flood(body)):.0f} requests/s")
+    print(f"Model validation alone: {model_validation_rate(body):.0f} payloads/s")
+
+
+if __name__ == "__main__":
+    main()
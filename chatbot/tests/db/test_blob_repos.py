@@ -0,0 +1,56 @@
+from unittest.mock import ANY, Mock
+
+import pytest
+
+from grannymail.db import blob_repos
+from tests.fake_repositories import FakeBlobRepo
+
+
+def _supabase_blobs(stored_names: list[str]) -> blob_repos.DraftBlobRepository:
+    """Returns blob storage whose folders list the given blob names."""
+    client = Mock()
+    client.storage.from_.return_value.list.return_value = [
+        {"name": name} for name in stored_names
+    ]
+    return blob_repos.DraftBlobRepository(client)
+
+
+def test_blob_path_is_derived_from_content():
+    blobs = FakeBlobRepo("drafts")
+    path = blobs.upload(b"letter", "application/pdf")
+    assert path.startswith("drafts/") and path.endswith(".pdf")
+    assert blobs.upload(b"letter", "application/pdf") == path
+    assert blobs.upload(b"other letter", "application/pdf") != path
+    assert blobs.upload(b"letter", "audio/ogg") != path
+
+
+def test_identical_content_is_uploaded_once():
+    blobs = FakeBlobRepo("memos")
+    for _ in range(3):
+        path = blobs.upload(b"memo", "audio/ogg")
+    assert blobs.num_uploads == 1
+    assert blobs.download(path) == b"memo"
+
+
+def test_unsupported_mime_type_is_rejected():
+    with pytest.raises(ValueError):
+        FakeBlobRepo("drafts").upload(b"image", "image/png")
+
+
+def test_stored_blob_is_not_uploaded_again():
+    blobs = _supabase_blobs(["abc.pdf"])
+
+    assert blobs.upload_to(b"letter", "drafts/ab/abc.pdf", "application/pdf") == (
+        "drafts/ab/abc.pdf"
+    )
+
+    blobs.blob_manager.list.assert_called_once_with("drafts/ab", ANY)
+    blobs.blob_manager.upload.assert_not_called()
+
+
+def test_missing_blob_is_uploaded():
+    blobs = _supabase_blobs(["abcd.pdf"])
+
+    blobs.upload_to(b"letter", "drafts/ab/abc.pdf", "application/pdf")
+
+    blobs.blob_manager.upload.assert_called_once()
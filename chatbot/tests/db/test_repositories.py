@@ -6,6 +6,7 @@ from faker import Faker
 import grannymail.db.repositories as repos
 import grannymail.domain.models as m
 from grannymail.services.unit_of_work import SupabaseUnitOfWork
+from tests.utils import create_credit_entry
 
 
 class TestRepositoryBase:
@@ -111,3 +112,69 @@ class TestUserRepository:
         user_repo.delete(user.user_id)
         user_retrieved = user_repo.maybe_get_one(id=user.user_id)
         assert user_retrieved is None
+
+
+class TestOrderRepository:
+    def test_transition_and_adjust_credits(
+        self, fake_uow, user, wa_message, address, draft, order
+    ):
+        with fake_uow:
+            fake_uow.users.add(user)
+            fake_uow.credit_ledger.add(create_credit_entry(user, 1))
+            fake_uow.wa_messages.add(wa_message)
+            fake_uow.addresses.add(address)
+            fake_uow.drafts.add(draft)
+            fake_uow.orders.add(order)
+
+            # the order is claimed and the credit is charged
+            assert fake_uow.orders.transition_and_adjust_credits(
+                order.order_id, "payment_pending", "paid", credit_delta=-1
+            ) == (True, 0)
+            # a concurrent second claim only adds the credits
+            assert fake_uow.orders.transition_and_adjust_credits(
+                order.order_id,
+                "payment_pending",
+                "paid",
+                credits_added=5,
+                credit_delta=-1,
+            ) == (False, 5)
+
+            assert fake_uow.orders.get_one(order.order_id).status == "paid"
+            assert fake_uow.credit_ledger.get_balance(user.user_id) == 5
+
+    def test_transition_requires_enough_credits(
+        self, fake_uow, user, wa_message, address, draft, order
+    ):
+        with fake_uow:
+            fake_uow.users.add(user)
+            fake_uow.wa_messages.add(wa_message)
+            fake_uow.addresses.add(address)
+            fake_uow.drafts.add(draft)
+            fake_uow.orders.add(order)
+
+            assert fake_uow.orders.transition_and_adjust_credits(
+                order.order_id, "payment_pending", "paid", credit_delta=-1
+            ) == (False, 0)
+            assert fake_uow.orders.get_one(order.order_id).status == "payment_pending"
+
+
+class TestCreditLedgerRepository:
+    def test_balance_sums_entries(self, fake_uow, user):
+        with fake_uow:
+            fake_uow.users.add(user)
+            fake_uow.credit_ledger.add(create_credit_entry(user, 5))
+            fake_uow.credit_ledger.add(create_credit_entry(user, -1))
+            assert fake_uow.credit_ledger.get_balance(user.user_id) == 4
+
+            # compaction keeps the balance
+            fake_uow.credit_ledger.compact()
+            assert fake_uow.credit_ledger.get_balance(user.user_id) == 4
+
+    def test_ledger_is_append_only(self, fake_uow, user):
+        with fake_uow:
+            fake_uow.users.add(user)
+            entry = fake_uow.credit_ledger.add(create_credit_entry(user, 5))
+            with pytest.raises(repos.LedgerIsAppendOnlyError):
+                fake_uow.credit_ledger.update(entry)
+            with pytest.raises(repos.LedgerIsAppendOnlyError):
+                fake_uow.credit_ledger.delete(entry.entry_id)
@@ -1,7 +1,54 @@
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+
 import grannymail.db.tasks as db_tasks
+import grannymail.domain.models as m
 from grannymail.services.unit_of_work import SupabaseUnitOfWork
 
 
 def test_synchronise_sheet_with_db():
     uow = SupabaseUnitOfWork()
     db_tasks.synchronise_sheet_with_db(uow)
+
+
+def test_diff_system_messages():
+    current = {"unchanged": "a", "changed": "b", "removed": "c"}
+    target = {"unchanged": "a", "changed": "B", "added": "d"}
+
+    upserts, deletes = db_tasks.diff_system_messages(current, target)
+
+    assert upserts == [
+        m.SystemMessage(message_identifier="changed", message_body="B"),
+        m.SystemMessage(message_identifier="added", message_body="d"),
+    ]
+    assert deletes == ["removed"]
+
+
+def test_synchronise_sheet_with_db_writes_only_changes():
+    uow = MagicMock()
+    uow.system_messages.get_all.return_value = [
+        m.SystemMessage(message_identifier="unchanged", message_body="a"),
+        m.SystemMessage(message_identifier="removed", message_body="c"),
+    ]
+    sheet = pd.DataFrame(
+        {
+            "message_identifier": ["unchanged", "added", "empty"],
+            "message_body": ["a", "d", None],
+            "comment": ["", "", ""],
+        }
+    )
+
+    with patch.object(
+        db_tasks, "get_message_spreadsheet", return_value=sheet
+    ) as mock_get_sheet:
+        db_tasks.synchronise_sheet_with_db(uow)
+
+    # the sheet is checked for changes instead of reading the cached copy
+    mock_get_sheet.assert_called_once_with(revalidate=True)
+
+    uow.system_messages.sync.assert_called_once_with(
+        [m.SystemMessage(message_identifier="added", message_body="d")], ["removed"]
+    )
+    uow.system_messages.add.assert_not_called()
+    uow.system_messages.delete.assert_not_called()
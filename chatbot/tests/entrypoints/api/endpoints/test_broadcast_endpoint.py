@@ -0,0 +1,74 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from grannymail.entrypoints.api.endpoints import broadcast
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("admin_token", [None, "secret"])
+async def test_broadcast_endpoint_requires_admin_token(async_client, admin_token):
+    with patch.object(broadcast.cfg, "ADMIN_TOKEN", admin_token):
+        response = await async_client.post(
+            "/api/broadcast/holidays",
+            params={"message_identifier": "broadcast-holidays"},
+            headers={"X-Admin-Token": "wrong"},
+        )
+    assert response.status_code == 403
+    assert broadcast.running == {}
+
+
+@pytest.mark.asyncio
+async def test_broadcast_endpoint_runs_broadcast_in_server_process(async_client):
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def run(broadcast_id, message_identifier):
+        started.set()
+        await finish.wait()
+
+    with patch.object(broadcast.cfg, "ADMIN_TOKEN", "secret"), patch.object(
+        broadcast, "Broadcaster"
+    ) as mock_broadcaster:
+        mock_broadcaster.return_value.run = AsyncMock(side_effect=run)
+        request = dict(
+            params={"message_identifier": "broadcast-holidays"},
+            headers={"X-Admin-Token": "secret"},
+        )
+        response = await async_client.post("/api/broadcast/holidays", **request)
+        assert response.status_code == 202
+        await started.wait()
+
+        # a broadcast that is running isn't started twice
+        response = await async_client.post("/api/broadcast/holidays", **request)
+        assert response.json()["status"] == "running"
+
+        task = broadcast.running["holidays"]
+        finish.set()
+        await task
+
+    mock_broadcaster.return_value.run.assert_awaited_once_with(
+        "holidays", "broadcast-holidays"
+    )
+    assert broadcast.running == {}
+
+
+@pytest.mark.asyncio
+async def test_broadcast_endpoint_skips_broadcast_running_on_another_worker(
+    async_client,
+):
+    with patch.object(broadcast.cfg, "ADMIN_TOKEN", "secret"), patch.object(
+        broadcast, "Broadcaster"
+    ) as mock_broadcaster:
+        mock_broadcaster.return_value.claim.return_value = False
+        response = await async_client.post(
+            "/api/broadcast/holidays",
+            params={"message_identifier": "broadcast-holidays"},
+            headers={"X-Admin-Token": "secret"},
+        )
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "running"
+    mock_broadcaster.return_value.run.assert_not_called()
+    assert broadcast.running == {}
@@ -1,8 +1,13 @@
-from unittest.mock import ANY, patch
+from datetime import timedelta
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
 
+import grannymail.domain.models as m
+from grannymail.entrypoints.api.endpoints import payment
 from grannymail.entrypoints.api.endpoints.payment import process_stripe_event
+from grannymail.utils import utils
+from tests.fake_repositories import FakeUnitOfWork
 
 
 @pytest.mark.asyncio
@@ -17,12 +22,8 @@ async def test_process_stripe_event(
     mock_handle_event.return_value = (was_dispatched, ref_message, 10, 12)
 
     # call
-    messenger_module = "whatsapp" if platform == "WhatsApp" else "telegram"
-    messenger_class = "Whatsapp" if platform == "WhatsApp" else "Telegram"
     with fake_uow:
-        with patch(
-            f"grannymail.integrations.messengers.{messenger_module}.{messenger_class}.reply_text"
-        ) as mock_messenger:
+        with patch.object(payment.outbox.sender, "notify") as mock_notify:
             await process_stripe_event({}, fake_uow)
 
         # assertions
@@ -31,4 +32,195 @@ async def test_process_stripe_event(
         else:
             msg_id = "stripe_webhook-success-no_dispatch"
         msg = fake_uow.system_messages.get_msg(msg_id).format(10, 12)
-        mock_messenger.assert_called_once_with(ANY, msg, fake_uow)
+        outbox_message = fake_uow.outbox.get_one(
+            None, filters={"ref_message_id": ref_message.message_id}
+        )
+        assert outbox_message.message_body == msg
+        assert outbox_message.messaging_platform == platform
+        mock_notify.assert_called_once()
+
+
+def _stored_event(event_id: str = "evt_1") -> m.StripeEvent:
+    return m.StripeEvent(
+        event_id=event_id,
+        type="checkout.session.completed",
+        payload={"id": event_id, "type": "checkout.session.completed"},
+        received_at=utils.get_utc_timestamp(),
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_stored_event_processes_event_once():
+    uow = FakeUnitOfWork()
+    uow.stripe_events.add(_stored_event())
+
+    with patch.object(payment, "process_stripe_event", new=AsyncMock()) as mock_process:
+        await payment.process_stored_event("evt_1", uow)
+        await payment.process_stored_event("evt_1", uow)
+
+    mock_process.assert_awaited_once()
+    stored_event = uow.stripe_events.get_one("evt_1")
+    assert stored_event.status == "processed"
+    assert stored_event.processed_at is not None
+
+
+@pytest.mark.asyncio
+async def test_process_stored_event_schedules_retry():
+    uow = FakeUnitOfWork()
+    uow.stripe_events.add(_stored_event())
+
+    with patch.object(
+        payment, "process_stripe_event", new=AsyncMock(side_effect=ValueError("boom"))
+    ):
+        await payment.process_stored_event("evt_1", uow)
+
+    stored_event = uow.stripe_events.get_one("evt_1")
+    assert stored_event.status == "failed"
+    assert stored_event.error == "boom"
+    assert stored_event.attempts == 1
+    assert stored_event.next_attempt_at > utils.get_utc_timestamp()
+    # not due before the backoff passed
+    assert uow.stripe_events.get_due(payment.CLAIM_LEASE) == []
+
+
+@pytest.mark.asyncio
+async def test_process_stored_event_retries_failed_event_when_due():
+    uow = FakeUnitOfWork()
+    stored_event = _stored_event()
+    stored_event.status = "failed"
+    stored_event.attempts = 1
+    stored_event.next_attempt_at = utils.get_utc_timestamp(timedelta(seconds=-1))
+    uow.stripe_events.add(stored_event)
+
+    with patch.object(payment, "process_stripe_event", new=AsyncMock()) as mock_process:
+        await payment.process_stored_event("evt_1", uow)
+
+    mock_process.assert_awaited_once()
+    stored_event = uow.stripe_events.get_one("evt_1")
+    assert stored_event.status == "processed"
+    assert stored_event.attempts == 2
+    assert stored_event.next_attempt_at is None
+
+
+@pytest.mark.asyncio
+async def test_process_stored_event_gives_up_after_max_attempts():
+    uow = FakeUnitOfWork()
+    stored_event = _stored_event()
+    stored_event.status = "failed"
+    stored_event.attempts = payment.MAX_ATTEMPTS - 1
+    stored_event.next_attempt_at = utils.get_utc_timestamp(timedelta(seconds=-1))
+    uow.stripe_events.add(stored_event)
+
+    with patch.object(
+        payment, "process_stripe_event", new=AsyncMock(side_effect=ValueError("boom"))
+    ):
+        await payment.process_stored_event("evt_1", uow)
+
+    stored_event = uow.stripe_events.get_one("evt_1")
+    assert stored_event.status == "failed"
+    assert stored_event.attempts == payment.MAX_ATTEMPTS
+    assert stored_event.next_attempt_at is None
+    assert uow.stripe_events.get_due(payment.CLAIM_LEASE) == []
+
+
+@pytest.mark.asyncio
+async def test_process_stored_event_recovers_expired_claim():
+    uow = FakeUnitOfWork()
+    stored_event = _stored_event()
+    stored_event.status = "processing"
+    stored_event.attempts = 1
+    stored_event.claimed_at = utils.get_utc_timestamp(
+        timedelta(seconds=-payment.CLAIM_LEASE - 1)
+    )
+    uow.stripe_events.add(stored_event)
+
+    with patch.object(payment, "process_stripe_event", new=AsyncMock()) as mock_process:
+        await payment.process_stored_event("evt_1", uow)
+
+    mock_process.assert_awaited_once()
+    stored_event = uow.stripe_events.get_one("evt_1")
+    assert stored_event.status == "processed"
+    assert stored_event.attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_process_stored_event_skips_claimed_event():
+    uow = FakeUnitOfWork()
+    stored_event = _stored_event()
+    stored_event.status = "processing"
+    stored_event.attempts = 1
+    stored_event.claimed_at = utils.get_utc_timestamp()
+    uow.stripe_events.add(stored_event)
+
+    with patch.object(payment, "process_stripe_event", new=AsyncMock()) as mock_process:
+        await payment.process_stored_event("evt_1", uow)
+
+    mock_process.assert_not_awaited()
+    assert uow.stripe_events.get_one("evt_1").status == "processing"
+
+
+@pytest.mark.asyncio
+async def test_retried_event_credits_purchase_once(user, wa_message, order):
+    uow = FakeUnitOfWork()
+    uow.users.add(user)
+    uow.messages.add(wa_message)
+    uow.orders.add(order)
+    uow.drafts_blob.upload_to(b"letter", order.blob_path, "application/pdf")
+    stored_event = _stored_event()
+    stored_event.payload["data"] = {
+        "object": {"client_reference_id": order.order_id, "payment_link": "plink_1"}
+    }
+    uow.stripe_events.add(stored_event)
+
+    with patch.object(payment.sp.catalog, "get_credits", return_value=3), patch.object(
+        payment.outbox.sender, "notify"
+    ), patch.object(uow.system_messages, "get_msg", return_value="{} {}"), patch(
+        "grannymail.domain.models.Pingen"
+    ) as mock_pingen:
+        # sending the letter fails after the purchase was credited
+        mock_pingen.return_value.upload_and_send_letter.side_effect = [
+            ValueError("Pingen is down"),
+            MagicMock(),
+        ]
+        await payment.process_stored_event("evt_1", uow)
+        assert uow.stripe_events.get_one("evt_1").status == "failed"
+        assert uow.credit_ledger.get_balance(user.user_id) == 3
+
+        stored_event = uow.stripe_events.get_one("evt_1")
+        stored_event.next_attempt_at = utils.get_utc_timestamp(timedelta(seconds=-1))
+        uow.stripe_events.update(stored_event)
+        await payment.process_stored_event("evt_1", uow)
+
+    assert uow.stripe_events.get_one("evt_1").status == "processed"
+    assert uow.orders.get_one(order.order_id).status == "transferred_to_pingen"
+    # the purchase is credited once, the letter is paid with one of its credits
+    assert uow.credit_ledger.get_balance(user.user_id) == 2
+
+
+def test_recover_unprocessed_events():
+    uow = FakeUnitOfWork()
+    uow.stripe_events.add(_stored_event("evt_1"))
+    processed_event = _stored_event("evt_2")
+    processed_event.status = "processed"
+    uow.stripe_events.add(processed_event)
+    claimed_event = _stored_event("evt_3")
+    claimed_event.status = "processing"
+    claimed_event.claimed_at = utils.get_utc_timestamp()
+    uow.stripe_events.add(claimed_event)
+    expired_event = _stored_event("evt_4")
+    expired_event.status = "processing"
+    expired_event.claimed_at = utils.get_utc_timestamp(
+        timedelta(seconds=-payment.CLAIM_LEASE - 1)
+    )
+    uow.stripe_events.add(expired_event)
+
+    with patch.object(payment, "event_queue") as mock_queue, patch.object(
+        payment, "_queued_event_ids", set()
+    ):
+        assert payment.recover_unprocessed_events(uow) == 2
+        # events that are still queued aren't queued twice
+        assert payment.recover_unprocessed_events(uow) == 2
+    assert [c.args for c in mock_queue.put_nowait.call_args_list] == [
+        ("evt_1",),
+        ("evt_4",),
+    ]
@@ -7,10 +7,7 @@ from tests.fake_repositories import FakeUnitOfWork
 
 @pytest.mark.asyncio
 async def test_telegram_endpoint_help_message(mocker):
-    msnger_mock = mocker.patch(
-        "grannymail.integrations.messengers.telegram.Telegram.reply_text",
-        new_callable=mocker.AsyncMock,
-    )
+    msnger_mock = mocker.patch("grannymail.services.outbox.enqueue_text")
     mocker.patch(
         "grannymail.services.unit_of_work.SupabaseUnitOfWork",
         new_callable=lambda: FakeUnitOfWork,
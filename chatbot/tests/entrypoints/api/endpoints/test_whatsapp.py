@@ -1,16 +1,13 @@
 import pytest
 
-from grannymail.entrypoints.api.endpoints.whatsapp import webhook_route
+from grannymail.entrypoints.api.endpoints.whatsapp import get_user_executor
 from tests import utils
 from tests.fake_repositories import FakeUnitOfWork
 
 
 @pytest.mark.asyncio
-async def test_whatsapp_endpoint_help_message(mocker):
-    msnger_mock = mocker.patch(
-        "grannymail.integrations.messengers.whatsapp.Whatsapp.reply_text",
-        new_callable=mocker.AsyncMock,
-    )
+async def test_whatsapp_endpoint_help_message(mocker, async_client):
+    msnger_mock = mocker.patch("grannymail.services.outbox.enqueue_text")
     mocker.patch(
         "grannymail.services.unit_of_work.SupabaseUnitOfWork",
         new_callable=lambda: FakeUnitOfWork,
@@ -18,9 +15,73 @@ async def test_whatsapp_endpoint_help_message(mocker):
     # Create a mock request data object
     data = utils._create_whatsapp_text_message(message_body="/help")
 
-    # Invoke the webhook_route function
-    response = await webhook_route(data)
+    # Post the delivery to the webhook
+    response = await async_client.post("/api/whatsapp/", content=data.model_dump_json())
+    # the message is processed in the background
+    await get_user_executor().join()
 
     # Assert the response status code and content
     assert response.status_code == 200
     msnger_mock.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_whatsapp_endpoint_acknowledges_status_updates(mocker, async_client):
+    submit_mock = mocker.patch(
+        "grannymail.entrypoints.api.endpoints.whatsapp.submit_messages"
+    )
+    data = utils._create_whatsapp_text_message(message_body="/help")
+    value = data.entry[0]["changes"][0]["value"]
+    del value["messages"]
+    value["statuses"] = [
+        {"id": "wamid.0", "status": "delivered", "timestamp": "1706312529"}
+    ]
+    tracker = mocker.patch(
+        "grannymail.entrypoints.api.endpoints.whatsapp.delivery_tracker"
+    )
+
+    response = await async_client.post("/api/whatsapp/", content=data.model_dump_json())
+
+    assert response.status_code == 200
+    assert response.json() == "ok"
+    submit_mock.assert_not_called()
+    tracker.record.assert_called_once_with(value["statuses"][0])
+
+
+@pytest.mark.asyncio
+async def test_whatsapp_endpoint_submits_messages_despite_malformed_status(
+    mocker, async_client
+):
+    submit_mock = mocker.patch(
+        "grannymail.entrypoints.api.endpoints.whatsapp.submit_messages"
+    )
+    data = utils._create_whatsapp_text_message(message_body="/help")
+    value = data.entry[0]["changes"][0]["value"]
+    value["statuses"] = [
+        {"id": "wamid.0", "status": "delivered"},
+        {"id": "wamid.1", "status": "read", "timestamp": "1706312529"},
+    ]
+    tracker = mocker.patch(
+        "grannymail.entrypoints.api.endpoints.whatsapp.delivery_tracker"
+    )
+    tracker.record.side_effect = [KeyError("timestamp"), None]
+
+    response = await async_client.post("/api/whatsapp/", content=data.model_dump_json())
+
+    assert response.status_code == 200
+    submit_mock.assert_called_once()
+    # the malformed status doesn't keep the others from being recorded
+    assert tracker.record.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_delivery_stats_require_admin_token(mocker, async_client):
+    mocker.patch("grannymail.config.ADMIN_TOKEN", "secret")
+
+    response = await async_client.get("/api/whatsapp/delivery_stats")
+    assert response.status_code == 403
+
+    response = await async_client.get(
+        "/api/whatsapp/delivery_stats", headers={"X-Admin-Token": "secret"}
+    )
+    assert response.status_code == 200
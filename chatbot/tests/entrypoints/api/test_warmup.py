@@ -0,0 +1,44 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from grannymail.entrypoints.api import warmup
+
+
+@pytest.fixture
+def warm_up_state():
+    state = warmup.WarmUpState()
+    with patch.object(warmup, "state", state):
+        yield state
+
+
+@pytest.mark.asyncio
+async def test_ready_endpoint_reports_warm_up(async_client, warm_up_state):
+    response = await async_client.get("/ready")
+    assert response.status_code == 503
+
+    warm_up_state.ready = True
+    response = await async_client.get("/ready")
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_warm_up_runs_all_steps_and_becomes_ready(warm_up_state):
+    with patch.object(warmup.lazy, "preload"), patch.object(
+        warmup.http_client, "warm_up", new=AsyncMock()
+    ), patch.object(warmup, "_warm_system_messages"), patch.object(
+        warmup, "_warm_fonts", side_effect=RuntimeError("no fonts")
+    ), patch.object(
+        warmup, "_warm_pingen_token"
+    ):
+        await warmup.warm_up()
+
+    assert warm_up_state.ready
+    assert set(warm_up_state.durations) == {
+        "imports",
+        "http_pool",
+        "system_messages",
+        "fonts",
+        "pingen_token",
+    }
+    assert warm_up_state.failed == ["fonts"]
@@ -1,13 +1,24 @@
 import typing as t
+from datetime import datetime, timedelta, timezone
 
 import grannymail.domain.models as m
 from grannymail.db.blob_repos import BlobRepositoryBase
 from grannymail.db.repositories import (
+    BroadcastRepositoryBase,
+    CreditLedgerRepositoryBase,
+    DeliveryStatusRepositoryBase,
+    DuplicateEntryError,
+    JobLeaseRepositoryBase,
+    LedgerIsAppendOnlyError,
+    OrderRepositoryBase,
+    OutboxRepositoryBase,
     RepositoryBase,
+    StripeEventRepositoryBase,
     SystemMessageRepository,
     T,
 )
 from grannymail.services.unit_of_work import AbstractUnitOfWork, SupabaseUnitOfWork
+from grannymail.utils import utils
 
 
 class FakeRepoBase(RepositoryBase[T]):
@@ -123,20 +134,250 @@ def create_fake_repo(class_type, id_attr: str):
     return FakeRepo(id_attr=id_attr)
 
 
+class FakeCreditLedgerRepo(
+    FakeRepoBase[m.CreditLedgerEntry], CreditLedgerRepositoryBase
+):
+    def __init__(self):
+        super().__init__(id_attr="entry_id")
+        self._next_entry_id = 1
+
+    def add(self, entity: m.CreditLedgerEntry) -> m.CreditLedgerEntry:
+        entity.entry_id = self._next_entry_id
+        self._next_entry_id += 1
+        return super().add(entity)
+
+    def update(self, entity: m.CreditLedgerEntry) -> m.CreditLedgerEntry:
+        raise LedgerIsAppendOnlyError()
+
+    def delete(self, id: str) -> None:
+        raise LedgerIsAppendOnlyError()
+
+    def get_balance(self, user_id: str) -> int:
+        return sum(entry.delta for entry in self.get_all(filters={"user_id": user_id}))
+
+    def compact(self) -> int:
+        return len({entry.user_id for entry in self._batches})
+
+
+class FakeOrderRepo(FakeRepoBase[m.Order], OrderRepositoryBase):
+    def __init__(self, credit_ledger: CreditLedgerRepositoryBase):
+        super().__init__(id_attr="order_id")
+        self._credit_ledger = credit_ledger
+
+    def _add_entry(
+        self,
+        order: m.Order,
+        delta: int,
+        reason: str,
+        stripe_event_id: str | None = None,
+    ) -> None:
+        self._credit_ledger.add(
+            m.CreditLedgerEntry(
+                user_id=order.user_id,
+                delta=delta,
+                reason=reason,
+                created_at=utils.get_utc_timestamp(),
+                order_id=order.order_id,
+                stripe_event_id=stripe_event_id,
+            )
+        )
+
+    def transition_and_adjust_credits(
+        self,
+        order_id: str,
+        from_status: str,
+        to_status: str,
+        credits_added: int = 0,
+        credit_delta: int = 0,
+        stripe_event_id: str | None = None,
+    ) -> tuple[bool, int]:
+        order = self.get_one(order_id)
+        already_credited = stripe_event_id is not None and any(
+            e.stripe_event_id == stripe_event_id for e in self._credit_ledger.get_all()
+        )
+        if credits_added != 0 and not already_credited:
+            self._add_entry(order, credits_added, "purchase", stripe_event_id)
+        balance = self._credit_ledger.get_balance(order.user_id)
+        transitioned = order.status == from_status and balance + credit_delta >= 0
+        if transitioned:
+            order.status = to_status  # type: ignore
+            if credit_delta != 0:
+                self._add_entry(order, credit_delta, f"order_{to_status}")
+                balance += credit_delta
+        return transitioned, balance
+
+
+class FakeStripeEventRepo(FakeRepoBase[m.StripeEvent], StripeEventRepositoryBase):
+    def __init__(self):
+        super().__init__(id_attr="event_id")
+
+    def add(self, entity: m.StripeEvent) -> m.StripeEvent:
+        if self.maybe_get_one(entity.event_id) is not None:
+            raise DuplicateEntryError(f"Event {entity.event_id} already exists")
+        return super().add(entity)
+
+    @staticmethod
+    def _is_due(event: m.StripeEvent, lease_seconds: int) -> bool:
+        now = datetime.now(timezone.utc)
+        if event.status == "received":
+            return True
+        if event.status == "failed":
+            return (
+                event.next_attempt_at is not None
+                and datetime.fromisoformat(event.next_attempt_at) <= now
+            )
+        if event.status == "processing":
+            assert event.claimed_at is not None
+            claimed_at = datetime.fromisoformat(event.claimed_at)
+            return claimed_at < now - timedelta(seconds=lease_seconds)
+        return False
+
+    def claim(self, event_id: str, lease_seconds: int) -> m.StripeEvent | None:
+        event = self.maybe_get_one(event_id)
+        if event is None or not self._is_due(event, lease_seconds):
+            return None
+        event.status = "processing"
+        event.attempts += 1
+        event.claimed_at = datetime.now(timezone.utc).isoformat()
+        return event
+
+    def get_due(self, lease_seconds: int) -> list[m.StripeEvent]:
+        return sorted(
+            [x for x in self._batches if self._is_due(x, lease_seconds)],
+            key=lambda x: x.received_at,
+        )
+
+
+class FakeJobLeaseRepo(FakeRepoBase[m.JobLease], JobLeaseRepositoryBase):
+    def __init__(self):
+        super().__init__(id_attr="job_name")
+
+    def try_acquire(self, job_name: str, holder: str, ttl: float) -> bool:
+        now = datetime.now(timezone.utc)
+        lease = self.maybe_get_one(job_name)
+        if lease is not None:
+            if datetime.fromisoformat(lease.expires_at) >= now:
+                return False
+            self.delete(job_name)
+        self.add(
+            m.JobLease(
+                job_name=job_name,
+                holder=holder,
+                expires_at=(now + timedelta(seconds=ttl)).isoformat(),
+                acquired_at=now.isoformat(),
+            )
+        )
+        return True
+
+    def renew(self, job_name: str, holder: str, ttl: float) -> bool:
+        lease = self.maybe_get_one(job_name)
+        if lease is None or lease.holder != holder:
+            return False
+        now = datetime.now(timezone.utc)
+        lease.expires_at = (now + timedelta(seconds=ttl)).isoformat()
+        return True
+
+
+class FakeDeliveryStatusRepo(
+    FakeRepoBase[m.DeliveryStatus], DeliveryStatusRepositoryBase
+):
+    def __init__(self, messages: FakeRepoBase):
+        super().__init__(id_attr="status_id")
+        self.messages = messages
+
+    def add_many(self, entities: list[m.DeliveryStatus]) -> None:
+        stored = {(x.wa_mid, x.status) for x in self._batches}
+        for entity in entities:
+            if (entity.wa_mid, entity.status) not in stored:
+                self.add(entity)
+
+    def get_sent_messages(self, wa_mids: list[str]) -> dict[str, tuple[str, str]]:
+        return {
+            x.wa_mid: (x.message_id, x.timestamp)
+            for x in self.messages._batches
+            if getattr(x, "wa_mid", None) in wa_mids
+        }
+
+
+class FakeOutboxRepo(FakeRepoBase[m.OutboxMessage], OutboxRepositoryBase):
+    def __init__(self):
+        super().__init__(id_attr="outbox_id")
+        self._next_seq = 1
+
+    def add(self, entity: m.OutboxMessage) -> m.OutboxMessage:
+        if entity.seq is None:
+            entity.seq = self._next_seq
+            self._next_seq += 1
+        return super().add(entity)
+
+    def claim(self, limit: int, lease_seconds: int) -> list[m.OutboxMessage]:
+        now = datetime.now(timezone.utc)
+        heads: dict[str, m.OutboxMessage] = {}
+        for message in sorted(self._batches, key=lambda x: x.seq or 0):
+            if message.status in ("pending", "sending"):
+                heads.setdefault(message.recipient, message)
+        claimed = []
+        for message in heads.values():
+            if len(claimed) == limit:
+                break
+            if message.status == "pending":
+                is_due = datetime.fromisoformat(message.next_attempt_at) <= now
+            else:
+                assert message.claimed_until is not None
+                is_due = datetime.fromisoformat(message.claimed_until) < now
+            if is_due:
+                message.status = "sending"
+                message.attempts += 1
+                message.claimed_until = (
+                    now + timedelta(seconds=lease_seconds)
+                ).isoformat()
+                claimed.append(message)
+        return claimed
+
+
+class FakeBroadcastRepo(FakeRepoBase[m.Broadcast], BroadcastRepositoryBase):
+    def __init__(self, users: FakeRepoBase, messages: FakeRepoBase):
+        super().__init__(id_attr="broadcast_id")
+        self.users = users
+        self.messages = messages
+
+    def get_recipients(
+        self, after_user_id: str | None, limit: int
+    ) -> list[tuple[m.User, m.WhatsappMessage | m.TelegramMessage]]:
+        recipients = []
+        for user in sorted(self.users._batches, key=lambda x: x.user_id):
+            if after_user_id is not None and user.user_id <= after_user_id:
+                continue
+            sent = [
+                x
+                for x in self.messages._batches
+                if x.user_id == user.user_id and x.sent_by == "user"
+            ]
+            if sent:
+                recipients.append((user, max(sent, key=lambda x: x.timestamp)))
+            if len(recipients) == limit:
+                break
+        return recipients
+
+
 class FakeBlobRepo(BlobRepositoryBase):
     def __init__(self, blob_prefix: str):
         self._blobs: dict[str, bytes] = {}
         self.blob_prefix: str = blob_prefix
+        self.num_uploads = 0
 
-    def upload(self, bytes: bytes, user_id: str, mime_type: str):
-        # Implement upload logic or leave as a pass for a fake implementation
-        blob_path = self._create_blob_path(user_id, mime_type)
-        self._blobs[blob_path] = bytes
+    def upload_to(self, bytes: bytes, blob_path: str, mime_type: str) -> str:
+        if blob_path not in self._blobs:
+            self._blobs[blob_path] = bytes
+            self.num_uploads += 1
         return blob_path
 
     def download(self, blob_path: str) -> bytes:
         return self._blobs[blob_path]
 
+    def exists(self, blob_path: str) -> bool:
+        return blob_path in self._blobs
+
 
 class FakeUnitOfWork(AbstractUnitOfWork):
     def __init__(self):
@@ -147,11 +388,17 @@ class FakeUnitOfWork(AbstractUnitOfWork):
         self.files = create_fake_repo(m.File, "file_id")
         self.addresses = create_fake_repo(m.Address, "address_id")
         self.drafts = create_fake_repo(m.Draft, "draft_id")
-        self.orders = create_fake_repo(m.Order, "order_id")
+        self.credit_ledger = FakeCreditLedgerRepo()
+        self.orders = FakeOrderRepo(self.credit_ledger)
         self.attachments = create_fake_repo(m.Attachment, "attachment_id")
         self.system_messages = SystemMessageRepository(
             SupabaseUnitOfWork().create_client()
         )
+        self.stripe_events = FakeStripeEventRepo()
+        self.job_leases = FakeJobLeaseRepo()
+        self.delivery_statuses = FakeDeliveryStatusRepo(self.messages)
+        self.outbox = FakeOutboxRepo()
+        self.broadcasts = FakeBroadcastRepo(self.users, self.messages)
         self.drafts_blob = FakeBlobRepo("drafts")
         self.files_blob = FakeBlobRepo("files")
 
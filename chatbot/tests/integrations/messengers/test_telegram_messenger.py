@@ -2,9 +2,17 @@ from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
 
+from telegram.error import BadRequest
+
 import grannymail.domain.models as m
 import tests.utils as utils
 from grannymail.integrations.messengers.telegram import Telegram
+from grannymail.utils import media_cache
+from tests.fake_repositories import FakeUnitOfWork
+
+
+def _sent_document(file_id: str) -> Mock:
+    return Mock(chat_id=1234, message_id=1, document=Mock(file_id=file_id))
 
 
 class TestTelegramMessenger:
@@ -123,3 +131,43 @@ class TestTelegramMessenger:
         )
         # check for media in fake_uow
         assert message == expected_message
+
+    @pytest.mark.asyncio
+    @patch.object(media_cache, "telegram_file_ids", media_cache.MediaIdCache(60))
+    @patch.object(Telegram, "_build_application")
+    async def test_reply_document_reuses_file_id(self, mock_build, tg_message):
+        send_document = mock_build.return_value.bot.sendDocument = AsyncMock(
+            return_value=_sent_document("file_id")
+        )
+
+        for _ in range(2):
+            await Telegram().reply_document(
+                tg_message, b"letter", "letter.pdf", "application/pdf", FakeUnitOfWork()
+            )
+
+        documents = [x.kwargs["document"] for x in send_document.await_args_list]
+        assert documents == [b"letter", "file_id"]
+
+    @pytest.mark.asyncio
+    @patch.object(media_cache, "telegram_file_ids", media_cache.MediaIdCache(60))
+    @patch.object(Telegram, "_build_application")
+    async def test_reply_document_uploads_again_if_file_id_was_rejected(
+        self, mock_build, tg_message
+    ):
+        send_document = mock_build.return_value.bot.sendDocument = AsyncMock(
+            side_effect=[
+                BadRequest("Wrong file identifier/http url specified"),
+                _sent_document("new_file_id"),
+            ]
+        )
+        key = media_cache.content_key(b"letter", "letter.pdf")
+        media_cache.telegram_file_ids.set(key, "stale_file_id")
+
+        msg_sent = await Telegram().reply_document(
+            tg_message, b"letter", "letter.pdf", "application/pdf", FakeUnitOfWork()
+        )
+
+        documents = [x.kwargs["document"] for x in send_document.await_args_list]
+        assert documents == ["stale_file_id", b"letter"]
+        assert media_cache.telegram_file_ids.get(key) == "new_file_id"
+        assert msg_sent.message_type == "document"
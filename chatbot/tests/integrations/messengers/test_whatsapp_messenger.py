@@ -1,11 +1,21 @@
 from unittest.mock import AsyncMock, Mock, patch
 
+import httpx
 import pytest
 
 import grannymail.domain.models as m
-from grannymail.integrations.messengers.whatsapp import Whatsapp
-from grannymail.utils import utils
+from grannymail.integrations.messengers.whatsapp import Whatsapp, split_webhook_messages
+from grannymail.utils import media_cache, utils
 from tests import utils as test_utils
+from tests.fake_repositories import FakeUnitOfWork
+
+
+def _graph_error(status_code: int, code: int, message: str) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://graph.facebook.com/messages")
+    response = httpx.Response(
+        status_code, json={"error": {"code": code, "message": message}}, request=request
+    )
+    return httpx.HTTPStatusError(message, request=request, response=response)
 
 
 class TestWhatsappMessenger:
@@ -175,3 +185,98 @@ class TestWhatsappMessenger:
             fake_uow.wa_messages.add(wa_message)
             msg_sent = await Whatsapp().reply_text(wa_message, "hey", fake_uow)
         assert isinstance(msg_sent, m.WhatsappMessage)
+
+    @pytest.mark.asyncio
+    @patch.object(media_cache, "whatsapp_media_ids", media_cache.MediaIdCache(60))
+    @patch.object(Whatsapp, "_upload_media", new_callable=AsyncMock)
+    @patch.object(Whatsapp, "_post_httpx_request", new_callable=AsyncMock)
+    async def test_reply_document_uploads_document_once(
+        self, mock_post_httpx, mock_upload, wa_message
+    ):
+        mock_upload.return_value = {"id": "media_id"}
+        mock_post_httpx.return_value = {"messages": [{"id": "some_message_id"}]}
+        uow = FakeUnitOfWork()
+
+        for _ in range(2):
+            await Whatsapp().reply_document(
+                wa_message, b"letter", "letter.pdf", "application/pdf", uow
+            )
+
+        mock_upload.assert_awaited_once()
+        sent = [x.kwargs["data"]["document"] for x in mock_post_httpx.await_args_list]
+        assert sent == [{"filename": "letter.pdf", "id": "media_id"}] * 2
+
+    @pytest.mark.asyncio
+    @patch.object(media_cache, "whatsapp_media_ids", media_cache.MediaIdCache(60))
+    @patch.object(Whatsapp, "_upload_media", new_callable=AsyncMock)
+    @patch.object(Whatsapp, "_post_httpx_request", new_callable=AsyncMock)
+    async def test_reply_document_uploads_again_if_media_was_rejected(
+        self, mock_post_httpx, mock_upload, wa_message
+    ):
+        mock_upload.return_value = {"id": "new_media_id"}
+        mock_post_httpx.side_effect = [
+            _graph_error(400, 131053, "Media upload error"),
+            {"messages": [{"id": "some_message_id"}]},
+        ]
+        key = media_cache.content_key(b"letter")
+        media_cache.whatsapp_media_ids.set(key, "expired_media_id")
+
+        msg_sent = await Whatsapp().reply_document(
+            wa_message, b"letter", "letter.pdf", "application/pdf", FakeUnitOfWork()
+        )
+
+        mock_upload.assert_awaited_once()
+        assert msg_sent.wa_media_id == "new_media_id"
+        assert media_cache.whatsapp_media_ids.get(key) == "new_media_id"
+
+    @pytest.mark.asyncio
+    @patch.object(media_cache, "whatsapp_media_ids", media_cache.MediaIdCache(60))
+    @patch.object(Whatsapp, "_upload_media", new_callable=AsyncMock)
+    @patch.object(Whatsapp, "_post_httpx_request", new_callable=AsyncMock)
+    async def test_reply_document_keeps_media_if_send_failed_otherwise(
+        self, mock_post_httpx, mock_upload, wa_message
+    ):
+        mock_post_httpx.side_effect = _graph_error(400, 131026, "Message undeliverable")
+        key = media_cache.content_key(b"letter")
+        media_cache.whatsapp_media_ids.set(key, "media_id")
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await Whatsapp().reply_document(
+                wa_message, b"letter", "letter.pdf", "application/pdf", FakeUnitOfWork()
+            )
+
+        mock_upload.assert_not_awaited()
+        assert media_cache.whatsapp_media_ids.get(key) == "media_id"
+
+    def test_split_webhook_messages(self):
+        first = test_utils._create_whatsapp_text_message("/help", "wamid.1")
+        second = test_utils._create_whatsapp_text_message("/edit", "wamid.2")
+        third = test_utils._create_whatsapp_text_message("/send", "wamid.3")
+        # a second message in the same change, a status update and a second entry
+        first_value = first.entry[0]["changes"][0]["value"]
+        first_value["messages"].append(
+            second.entry[0]["changes"][0]["value"]["messages"][0]
+        )
+        first.entry[0]["changes"].append(
+            {"value": {"statuses": [{"id": "wamid.0", "status": "read"}]}}
+        )
+        first.entry.extend(third.entry)
+
+        payloads = split_webhook_messages(first)
+
+        messages = [p.entry[0]["changes"][0]["value"]["messages"] for p in payloads]
+        assert [[msg["id"] for msg in x] for x in messages] == [
+            ["wamid.1"],
+            ["wamid.2"],
+            ["wamid.3"],
+        ]
+        assert payloads[1].entry[0]["changes"][0]["value"]["contacts"] == (
+            first_value["contacts"]
+        )
+
+    def test_split_webhook_messages_skips_statuses(self):
+        data = test_utils._create_whatsapp_text_message("/help")
+        value = data.entry[0]["changes"][0]["value"]
+        del value["messages"]
+        value["statuses"] = [{"id": "wamid.0", "status": "delivered"}]
+        assert split_webhook_messages(data) == []
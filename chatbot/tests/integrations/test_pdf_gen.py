@@ -2,11 +2,14 @@ import os
 from uuid import uuid4
 
 from pytest import fixture
+from reportlab import rl_config
 
 from grannymail.domain.models import Address
 from grannymail.integrations.pdf_gen import (
+    LetterLayout,
     create_and_save_letter,
     create_letter_pdf_as_bytes,
+    get_glyph_coverage,
 )
 
 
@@ -31,3 +34,47 @@ def test_multi_page_letter(address, draft):
         os.remove(file_path)
     create_and_save_letter(file_path, text, address)
     assert os.path.exists(file_path)
+
+
+def test_letter_layout_matches_full_text_rendering(address, draft, monkeypatch):
+    # leaves out timestamps and random ids, so identical documents are identical bytes
+    monkeypatch.setattr(rl_config, "invariant", 1)
+    text = "Hallo Doris,\nmir geht es gut!\n\nLiebe Grüße"
+    layout = LetterLayout()
+    for paragraph in text.split("\n"):
+        layout.add_paragraph(paragraph)
+    assert len(layout.story) == 1 + 2 * len(text.split("\n"))
+    assert layout.build(address) == create_letter_pdf_as_bytes(text, address)
+
+
+def test_glyph_coverage_finds_unsupported_characters():
+    coverage = get_glyph_coverage()
+    assert coverage.find_unsupported("Liebe Grüße, ça va? 5€ „gut“\n") == set()
+    # Greek is rendered through the Symbol font ReportLab substitutes
+    assert coverage.find_unsupported("αβγ") == set()
+    assert coverage.find_unsupported("Привет 😀") == {
+        "П",
+        "р",
+        "и",
+        "в",
+        "е",
+        "т",
+        "😀",
+    }
+
+
+def test_glyph_coverage_rejects_latin_extended_a():
+    # Times-Roman uses WinAnsiEncoding, which only holds a few Latin Extended-A
+    # characters, so letters in e.g. Polish, Czech, Hungarian or Turkish are refused
+    coverage = get_glyph_coverage()
+    assert coverage.find_unsupported("Šž Œœ Ÿ") == set()
+    assert coverage.find_unsupported("łŁ č ő ş ą ę") == {
+        "ł",
+        "Ł",
+        "č",
+        "ő",
+        "ş",
+        "ą",
+        "ę",
+    }
+    assert coverage.find_unsupported("a\tb") == {"\t"}
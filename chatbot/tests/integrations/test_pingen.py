@@ -1,5 +1,8 @@
+from unittest.mock import MagicMock, patch
+
 from pytest import fixture
 
+import grannymail.integrations.pingen as pingen_module
 from grannymail.integrations.pingen import Pingen
 
 
@@ -25,3 +28,14 @@ def test_get_letter_details(pingen):
     re = pingen.get_letter_details(exant_uuid)
     assert isinstance(re, dict)
     assert re["id"] == exant_uuid
+
+
+def test_token_is_shared_between_instances():
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"access_token": "token", "expires_in": 3600}
+    with patch.dict(pingen_module._tokens, clear=True), patch(
+        "requests.post", return_value=response
+    ) as mock_post:
+        assert Pingen(client_id="shared")._get_token() == "token"
+        assert Pingen(client_id="shared")._get_token() == "token"
+    mock_post.assert_called_once()
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+
+import grannymail.config as cfg
+from grannymail.integrations import rate_limiter
+from grannymail.integrations.rate_limiter import Priority, RateLimited, RateLimiter
+
+
+def _limiter(**kwargs) -> RateLimiter:
+    params = dict(global_rate=1000, global_burst=1000, per_key_rate=20, per_key_burst=1)
+    params.update(kwargs)
+    return RateLimiter("test", **params)
+
+
+@pytest.mark.asyncio
+async def test_sends_to_one_chat_are_spaced_out():
+    limiter = _limiter()
+    start = time.monotonic()
+    for _ in range(3):
+        await limiter.acquire("chat")
+    # the burst allows one send, the next two wait 1/20s each
+    assert time.monotonic() - start >= 0.09
+    assert limiter.stats.delayed_sends == 2
+
+
+@pytest.mark.asyncio
+async def test_other_chats_are_not_delayed():
+    limiter = _limiter()
+    await limiter.acquire("chat")
+    start = time.monotonic()
+    await limiter.acquire("other_chat")
+    assert time.monotonic() - start < 0.04
+
+
+@pytest.mark.asyncio
+async def test_interactive_sends_go_before_bulk_sends():
+    limiter = _limiter(global_rate=20, global_burst=1)
+    await limiter.acquire()
+    order = []
+
+    async def send(name: str, prio: Priority):
+        with rate_limiter.priority(prio):
+            await limiter.acquire()
+        order.append(name)
+
+    bulk = asyncio.create_task(send("bulk", Priority.BULK))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(send("interactive", Priority.INTERACTIVE))
+    await asyncio.gather(bulk, interactive)
+
+    assert order == ["interactive", "bulk"]
+    assert limiter.stats.bulk_sends == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("reason", ["chat_bucket", "paused_chat"])
+async def test_interactive_sends_waiting_for_their_chat_dont_hold_bulk_back(reason):
+    limiter = _limiter(per_key_rate=2)
+    if reason == "chat_bucket":
+        await limiter.acquire("chat")
+    else:
+        limiter.block(1, "chat")
+    interactive = asyncio.create_task(limiter.acquire("chat"))
+    await asyncio.sleep(0)
+
+    start = time.monotonic()
+    with rate_limiter.priority(Priority.BULK):
+        await limiter.acquire("other_chat")
+    assert time.monotonic() - start < 0.04
+    assert not interactive.done()
+    interactive.cancel()
+
+
+@pytest.mark.asyncio
+async def test_expired_pauses_are_dropped():
+    limiter = _limiter()
+    limiter.block(0.001, "chat")
+    await asyncio.sleep(0.01)
+    limiter.block(1, "other_chat")
+    assert list(limiter._blocked_until) == ["other_chat"]
+
+
+@pytest.mark.asyncio
+async def test_call_honours_retry_after():
+    limiter = _limiter()
+    attempts = []
+
+    async def send() -> str:
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited(retry_after=0.05)
+        return "sent"
+
+    assert await limiter.call("chat", send) == "sent"
+    assert attempts[1] - attempts[0] >= 0.05
+    assert limiter.stats.retry_afters == 1
+
+
+@pytest.mark.asyncio
+async def test_call_gives_up_after_max_retries():
+    limiter = _limiter()
+
+    async def send():
+        raise RateLimited(retry_after=0.001)
+
+    with pytest.raises(RateLimited):
+        await limiter.call("chat", send, max_retries=2)
+    assert limiter.stats.retry_afters == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limits_endpoint_requires_admin_token(async_client):
+    with patch.object(cfg, "ADMIN_TOKEN", "secret"):
+        response = await async_client.get("/rate_limits")
+        assert response.status_code == 403
+
+        response = await async_client.get(
+            "/rate_limits", headers={"X-Admin-Token": "secret"}
+        )
+    assert response.status_code == 200
@@ -1,4 +1,4 @@
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
@@ -51,3 +51,48 @@ def test_handle_event(
         assert credit_balance == 0
     else:
         assert credit_balance == 1
+
+
+def _line_items(*product_ids):
+    return {"data": [{"price": {"product": p}} for p in product_ids]}
+
+
+def test_catalog_resolves_credits_without_stripe_calls_after_warm():
+    catalog = sp.StripeCatalog(["https://buy.stripe.com/five"])
+    links = MagicMock()
+    links.auto_paging_iter.return_value = [
+        {"id": "plink_5", "url": "https://buy.stripe.com/five"},
+        {"id": "plink_other", "url": "https://buy.stripe.com/other"},
+    ]
+    with patch("stripe.PaymentLink.list", return_value=links), patch(
+        "stripe.PaymentLink.list_line_items", return_value=_line_items("prod_5")
+    ) as mock_line_items, patch(
+        "stripe.Product.retrieve", return_value={"metadata": {"letter_credits": "5"}}
+    ) as mock_retrieve:
+        catalog.warm()
+        assert mock_line_items.call_count == 1
+        mock_line_items.reset_mock()
+        mock_retrieve.reset_mock()
+
+        assert catalog.get_credits("plink_5") == 5
+        mock_line_items.assert_not_called()
+        mock_retrieve.assert_not_called()
+
+
+def test_catalog_handles_product_updates_and_misses():
+    catalog = sp.StripeCatalog([])
+    with patch(
+        "stripe.PaymentLink.list_line_items", return_value=_line_items("prod_1")
+    ), patch(
+        "stripe.Product.retrieve", return_value={"metadata": {"letter_credits": "1"}}
+    ) as mock_retrieve:
+        assert catalog.get_credits("plink_1") == 1
+        assert mock_retrieve.call_count == 1
+
+    catalog.handle_event(
+        {
+            "type": "product.updated",
+            "data": {"object": {"id": "prod_1", "metadata": {"letter_credits": "2"}}},
+        }
+    )
+    assert catalog.get_credits("plink_1") == 2
@@ -0,0 +1,162 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+import grannymail.domain.models as m
+from grannymail.integrations import rate_limiter
+from grannymail.services import broadcast as broadcast_service
+from grannymail.services.broadcast import Broadcaster, render
+from grannymail.utils import utils
+from tests.fake_repositories import FakeUnitOfWork
+
+
+def _add_user(
+    uow: FakeUnitOfWork,
+    user_id: str,
+    first_name: str,
+    platform: str | None = "WhatsApp",
+):
+    uow.users.add(
+        m.User(
+            user_id=user_id, created_at="", first_name=first_name, telegram_id=user_id
+        )
+    )
+    message: m.WhatsappMessage | m.TelegramMessage
+    if platform == "WhatsApp":
+        message = m.WhatsappMessage(
+            message_id=f"message-{user_id}",
+            user_id=user_id,
+            sent_by="user",
+            message_type="text",
+            timestamp=utils.get_utc_timestamp(),
+            phone_number=f"+41{user_id}",
+        )
+    elif platform == "Telegram":
+        message = m.TelegramMessage(
+            message_id=f"message-{user_id}",
+            user_id=user_id,
+            sent_by="user",
+            message_type="text",
+            timestamp=utils.get_utc_timestamp(),
+            tg_user_id=user_id,
+            tg_chat_id=int(user_id),
+            tg_message_id=f"tg-{user_id}",
+        )
+    else:
+        return
+    uow.messages.add(message)
+
+
+class RecordingBroadcaster(Broadcaster):
+    def __init__(self, uow: FakeUnitOfWork):
+        super().__init__(lambda: uow, page_size=2)
+
+    def get_template(self, message_identifier: str) -> str:
+        return "Hi {first_name}, we are on holiday."
+
+
+@pytest.fixture
+def messenger():
+    """Replaces the messengers the broadcaster creates with a mock that records the
+    replies and the priority they were sent with."""
+    messenger = AsyncMock()
+    messenger.failing = set()
+    messenger.sent = []
+    messenger.priorities = set()
+
+    async def reply_text(ref_message, msg_body, uow):
+        messenger.priorities.add(rate_limiter._priority.get())
+        if ref_message.user_id in messenger.failing:
+            raise RuntimeError("Recipient is unreachable")
+        messenger.sent.append(
+            (ref_message.user_id, ref_message.messaging_platform, msg_body)
+        )
+
+    messenger.reply_text.side_effect = reply_text
+    with patch.object(
+        broadcast_service.whatsapp, "Whatsapp", return_value=messenger
+    ), patch.object(broadcast_service.telegram, "Telegram", return_value=messenger):
+        yield messenger
+
+
+@pytest.fixture
+def uow() -> FakeUnitOfWork:
+    uow = FakeUnitOfWork()
+    _add_user(uow, "1", "Anna")
+    _add_user(uow, "2", "Ben")
+    _add_user(uow, "3", "Carl", platform="Telegram")
+    _add_user(uow, "4", "Dora", platform=None)
+    _add_user(uow, "5", "Emil")
+    return uow
+
+
+@pytest.mark.asyncio
+async def test_broadcast_is_sent_to_every_reachable_user(uow, messenger):
+    broadcast = await RecordingBroadcaster(uow).run("holidays", "broadcast-holidays")
+
+    assert messenger.sent == [
+        ("1", "WhatsApp", "Hi Anna, we are on holiday."),
+        ("2", "WhatsApp", "Hi Ben, we are on holiday."),
+        ("3", "Telegram", "Hi Carl, we are on holiday."),
+        ("5", "WhatsApp", "Hi Emil, we are on holiday."),
+    ]
+    assert messenger.priorities == {rate_limiter.Priority.BULK}
+    assert broadcast.status == "completed"
+    assert broadcast.num_sent == 4
+    assert uow.broadcasts.get_one("holidays").last_user_id == "5"
+
+
+@pytest.mark.asyncio
+async def test_broadcast_resumes_after_checkpoint(uow, messenger):
+    broadcaster = RecordingBroadcaster(uow)
+    broadcast = broadcaster.get_or_create("holidays", "broadcast-holidays")
+    broadcast.last_user_id = "2"
+    broadcast.num_sent = 2
+    broadcaster.checkpoint(broadcast)
+
+    broadcast = await broadcaster.run("holidays", "broadcast-holidays")
+
+    assert [user_id for user_id, _, _ in messenger.sent] == ["3", "5"]
+    assert broadcast.num_sent == 4
+
+
+@pytest.mark.asyncio
+async def test_failed_sends_are_counted(uow, messenger):
+    messenger.failing.add("2")
+
+    broadcast = await RecordingBroadcaster(uow).run("holidays", "broadcast-holidays")
+
+    assert broadcast.num_sent == 3
+    assert broadcast.num_failed == 1
+
+
+@pytest.mark.asyncio
+async def test_completed_broadcast_is_not_sent_again(uow, messenger):
+    await RecordingBroadcaster(uow).run("holidays", "broadcast-holidays")
+    messenger.sent.clear()
+
+    await RecordingBroadcaster(uow).run("holidays", "broadcast-holidays")
+
+    assert messenger.sent == []
+
+
+@pytest.mark.asyncio
+async def test_broadcast_claimed_by_another_worker_is_not_sent(uow, messenger):
+    assert Broadcaster(lambda: uow).claim("holidays")
+
+    with pytest.raises(broadcast_service.BroadcastClaimedError):
+        await RecordingBroadcaster(uow).run("holidays", "broadcast-holidays")
+
+    assert messenger.sent == []
+
+
+@pytest.mark.asyncio
+async def test_broadcast_stops_when_its_claim_was_lost(uow, messenger):
+    broadcaster = RecordingBroadcaster(uow)
+    # the lease expired during the first page and another worker claimed it
+    with patch.object(broadcaster, "claim", side_effect=[True, False]):
+        with pytest.raises(broadcast_service.BroadcastClaimedError):
+            await broadcaster.run("holidays", "broadcast-holidays")
+
+    assert [user_id for user_id, _, _ in messenger.sent] == ["1", "2"]
+    assert uow.broadcasts.get_one("holidays").last_user_id == "2"
@@ -0,0 +1,123 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+import grannymail.domain.models as m
+from grannymail.services.delivery_tracker import DeliveryTracker, LatencyHistogram
+from tests.fake_repositories import FakeUnitOfWork
+
+
+def _sent_message(wa_mid: str) -> m.WhatsappMessage:
+    return m.WhatsappMessage(
+        message_id=f"message-{wa_mid}",
+        user_id="user",
+        sent_by="system",
+        message_type="text",
+        timestamp="2024-01-26T23:42:00+00:00",
+        wa_mid=wa_mid,
+    )
+
+
+def _status(wa_mid: str, status: str, timestamp: int = 1706312529) -> dict:
+    # 1706312529 is 2024-01-26T23:42:09+00:00
+    return {"id": wa_mid, "status": status, "timestamp": str(timestamp)}
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram(buckets=(1, 10, float("inf")))
+    assert histogram.percentile(50) is None
+    for latency in [0.5, 0.5, 0.5, 5, 100]:
+        histogram.observe(latency)
+    assert histogram.percentile(50) == 1
+    assert histogram.percentile(80) == 10
+    assert histogram.percentile(100) == float("inf")
+
+
+def test_flush_correlates_statuses_with_sent_messages():
+    uow = FakeUnitOfWork()
+    tracker = DeliveryTracker()
+    tracker.track_sent(_sent_message("wamid.1"))
+    tracker.record(_status("wamid.1", "delivered"))
+    # WhatsApp retries callbacks
+    tracker.record(_status("wamid.1", "delivered"))
+    tracker.record(_status("wamid.unknown", "read"))
+
+    assert tracker.flush(uow) == 2
+    assert len(tracker) == 0
+
+    delivered = uow.delivery_statuses.get_one(None, filters={"wa_mid": "wamid.1"})
+    assert delivered.message_id == "message-wamid.1"
+    assert delivered.latency_seconds == pytest.approx(9)
+    unknown = uow.delivery_statuses.get_one(None, filters={"wa_mid": "wamid.unknown"})
+    assert unknown.message_id is None
+    assert tracker.histograms["delivered"].total == 1
+    assert tracker.histograms["read"].total == 0
+
+
+def test_flush_looks_up_messages_sent_by_other_workers():
+    uow = FakeUnitOfWork()
+    uow.wa_messages.add(_sent_message("wamid.2"))
+    tracker = DeliveryTracker()
+    tracker.record(_status("wamid.2", "read", timestamp=1706312539))
+
+    tracker.flush(uow)
+
+    read = uow.delivery_statuses.get_one(None, filters={"wa_mid": "wamid.2"})
+    assert read.message_id == "message-wamid.2"
+    assert read.latency_seconds == pytest.approx(19)
+    assert tracker.stats()["counts"]["read"] == 1
+
+
+def test_full_buffer_drops_statuses():
+    tracker = DeliveryTracker(max_buffered=1)
+    tracker.record(_status("wamid.1", "sent"))
+    tracker.record(_status("wamid.2", "sent"))
+    assert len(tracker) == 1
+    assert tracker.num_dropped == 1
+
+
+def test_requeue_keeps_buffer_bounded():
+    tracker = DeliveryTracker(max_buffered=2)
+    tracker.record(_status("wamid.1", "sent"))
+    tracker.record(_status("wamid.2", "sent"))
+    statuses, _ = tracker.drain()
+    # arrives while the drained statuses are written
+    tracker.record(_status("wamid.3", "sent"))
+
+    tracker.requeue(statuses)
+
+    assert len(tracker) == 2
+    assert tracker.num_dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_is_retried():
+    uow = FakeUnitOfWork()
+    tracker = DeliveryTracker()
+    tracker.track_sent(_sent_message("wamid.1"))
+    tracker.record(_status("wamid.1", "delivered"))
+    add_many = uow.delivery_statuses.add_many
+    num_calls = 0
+
+    def fail_once(entities):
+        nonlocal num_calls
+        num_calls += 1
+        if num_calls == 1:
+            raise RuntimeError("Supabase is down")
+        add_many(entities)
+
+    with patch.object(uow.delivery_statuses, "add_many", side_effect=fail_once):
+        task = asyncio.create_task(tracker.flush_forever(lambda: uow, interval=0))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if uow.delivery_statuses.get_all():
+                break
+        task.cancel()
+
+    assert num_calls == 2
+    assert len(uow.delivery_statuses.get_all()) == 1
+    assert tracker.num_dropped == 0
+    # the failed write isn't counted
+    assert tracker.counts["delivered"] == 1
+    assert tracker.histograms["delivered"].total == 1
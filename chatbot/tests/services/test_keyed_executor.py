@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from grannymail.services.keyed_executor import KeyedExecutor, MailboxFullError
+
+
+@pytest.mark.asyncio
+async def test_jobs_of_one_key_run_in_order():
+    executor = KeyedExecutor("test", max_concurrency=4)
+    order = []
+
+    def make_job(i: int, delay: float):
+        async def job():
+            await asyncio.sleep(delay)
+            order.append(i)
+
+        return job
+
+    # the first job is the slowest, later jobs must still wait for it
+    for i, delay in enumerate([0.03, 0.01, 0]):
+        executor.submit("chat", make_job(i, delay))
+    await executor.join()
+
+    assert order == [0, 1, 2]
+    assert len(executor) == 0
+
+
+@pytest.mark.asyncio
+async def test_keys_run_concurrently_up_to_limit():
+    executor = KeyedExecutor("test", max_concurrency=2)
+    running = 0
+    max_running = 0
+
+    async def job():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    for key in range(5):
+        executor.submit(key, job)
+    await executor.join()
+
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_job_does_not_block_key():
+    executor = KeyedExecutor("test", max_concurrency=1)
+    done = []
+
+    async def failing_job():
+        raise ValueError("boom")
+
+    async def job():
+        done.append(True)
+
+    executor.submit("chat", failing_job)
+    executor.submit("chat", job)
+    await executor.join()
+
+    assert done == [True]
+
+
+@pytest.mark.asyncio
+async def test_full_mailbox_rejects_jobs():
+    executor = KeyedExecutor("test", max_concurrency=1, max_mailbox_size=1)
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    executor.submit("user", job)
+    # the worker has not started yet, so the first job still occupies the mailbox
+    with pytest.raises(MailboxFullError):
+        executor.submit("user", job)
+    # other keys are not affected
+    executor.submit("other_user", job)
+    release.set()
+    await executor.join()
+
+
+@pytest.mark.asyncio
+async def test_idle_mailbox_is_evicted():
+    executor = KeyedExecutor("test", max_concurrency=1, idle_timeout=0.02)
+    done = []
+
+    async def job():
+        done.append(True)
+
+    executor.submit("user", job)
+    await executor.join()
+    # the mailbox stays around for a while and picks up new jobs
+    assert len(executor) == 1
+    executor.submit("user", job)
+    await executor.join()
+    assert done == [True, True]
+
+    await asyncio.sleep(0.05)
+    assert len(executor) == 0
@@ -11,6 +11,7 @@ from grannymail.integrations.messengers import telegram, whatsapp
 from grannymail.services.message_processing_service import MessageProcessingService
 from grannymail.utils import message_utils
 from grannymail.utils.utils import get_utc_timestamp
+from tests.fake_repositories import FakeUnitOfWork
 
 # test most functions -> ideally use codiume
 
@@ -22,6 +23,7 @@ async def assert_message_received_correct_responses(
     msg_responses: dict[str, list[str]] = {},
     button_responses: dict[str, list[str]] = {},
     edit_text_responses: dict[str, list] = {},
+    inline_text_responses: dict[str, list[str]] = {},
     sent_document=False,
 ):
     messenger = whatsapp.Whatsapp() if platform == "WhatsApp" else telegram.Telegram()
@@ -45,7 +47,9 @@ async def assert_message_received_correct_responses(
         ) as mock_patch, patch(
             "telegram._callbackquery.CallbackQuery.answer", new_callable=AsyncMock
         ) as mock_callback_answer:
-            with patch.object(
+            with patch(
+                "grannymail.services.outbox.enqueue_text"
+            ) as mock_enqueue_text, patch.object(
                 messenger, "reply_text", new=AsyncMock()
             ) as mock_reply_text, patch.object(
                 messenger, "reply_edit_or_text", new=AsyncMock()
@@ -82,7 +86,7 @@ async def assert_message_received_correct_responses(
             expected_msg = fake_uow.system_messages.get_msg(identifier).format(
                 *insertions
             )
-            mock_reply_text.assert_any_await(ANY, expected_msg, fake_uow)
+            mock_enqueue_text.assert_any_call(ANY, expected_msg, fake_uow)
 
         for identifier, insertions in button_responses.items():
             expected_msg = fake_uow.system_messages.get_msg(identifier).format(
@@ -107,6 +111,12 @@ async def assert_message_received_correct_responses(
             )
             mock_reply_edit_or_text.assert_any_await(ANY, expected_msg, fake_uow)
 
+        for identifier, insertions in inline_text_responses.items():
+            expected_msg = fake_uow.system_messages.get_msg(identifier).format(
+                *insertions
+            )
+            mock_reply_text.assert_any_await(ANY, expected_msg, fake_uow)
+
     if sent_document:
         mock_reply_document.assert_awaited_once()
 
@@ -133,6 +143,47 @@ class TestMessageProcessingService:
         wa_message.message_body = " hi   "
         assert mps._is_message_empty(wa_message) is False
 
+    @pytest.mark.asyncio
+    async def test_text_replies_go_through_the_outbox(self, wa_message):
+        uow = FakeUnitOfWork()
+        messenger = AsyncMock()
+        with patch.object(
+            uow.system_messages, "get_msg", return_value="How can I help?"
+        ), patch("grannymail.services.outbox.sender.notify") as mock_notify:
+            await MessageProcessingService().handle_help(wa_message, uow, messenger)
+
+        outbox_message = uow.outbox.get_one(
+            None, filters={"ref_message_id": wa_message.message_id}
+        )
+        assert outbox_message.message_body == "How can I help?"
+        assert outbox_message.status == "pending"
+        mock_notify.assert_called_once()
+        messenger.reply_text.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_confirmation_is_sent_before_the_command_is_handled(self, wa_message):
+        uow = FakeUnitOfWork()
+        wa_message.command = "edit"
+        calls = Mock()
+        messenger = AsyncMock()
+        messenger.reply_text.side_effect = calls.reply_text
+        mps = MessageProcessingService()
+        with patch.object(
+            uow.system_messages, "get_msg", return_value="Working on it"
+        ), patch.object(
+            mps, "_process_message", new=AsyncMock(return_value=wa_message)
+        ), patch.object(
+            mps, "handle_edit", new=AsyncMock(side_effect=calls.handle_edit)
+        ):
+            await mps.receive_and_process_message(uow, messenger)
+
+        # the confirmation is sent inline, so it can't arrive after the new draft
+        assert calls.mock_calls == [
+            call.reply_text(wa_message, "Working on it", uow),
+            call.handle_edit(wa_message, uow, messenger),
+        ]
+        assert uow.outbox.get_all() == []
+
     @pytest.mark.asyncio
     @pytest.mark.parametrize("platform", ["WhatsApp", "Telegram"])
     async def test_process_no_command(self, platform, fake_uow):
@@ -211,7 +262,8 @@ class TestMessageProcessingService:
             platform,
             fake_uow,
             messages={"voice": {}},
-            msg_responses={"voice-confirm": [], "voice-success": []},
+            inline_text_responses={"voice-confirm": []},
+            msg_responses={"voice-success": []},
             sent_document=True,
         )
 
@@ -222,7 +274,8 @@ class TestMessageProcessingService:
             platform,
             fake_uow,
             messages={"message": {"user_msg": "/edit  "}},
-            msg_responses={"edit-confirm": [], "edit-error-msg_empty": []},
+            inline_text_responses={"edit-confirm": []},
+            msg_responses={"edit-error-msg_empty": []},
         )
 
     @pytest.mark.asyncio
@@ -232,7 +285,8 @@ class TestMessageProcessingService:
             platform,
             fake_uow,
             messages={"message": {"user_msg": "/edit  doris -> dominique"}},
-            msg_responses={"edit-confirm": [], "edit-error-no_draft_found": []},
+            inline_text_responses={"edit-confirm": []},
+            msg_responses={"edit-error-no_draft_found": []},
         )
 
     @pytest.mark.asyncio
@@ -246,7 +300,8 @@ class TestMessageProcessingService:
             platform,
             fake_uow,
             messages={"message": {"user_msg": "/edit doris -> dominique "}},
-            msg_responses={"edit-confirm": [], "edit-success": []},
+            inline_text_responses={"edit-confirm": []},
+            msg_responses={"edit-success": []},
             sent_document=True,
         )
 
@@ -513,8 +568,8 @@ class TestMessageProcessingService:
     ):
         with fake_uow:
             # Using /send without keyword with only address successfully triggers sending an address
-            user.num_letter_credits = 2
             fake_uow.users.add(user)
+            fake_uow.credit_ledger.add(utils.create_credit_entry(user, 2))
             fake_uow.addresses.add(address)
             fake_uow.drafts.add(draft)
 
@@ -525,7 +580,7 @@ class TestMessageProcessingService:
             button_responses={
                 "send-success-credits": [
                     " " + user.first_name,
-                    str(user.num_letter_credits),
+                    "2",
                     address.format_address_as_string(),
                 ]
             },
@@ -578,8 +633,8 @@ class TestMessageProcessingService:
         self, platform, fake_uow, user, address, draft
     ):
         with fake_uow:
-            user.num_letter_credits = 2
             fake_uow.users.add(user)
+            fake_uow.credit_ledger.add(utils.create_credit_entry(user, 2))
             fake_uow.addresses.add(address)
             fake_uow.drafts.add(draft)
 
@@ -590,7 +645,7 @@ class TestMessageProcessingService:
             button_responses={
                 "send-success-credits": [
                     " " + user.first_name,
-                    str(user.num_letter_credits),
+                    "2",
                     address.format_address_as_string(),
                 ]
             },
@@ -602,8 +657,8 @@ class TestMessageProcessingService:
         self, platform, fake_uow, user, address, draft
     ):
         with fake_uow:
-            user.num_letter_credits = 2
             fake_uow.users.add(user)
+            fake_uow.credit_ledger.add(utils.create_credit_entry(user, 2))
             fake_uow.addresses.add(address)
             fake_uow.drafts.add(draft)
 
@@ -614,7 +669,7 @@ class TestMessageProcessingService:
             button_responses={
                 "send-success-credits": [
                     " " + user.first_name,
-                    str(user.num_letter_credits),
+                    "2",
                     address.format_address_as_string(),
                 ]
             },
@@ -643,8 +698,8 @@ class TestMessageProcessingService:
         self, platform, fake_uow, user, address, draft
     ):
         with fake_uow:
-            user.num_letter_credits = 2
             fake_uow.users.add(user)
+            fake_uow.credit_ledger.add(utils.create_credit_entry(user, 2))
             fake_uow.addresses.add(address)
             fake_uow.drafts.add(draft)
 
@@ -655,7 +710,7 @@ class TestMessageProcessingService:
             button_responses={
                 "send-success-credits": [
                     " " + user.first_name,
-                    str(user.num_letter_credits),
+                    "2",
                     address.format_address_as_string(),
                 ]
             },
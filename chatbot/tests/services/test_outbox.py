@@ -0,0 +1,86 @@
+import pytest
+
+import grannymail.domain.models as m
+from grannymail.services import outbox
+from grannymail.services.outbox import OutboxSender
+from grannymail.utils import utils
+from tests.fake_repositories import FakeUnitOfWork
+
+
+def _ref_message(phone_number: str) -> m.WhatsappMessage:
+    return m.WhatsappMessage(
+        message_id=f"message-{phone_number}",
+        user_id="user",
+        sent_by="user",
+        message_type="text",
+        timestamp=utils.get_utc_timestamp(),
+        phone_number=phone_number,
+    )
+
+
+class RecordingSender(OutboxSender):
+    def __init__(self, uow: FakeUnitOfWork, failing: set[str] = set()):
+        super().__init__(lambda: uow)
+        self.failing = failing
+        self.sent: list[str] = []
+
+    async def send(self, message, uow):
+        if message.message_body in self.failing:
+            raise ConnectionError("platform unavailable")
+        self.sent.append(message.message_body)
+
+
+@pytest.mark.asyncio
+async def test_messages_to_one_recipient_are_sent_in_order():
+    uow = FakeUnitOfWork()
+    for body in ["first", "second"]:
+        outbox.enqueue_text(_ref_message("+41000"), body, uow)
+    outbox.enqueue_text(_ref_message("+41001"), "other", uow)
+    sender = RecordingSender(uow)
+
+    # one message per recipient and batch
+    assert await sender.run_once() == 2
+    assert sorted(sender.sent) == ["first", "other"]
+    assert await sender.run_once() == 1
+    assert sender.sent[-1] == "second"
+    assert await sender.run_once() == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_message_is_retried_and_blocks_later_messages():
+    uow = FakeUnitOfWork()
+    failing = outbox.enqueue_text(_ref_message("+41000"), "failing", uow)
+    outbox.enqueue_text(_ref_message("+41000"), "later", uow)
+    sender = RecordingSender(uow, failing={"failing"})
+
+    assert await sender.run_once() == 1
+    assert failing.status == "pending"
+    assert failing.attempts == 1
+    assert failing.next_attempt_at > utils.get_utc_timestamp()
+    # the retry is not due yet and the later message has to wait for it
+    assert await sender.run_once() == 0
+    assert sender.sent == []
+
+
+@pytest.mark.asyncio
+async def test_message_fails_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(outbox, "backoff_delay", lambda attempts: -1)
+    uow = FakeUnitOfWork()
+    failing = outbox.enqueue_text(_ref_message("+41000"), "failing", uow)
+    outbox.enqueue_text(_ref_message("+41000"), "later", uow)
+    sender = RecordingSender(uow, failing={"failing"})
+
+    for _ in range(outbox.MAX_ATTEMPTS):
+        await sender.run_once()
+
+    assert failing.status == "failed"
+    assert failing.attempts == outbox.MAX_ATTEMPTS
+    # failed messages no longer block the recipient
+    await sender.run_once()
+    assert sender.sent == ["later"]
+
+
+def test_backoff_grows_and_is_capped():
+    assert 1 <= outbox.backoff_delay(1) <= 3
+    assert 4 <= outbox.backoff_delay(3) <= 12
+    assert outbox.backoff_delay(20) <= outbox.MAX_BACKOFF * 1.5
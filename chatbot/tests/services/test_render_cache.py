@@ -0,0 +1,61 @@
+from dataclasses import replace
+from unittest.mock import patch
+
+from grannymail.integrations import pdf_gen
+from grannymail.services.render_cache import RenderCache
+from tests.fake_repositories import FakeBlobRepo
+
+
+def test_identical_letters_are_rendered_once(address):
+    cache = RenderCache()
+    blobs = FakeBlobRepo("drafts")
+
+    blob_path, letter = cache.get_or_render("Hallo Doris", address, blobs)
+    with patch.object(pdf_gen, "create_letter_pdf_as_bytes") as mock_render:
+        assert cache.get_or_render("Hallo Doris", address, blobs) == (
+            blob_path,
+            letter,
+        )
+        mock_render.assert_not_called()
+
+    assert blobs.download(blob_path) == letter
+    assert cache.stats == {"memory_hits": 1, "blob_hits": 0, "renders": 1}
+
+
+def test_letters_are_looked_up_in_blob_storage(address):
+    blobs = FakeBlobRepo("drafts")
+    blob_path, letter = RenderCache().get_or_render("Hallo Doris", address, blobs)
+
+    # e.g. another worker or after a restart
+    cache = RenderCache()
+    assert cache.get_or_render("Hallo Doris", address, blobs) == (blob_path, letter)
+    assert cache.stats == {"memory_hits": 0, "blob_hits": 1, "renders": 0}
+
+
+def test_text_address_and_template_version_are_part_of_the_key(address, address2):
+    key = pdf_gen.letter_render_key("Hallo Doris", address)
+    assert pdf_gen.letter_render_key("Hallo Doris", replace(address)) == key
+    assert pdf_gen.letter_render_key("Hallo Dorothea", address) != key
+    assert pdf_gen.letter_render_key("Hallo Doris", address2) != key
+    with patch.object(pdf_gen, "TEMPLATE_VERSION", pdf_gen.TEMPLATE_VERSION + 1):
+        assert pdf_gen.letter_render_key("Hallo Doris", address) != key
+
+
+def test_least_recently_used_letters_are_evicted(address):
+    cache = RenderCache(max_letters=1)
+    blobs = FakeBlobRepo("drafts")
+    cache.get_or_render("first", address, blobs)
+    cache.get_or_render("second", address, blobs)
+    cache.get_or_render("first", address, blobs)
+    assert cache.stats == {"memory_hits": 0, "blob_hits": 1, "renders": 2}
+
+
+def test_letter_missing_from_storage_is_uploaded_again(address):
+    cache = RenderCache()
+    blobs = FakeBlobRepo("drafts")
+    blob_path, letter = cache.get_or_render("Hallo Doris", address, blobs)
+    # e.g. the upload failed after the letter was rendered
+    del blobs._blobs[blob_path]
+
+    assert cache.get_or_render("Hallo Doris", address, blobs) == (blob_path, letter)
+    assert blobs.download(blob_path) == letter
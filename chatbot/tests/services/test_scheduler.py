@@ -0,0 +1,55 @@
+import datetime
+
+import pytest
+
+from grannymail.services.scheduler import ScheduledJob, Scheduler
+from tests.fake_repositories import FakeUnitOfWork
+
+
+def _shared_uow_factory():
+    uow = FakeUnitOfWork()
+    return lambda: uow
+
+
+@pytest.mark.asyncio
+async def test_job_runs_on_one_worker_only():
+    uow_factory = _shared_uow_factory()
+    runs = []
+
+    async def job():
+        runs.append(1)
+
+    workers = [Scheduler(uow_factory) for _ in range(3)]
+    for worker in workers:
+        worker.every("test_job", datetime.timedelta(minutes=10), job)
+
+    results = [await worker.run_job(worker.jobs[0]) for worker in workers]
+
+    assert results == [True, False, False]
+    assert len(runs) == 1
+
+
+@pytest.mark.asyncio
+async def test_job_runs_again_once_lease_expired():
+    uow_factory = _shared_uow_factory()
+    runs = []
+
+    async def job():
+        runs.append(1)
+
+    first, second = Scheduler(uow_factory), Scheduler(uow_factory)
+    for worker in [first, second]:
+        worker.every("test_job", datetime.timedelta(minutes=10), job, lease_ttl=-1)
+
+    assert await first.run_job(first.jobs[0])
+    assert await second.run_job(second.jobs[0])
+    assert len(runs) == 2
+
+
+def test_daily_job_next_run():
+    async def job():
+        pass
+
+    scheduled_job = ScheduledJob("test_job", job, daily_at=datetime.time(hour=6))
+    now = datetime.datetime(2024, 4, 6, 7, tzinfo=datetime.timezone.utc)
+    assert scheduled_job.seconds_until_next_run(now) == 23 * 60 * 60
@@ -1,17 +1,14 @@
 import pytest
 
-from grannymail.entrypoints.api.endpoints.whatsapp import webhook_route
+from grannymail.entrypoints.api.endpoints.whatsapp import get_user_executor
 
 from .fake_repositories import FakeUnitOfWork
 from .utils import _create_whatsapp_text_message
 
 
 @pytest.mark.asyncio
-async def test_whatsapp_endpoint_help_message(mocker):
-    msnger_mock = mocker.patch(
-        "grannymail.integrations.messengers.whatsapp.Whatsapp.reply_text",
-        new_callable=mocker.AsyncMock,
-    )
+async def test_whatsapp_endpoint_help_message(mocker, async_client):
+    msnger_mock = mocker.patch("grannymail.services.outbox.enqueue_text")
     mocker.patch(
         "grannymail.services.unit_of_work.SupabaseUnitOfWork",
         new_callable=lambda: FakeUnitOfWork,
@@ -19,8 +16,9 @@ async def test_whatsapp_endpoint_help_message(mocker):
     # Create a mock request data object
     data = _create_whatsapp_text_message(message_body="/help")
 
-    # Invoke the webhook_route function
-    response = await webhook_route(data)
+    # Post the delivery to the webhook, the message is processed in the background
+    response = await async_client.post("/api/whatsapp/", content=data.model_dump_json())
+    await get_user_executor().join()
 
     # Assert the response status code and content
     assert response.status_code == 200
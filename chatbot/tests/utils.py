@@ -7,8 +7,10 @@ from unittest.mock import AsyncMock, MagicMock
 
 from telegram import Update
 
-from grannymail.entrypoints.api.endpoints.telegram import ptb
+import grannymail.domain.models as m
+from grannymail.entrypoints.api.endpoints.telegram import get_ptb
 from grannymail.integrations.messengers.whatsapp import WebhookRequestData
+from grannymail.utils.utils import get_utc_timestamp
 
 
 def generate_whatsapp_httpx_response(start_id=1000):
@@ -17,11 +19,20 @@ def generate_whatsapp_httpx_response(start_id=1000):
         start_id += 1
 
 
+def create_credit_entry(user: m.User, delta: int) -> m.CreditLedgerEntry:
+    return m.CreditLedgerEntry(
+        user_id=user.user_id,
+        delta=delta,
+        reason="test",
+        created_at=get_utc_timestamp(),
+    )
+
+
 def create_mock_update(data: dict, username="mike_mockowitz") -> Update:
     """
     Factory function to create a mock Update object from a given data dictionary.
     """
-    update = Update.de_json(data, ptb.bot)
+    update = Update.de_json(data, get_ptb().bot)
     assert update is not None
     return update
 
@@ -0,0 +1,34 @@
+from grannymail.utils import address_index
+from grannymail.utils.message_utils import fetch_closest_address_index
+
+
+def test_fetch_closest_address_index(address, address2):
+    address_book = [address, address2]
+    assert fetch_closest_address_index("Yankee", address_book) == 1
+    assert fetch_closest_address_index("mama", address_book) == 0
+    assert fetch_closest_address_index("Doris", address_book) == -1
+
+
+def test_index_syncs_incrementally(address, address2):
+    index = address_index.AddressSearchIndex()
+    index.sync([address])
+    assert len(index) == 1
+    assert index.search("Yankee") is None
+
+    index.sync([address, address2])
+    assert index.search("Yankee") == address2.address_id
+
+    index.sync([address2])
+    assert len(index) == 1
+    assert index.search("Mama Mockowitz") is None
+
+
+def test_index_is_updated_on_add_and_delete(user, address, address2):
+    index = address_index.get_user_index(user.user_id)
+    index.sync([address])
+
+    address_index.on_address_added(address2)
+    assert index.search("Yankee") == address2.address_id
+
+    address_index.on_address_deleted(address2.address_id)
+    assert index.search("Yankee") is None
@@ -0,0 +1,37 @@
+from unittest.mock import patch
+
+from grannymail.utils.credit_balances import CreditBalanceCache
+
+
+def test_cache_returns_set_balance():
+    cache = CreditBalanceCache()
+    assert cache.get("user") is None
+    cache.set("user", 3, last_entry_id=10)
+    assert cache.get("user") == 3
+    cache.invalidate("user")
+    assert cache.get("user") is None
+
+
+def test_cache_ignores_older_balances():
+    cache = CreditBalanceCache()
+    cache.set("user", 3, last_entry_id=10)
+    cache.set("user", 5, last_entry_id=8)
+    assert cache.get("user") == 3
+
+
+def test_cache_expires_balances():
+    cache = CreditBalanceCache(ttl=60)
+    with patch("time.monotonic", return_value=0):
+        cache.set("user", 3, last_entry_id=10)
+    with patch("time.monotonic", return_value=61):
+        assert cache.get("user") is None
+
+
+def test_cache_evicts_least_recently_used_user():
+    cache = CreditBalanceCache(max_users=2)
+    cache.set("a", 1, last_entry_id=1)
+    cache.set("b", 2, last_entry_id=2)
+    cache.get("a")
+    cache.set("c", 3, last_entry_id=3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
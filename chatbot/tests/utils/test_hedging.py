@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from grannymail.utils.hedging import HedgePolicy, hedged_request
+
+
+def _warm_policy(latency: float, **kwargs) -> HedgePolicy:
+    policy = HedgePolicy("test", default_timeout=5, min_samples=5, **kwargs)
+    for _ in range(10):
+        policy.observe(latency)
+    return policy
+
+
+def test_policy_uses_defaults_without_enough_samples():
+    policy = HedgePolicy("test", default_timeout=30, min_samples=5)
+    policy.observe(1.0)
+    assert policy.hedge_delay is None
+    assert policy.timeout == 30
+
+
+def test_policy_derives_timeout_from_percentiles():
+    policy = _warm_policy(2.0, min_timeout=1, max_timeout=60)
+    assert policy.hedge_delay == 2.0
+    assert policy.timeout == 4.0
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_no_hedge_for_fast_request():
+    policy = _warm_policy(0.1)
+
+    async def request(timeout: float) -> str:
+        return "fast"
+
+    assert await hedged_request(request, policy) == "fast"
+    assert policy.stats.hedges_fired == 0
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_hedge_wins_over_stalled_request():
+    policy = _warm_policy(0.05)
+    calls = []
+
+    async def request(timeout: float) -> str:
+        calls.append(timeout)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+            return "stalled"
+        return "hedge"
+
+    assert await hedged_request(request, policy) == "hedge"
+    assert len(calls) == 2
+    assert policy.stats.hedges_fired == 1
+    assert policy.stats.hedges_won == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_times_out():
+    policy = HedgePolicy("test", default_timeout=0.05)
+
+    async def request(timeout: float) -> str:
+        await asyncio.sleep(10)
+        return "never"
+
+    with pytest.raises(asyncio.TimeoutError):
+        await hedged_request(request, policy)
+    assert policy.stats.timeouts == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_raises_error_of_failed_request():
+    policy = HedgePolicy("test", default_timeout=1)
+
+    async def request(timeout: float) -> str:
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await hedged_request(request, policy)
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_discards_result_that_finished_with_the_winner():
+    policy = _warm_policy(0.05)
+    hedge_fired = asyncio.Event()
+    calls = []
+    discarded = []
+
+    async def request(timeout: float) -> str:
+        calls.append(timeout)
+        if len(calls) == 1:
+            await hedge_fired.wait()
+            return "primary"
+        # wakes up the primary request, so that both finish in the same round
+        hedge_fired.set()
+        return "hedge"
+
+    async def on_discard(result: str) -> None:
+        discarded.append(result)
+
+    result = await hedged_request(request, policy, on_discard=on_discard)
+
+    assert sorted([result, *discarded]) == ["hedge", "primary"]
@@ -0,0 +1,21 @@
+import sys
+
+from grannymail.utils import lazy
+
+
+def test_lazy_module_is_imported_on_first_access(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    loaded = []
+    module = lazy.LazyModule("colorsys", on_load=lambda m: loaded.append(m.__name__))
+
+    assert "colorsys" not in sys.modules
+    assert module.rgb_to_hsv(1, 0, 0)[0] == 0
+    assert "colorsys" in sys.modules
+    assert loaded == ["colorsys"]
+
+    module.hsv_to_rgb(0, 0, 0)
+    assert loaded == ["colorsys"]
+
+
+def test_lazy_import_returns_one_stand_in_per_module():
+    assert lazy.lazy_import("json") is lazy.lazy_import("json")
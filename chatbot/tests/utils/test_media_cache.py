@@ -0,0 +1,36 @@
+from unittest.mock import patch
+
+from grannymail.utils.media_cache import MediaIdCache, content_key
+
+
+def test_content_key_depends_on_content_and_extra_values():
+    assert content_key(b"letter") == content_key(b"letter")
+    assert content_key(b"letter") != content_key(b"other letter")
+    assert content_key(b"letter", "a.pdf") != content_key(b"letter", "b.pdf")
+
+
+def test_cache_returns_set_media_id():
+    cache = MediaIdCache(ttl=60)
+    assert cache.get("key") is None
+    cache.set("key", "media")
+    assert cache.get("key") == "media"
+    cache.invalidate("key")
+    assert cache.get("key") is None
+
+
+def test_cache_expires_media_ids():
+    cache = MediaIdCache(ttl=60)
+    with patch("time.monotonic", return_value=0):
+        cache.set("key", "media")
+    with patch("time.monotonic", return_value=61):
+        assert cache.get("key") is None
+
+
+def test_cache_evicts_least_recently_used_media():
+    cache = MediaIdCache(ttl=60, max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
@@ -1,7 +1,13 @@
+import asyncio
 import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
 
 import pytest
 
+import grannymail.integrations.pdf_gen as pdf_gen
+from grannymail.utils import message_utils
+from grannymail.utils.hedging import HedgePolicy
 from grannymail.utils.message_utils import (
     implement_letter_edits,
     transcribe_voice_memo,
@@ -38,3 +44,116 @@ from grannymail.utils.message_utils import (
 #     assert "schlecht" in response
 #     assert "Doris" not in response
 #     assert "gut" not in response
+
+
+class _FakeStream:
+    def __init__(self, deltas: list[str], first_chunk_delay: float = 0):
+        self.deltas = deltas
+        self.first_chunk_delay = first_chunk_delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self.first_chunk_delay)
+        for delta in self.deltas:
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))]
+            )
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_completion_lays_out_paragraphs():
+    stream = _FakeStream(["Dear Doris,\nHow ", "are you?\n", "Best, Mike"])
+    layout = pdf_gen.LetterLayout()
+    with patch.object(
+        message_utils.get_openai_client().chat.completions,
+        "create",
+        new=AsyncMock(return_value=stream),
+    ):
+        content = await message_utils._stream_chat_completion(
+            [], HedgePolicy("test", default_timeout=1), layout
+        )
+    assert content == "Dear Doris,\nHow are you?\nBest, Mike"
+    paragraphs = [f.text for f in layout.story if hasattr(f, "text")]
+    assert paragraphs == ["Dear Doris,", "How are you?", "Best, Mike"]
+    assert stream.closed
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_completion_aborts_on_unsupported_characters():
+    stream = _FakeStream(["Dear Doris,\n", "你好", "never read"])
+    with patch.object(
+        message_utils.get_openai_client().chat.completions,
+        "create",
+        new=AsyncMock(return_value=stream),
+    ):
+        with pytest.raises(message_utils.CharactersNotSupported):
+            await message_utils._stream_chat_completion(
+                [], HedgePolicy("test", default_timeout=1), pdf_gen.LetterLayout()
+            )
+    assert stream.closed
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_completion_hedges_stalled_first_chunk():
+    policy = HedgePolicy("test", default_timeout=5, min_samples=5)
+    for _ in range(10):
+        policy.observe(0.05)
+    stalled = _FakeStream(["stalled"], first_chunk_delay=10)
+    hedge = _FakeStream(["Dear Doris"])
+    with patch.object(
+        message_utils.get_openai_client().chat.completions,
+        "create",
+        new=AsyncMock(side_effect=[stalled, hedge]),
+    ):
+        content = await message_utils._stream_chat_completion(
+            [], policy, pdf_gen.LetterLayout()
+        )
+    assert content == "Dear Doris"
+    assert policy.stats.hedges_won == 1
+    # the stalled request closes its stream once its cancellation is processed
+    await asyncio.sleep(0)
+    assert stalled.closed and hedge.closed
+
+
+def test_split_transcript_respects_sentences_and_length():
+    transcript = "This is one sentence. " * 50
+    segments = message_utils._split_transcript(transcript, 100)
+    assert len(segments) > 1
+    assert all(len(segment) <= 100 for segment in segments)
+    assert all(segment.endswith(".") for segment in segments)
+    assert " ".join(segments) == transcript.strip()
+
+
+@pytest.mark.asyncio
+async def test_map_reduce_letter_text_generates_and_stitches_sections():
+    async def fake_completion(messages, policy, model="gpt-3.5-turbo"):
+        prompt = messages[-1]["content"]
+        if "Rewritten paragraph" in prompt:
+            return "Stitched opening"
+        part = prompt.split("part ")[1].split(" of")[0]
+        return f"Opening {part}\nBody {part}"
+
+    transcript = "Some sentence. " * 500
+    with patch.object(message_utils, "_create_chat_completion", new=fake_completion):
+        letter = await message_utils._map_reduce_letter_text(transcript, "system", "")
+    num_segments = len(
+        message_utils._split_transcript(
+            transcript, message_utils.TRANSCRIPT_SEGMENT_LENGTH
+        )
+    )
+    lines = letter.split("\n")
+    assert lines[:2] == ["Opening 1", "Body 1"]
+    assert lines.count("Stitched opening") == num_segments - 1
+    assert lines[-1] == f"Body {num_segments}"
+
+
+def test_check_supported_by_times_new_roman():
+    message_utils._check_supported_by_times_new_roman("Hallo Doris,\nwie geht's?")
+    with pytest.raises(message_utils.CharactersNotSupported):
+        message_utils._check_supported_by_times_new_roman("Hallo 你好")
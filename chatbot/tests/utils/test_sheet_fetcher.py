@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from grannymail.utils.sheet_fetcher import SheetFetcher
+
+SHEET_URL = "https://sheets.example.com/messages.csv"
+CSV = b"message_identifier,message_body\nhelp-success,Hello\nsend-success,Sent\n"
+
+
+def _response(status_code: int, content: bytes = b"", headers=None) -> httpx.Response:
+    return httpx.Response(
+        status_code,
+        content=content,
+        headers=headers,
+        request=httpx.Request("GET", SHEET_URL),
+    )
+
+
+def test_local_file_stands_in_for_sheet(tmp_path):
+    path = tmp_path / "messages.csv"
+    path.write_bytes(CSV)
+    fetcher = SheetFetcher(SHEET_URL, local_path=str(path))
+
+    with patch("httpx.get") as mock_get:
+        assert fetcher.get_value("help-success", "message_body") == "Hello"
+    mock_get.assert_not_called()
+    with pytest.raises(ValueError):
+        fetcher.get_value("unknown", "message_body")
+
+
+def test_lookups_are_served_from_memory():
+    fetcher = SheetFetcher(SHEET_URL)
+    with patch("httpx.get", return_value=_response(200, CSV)) as mock_get:
+        assert fetcher.get_value("help-success", "message_body") == "Hello"
+        assert fetcher.get_value("send-success", "message_body") == "Sent"
+    assert mock_get.call_count == 1
+
+
+def test_revalidates_with_conditional_request(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.csv")
+    fetcher = SheetFetcher(SHEET_URL, snapshot_path=snapshot_path)
+    with patch("httpx.get", return_value=_response(200, CSV, {"ETag": '"v1"'})):
+        fetcher.get_dataframe()
+
+    fetcher.invalidate()
+    with patch("httpx.get", return_value=_response(304)) as mock_get, patch(
+        "pandas.read_csv"
+    ) as mock_read_csv:
+        assert fetcher.get_value("help-success", "message_body") == "Hello"
+    assert mock_get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+    mock_read_csv.assert_not_called()
+
+    # a restarted fetcher starts from the snapshot and can revalidate it
+    restarted = SheetFetcher(SHEET_URL, snapshot_path=snapshot_path)
+    with patch("httpx.get", side_effect=httpx.ConnectError("offline")):
+        assert restarted.get_value("send-success", "message_body") == "Sent"
@@ -0,0 +1,41 @@
+create table "public"."stripe_events" (
+    "event_id" text not null,
+    "type" text not null,
+    "payload" jsonb not null,
+    "status" character varying not null default 'received'::character varying,
+    "received_at" timestamp with time zone not null default (now() AT TIME ZONE 'utc'::text),
+    "processed_at" timestamp with time zone,
+    "error" text
+);
+
+alter table "public"."stripe_events" enable row level security;
+
+CREATE UNIQUE INDEX stripe_events_pkey ON public.stripe_events USING btree (event_id);
+
+CREATE INDEX stripe_events_status_idx ON public.stripe_events USING btree (status, received_at);
+
+alter table "public"."stripe_events" add constraint "stripe_events_pkey" PRIMARY KEY using index "stripe_events_pkey";
+
+grant delete on table "public"."stripe_events" to "anon";
+
+grant insert on table "public"."stripe_events" to "anon";
+
+grant select on table "public"."stripe_events" to "anon";
+
+grant update on table "public"."stripe_events" to "anon";
+
+grant delete on table "public"."stripe_events" to "authenticated";
+
+grant insert on table "public"."stripe_events" to "authenticated";
+
+grant select on table "public"."stripe_events" to "authenticated";
+
+grant update on table "public"."stripe_events" to "authenticated";
+
+grant delete on table "public"."stripe_events" to "service_role";
+
+grant insert on table "public"."stripe_events" to "service_role";
+
+grant select on table "public"."stripe_events" to "service_role";
+
+grant update on table "public"."stripe_events" to "service_role";
@@ -0,0 +1,55 @@
+-- Moves an order from one status to another and adjusts the letter credits of its
+-- user in a single transaction.
+--
+-- p_credits_added is always added to the balance (e.g. credits that were bought),
+-- p_credit_delta is only applied if the order was transitioned (e.g. -1 for the
+-- credit that pays for the letter). The transition is skipped if the order is not
+-- in p_from_status or if the balance would become negative. Locking the user row
+-- serialises concurrent calls for the same user, so no update is lost.
+CREATE OR REPLACE FUNCTION "public"."transition_order_and_adjust_credits"(
+    "p_order_id" "uuid",
+    "p_from_status" character varying,
+    "p_to_status" character varying,
+    "p_credits_added" integer DEFAULT 0,
+    "p_credit_delta" integer DEFAULT 0
+) RETURNS TABLE("transitioned" boolean, "num_letter_credits" bigint)
+    LANGUAGE "plpgsql"
+    AS $$
+DECLARE
+    v_user_id uuid;
+    v_balance bigint;
+    v_transitioned boolean := false;
+BEGIN
+    SELECT o.user_id INTO v_user_id FROM public.orders o WHERE o.order_id = p_order_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Order % not found', p_order_id;
+    END IF;
+
+    SELECT coalesce(u.num_letter_credits, 0) INTO v_balance
+    FROM public.users u
+    WHERE u.user_id = v_user_id
+    FOR UPDATE;
+    v_balance := v_balance + p_credits_added;
+
+    IF v_balance + p_credit_delta >= 0 THEN
+        UPDATE public.orders o
+        SET status = p_to_status
+        WHERE o.order_id = p_order_id AND o.status = p_from_status;
+        v_transitioned := FOUND;
+    END IF;
+
+    IF v_transitioned THEN
+        v_balance := v_balance + p_credit_delta;
+    END IF;
+
+    UPDATE public.users u SET num_letter_credits = v_balance WHERE u.user_id = v_user_id;
+
+    RETURN QUERY SELECT v_transitioned, v_balance;
+END;
+$$;
+
+ALTER FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) TO "service_role";
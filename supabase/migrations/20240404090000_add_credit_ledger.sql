@@ -0,0 +1,176 @@
+-- Letter credits are kept in an append-only ledger. A user's balance is the latest
+-- snapshot in credit_balances plus all ledger entries written after it.
+
+create table "public"."credit_ledger" (
+    "entry_id" bigserial not null,
+    "user_id" uuid not null,
+    "delta" bigint not null,
+    "reason" character varying not null,
+    "order_id" uuid,
+    "created_at" timestamp with time zone not null default (now() AT TIME ZONE 'utc'::text)
+);
+
+create table "public"."credit_balances" (
+    "user_id" uuid not null,
+    "balance" bigint not null default '0'::bigint,
+    "last_entry_id" bigint not null default '0'::bigint,
+    "updated_at" timestamp with time zone not null default (now() AT TIME ZONE 'utc'::text)
+);
+
+alter table "public"."credit_ledger" enable row level security;
+
+alter table "public"."credit_balances" enable row level security;
+
+CREATE UNIQUE INDEX credit_ledger_pkey ON public.credit_ledger USING btree (entry_id);
+
+CREATE INDEX credit_ledger_user_id_entry_id_idx ON public.credit_ledger USING btree (user_id, entry_id);
+
+CREATE UNIQUE INDEX credit_balances_pkey ON public.credit_balances USING btree (user_id);
+
+alter table "public"."credit_ledger" add constraint "credit_ledger_pkey" PRIMARY KEY using index "credit_ledger_pkey";
+
+alter table "public"."credit_balances" add constraint "credit_balances_pkey" PRIMARY KEY using index "credit_balances_pkey";
+
+alter table "public"."credit_ledger" add constraint "credit_ledger_user_id_fkey" FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE;
+
+alter table "public"."credit_ledger" add constraint "credit_ledger_order_id_fkey" FOREIGN KEY (order_id) REFERENCES orders(order_id) ON DELETE SET NULL;
+
+alter table "public"."credit_balances" add constraint "credit_balances_user_id_fkey" FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE;
+
+-- carry over the existing balances as opening entries
+insert into "public"."credit_ledger" (user_id, delta, reason)
+select user_id, num_letter_credits, 'opening_balance'
+from "public"."users"
+where num_letter_credits is not null and num_letter_credits <> 0;
+
+alter table "public"."users" drop column "num_letter_credits";
+
+
+CREATE OR REPLACE FUNCTION "public"."get_credit_balance"("p_user_id" "uuid")
+RETURNS TABLE("balance" bigint, "last_entry_id" bigint)
+    LANGUAGE "sql" STABLE
+    AS $$
+    SELECT
+        coalesce(b.balance, 0) + coalesce(sum(l.delta), 0),
+        greatest(coalesce(b.last_entry_id, 0), coalesce(max(l.entry_id), 0))
+    FROM (SELECT p_user_id AS user_id) u
+    LEFT JOIN public.credit_balances b ON b.user_id = u.user_id
+    LEFT JOIN public.credit_ledger l
+        ON l.user_id = u.user_id AND l.entry_id > coalesce(b.last_entry_id, 0)
+    GROUP BY b.balance, b.last_entry_id;
+$$;
+
+-- Folds ledger entries into the balance snapshots. Entries are kept for auditing,
+-- compaction only bounds the number of entries a balance lookup has to sum up. Recent
+-- entries are skipped so that a transaction that has not committed yet cannot end up
+-- below the snapshot's last_entry_id.
+CREATE OR REPLACE FUNCTION "public"."compact_credit_ledger"()
+RETURNS integer
+    LANGUAGE "plpgsql"
+    AS $$
+DECLARE
+    v_num_users integer;
+BEGIN
+    INSERT INTO public.credit_balances AS b (user_id, balance, last_entry_id, updated_at)
+    SELECT
+        l.user_id,
+        coalesce(max(cb.balance), 0) + sum(l.delta),
+        max(l.entry_id),
+        now() AT TIME ZONE 'utc'::text
+    FROM public.credit_ledger l
+    LEFT JOIN public.credit_balances cb ON cb.user_id = l.user_id
+    WHERE l.entry_id > coalesce(cb.last_entry_id, 0)
+        AND l.created_at < (now() AT TIME ZONE 'utc'::text) - interval '5 minutes'
+    GROUP BY l.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET balance = excluded.balance,
+        last_entry_id = excluded.last_entry_id,
+        updated_at = excluded.updated_at;
+    GET DIAGNOSTICS v_num_users = ROW_COUNT;
+    RETURN v_num_users;
+END;
+$$;
+
+-- Replaces the version that updated users.num_letter_credits, the credit changes are
+-- now appended to the ledger. The user row is still locked to serialise concurrent
+-- calls for the same user.
+DROP FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer);
+
+CREATE FUNCTION "public"."transition_order_and_adjust_credits"(
+    "p_order_id" "uuid",
+    "p_from_status" character varying,
+    "p_to_status" character varying,
+    "p_credits_added" integer DEFAULT 0,
+    "p_credit_delta" integer DEFAULT 0
+) RETURNS TABLE("transitioned" boolean, "user_id" "uuid", "num_letter_credits" bigint, "last_entry_id" bigint)
+    LANGUAGE "plpgsql"
+    AS $$
+DECLARE
+    v_user_id uuid;
+    v_balance bigint;
+    v_last_entry_id bigint;
+    v_transitioned boolean := false;
+BEGIN
+    SELECT o.user_id INTO v_user_id FROM public.orders o WHERE o.order_id = p_order_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Order % not found', p_order_id;
+    END IF;
+
+    PERFORM 1 FROM public.users u WHERE u.user_id = v_user_id FOR UPDATE;
+    SELECT b.balance, b.last_entry_id INTO v_balance, v_last_entry_id
+    FROM public.get_credit_balance(v_user_id) b;
+
+    IF p_credits_added <> 0 THEN
+        INSERT INTO public.credit_ledger (user_id, delta, reason, order_id)
+        VALUES (v_user_id, p_credits_added, 'purchase', p_order_id)
+        RETURNING entry_id INTO v_last_entry_id;
+        v_balance := v_balance + p_credits_added;
+    END IF;
+
+    IF v_balance + p_credit_delta >= 0 THEN
+        UPDATE public.orders o
+        SET status = p_to_status
+        WHERE o.order_id = p_order_id AND o.status = p_from_status;
+        v_transitioned := FOUND;
+    END IF;
+
+    IF v_transitioned AND p_credit_delta <> 0 THEN
+        INSERT INTO public.credit_ledger (user_id, delta, reason, order_id)
+        VALUES (v_user_id, p_credit_delta, 'order_' || p_to_status, p_order_id)
+        RETURNING entry_id INTO v_last_entry_id;
+        v_balance := v_balance + p_credit_delta;
+    END IF;
+
+    RETURN QUERY SELECT v_transitioned, v_user_id, v_balance, v_last_entry_id;
+END;
+$$;
+
+ALTER FUNCTION "public"."get_credit_balance"("uuid") OWNER TO "postgres";
+ALTER FUNCTION "public"."compact_credit_ledger"() OWNER TO "postgres";
+ALTER FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."get_credit_balance"("uuid") TO "anon";
+GRANT ALL ON FUNCTION "public"."get_credit_balance"("uuid") TO "authenticated";
+GRANT ALL ON FUNCTION "public"."get_credit_balance"("uuid") TO "service_role";
+GRANT ALL ON FUNCTION "public"."compact_credit_ledger"() TO "service_role";
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer) TO "service_role";
+
+grant insert on table "public"."credit_ledger" to "service_role";
+
+grant select on table "public"."credit_ledger" to "service_role";
+
+grant insert on table "public"."credit_ledger" to "anon";
+
+grant select on table "public"."credit_ledger" to "anon";
+
+grant usage, select on sequence "public"."credit_ledger_entry_id_seq" to "anon", "authenticated", "service_role";
+
+grant insert on table "public"."credit_balances" to "service_role";
+
+grant select on table "public"."credit_balances" to "service_role";
+
+grant update on table "public"."credit_balances" to "service_role";
+
+grant select on table "public"."credit_balances" to "anon";
@@ -0,0 +1,25 @@
+-- Applies a diff of the system messages in a single transaction, so readers never
+-- see a partially synchronised table.
+CREATE OR REPLACE FUNCTION "public"."sync_system_messages"(
+    "p_upserts" "jsonb",
+    "p_deletes" "text"[]
+) RETURNS void
+    LANGUAGE "plpgsql"
+    AS $$
+BEGIN
+    INSERT INTO public.system_messages (message_identifier, message_body)
+    SELECT u.message_identifier, u.message_body
+    FROM jsonb_to_recordset(p_upserts) AS u(message_identifier text, message_body text)
+    ON CONFLICT (message_identifier) DO UPDATE
+    SET message_body = excluded.message_body;
+
+    DELETE FROM public.system_messages s
+    WHERE s.message_identifier = ANY(p_deletes);
+END;
+$$;
+
+ALTER FUNCTION "public"."sync_system_messages"("jsonb", "text"[]) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."sync_system_messages"("jsonb", "text"[]) TO "anon";
+GRANT ALL ON FUNCTION "public"."sync_system_messages"("jsonb", "text"[]) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."sync_system_messages"("jsonb", "text"[]) TO "service_role";
@@ -0,0 +1,51 @@
+create table "public"."job_leases" (
+    "job_name" text not null,
+    "holder" text not null,
+    "expires_at" timestamp with time zone not null,
+    "acquired_at" timestamp with time zone not null default now()
+);
+
+alter table "public"."job_leases" enable row level security;
+
+CREATE UNIQUE INDEX job_leases_pkey ON public.job_leases USING btree (job_name);
+
+alter table "public"."job_leases" add constraint "job_leases_pkey" PRIMARY KEY using index "job_leases_pkey";
+
+-- Grants the lease of a job to the holder if nobody holds it or the lease expired.
+-- The upsert is atomic, so of several workers that race for a lease exactly one wins.
+CREATE OR REPLACE FUNCTION "public"."try_acquire_job_lease"(
+    "p_job_name" text,
+    "p_holder" text,
+    "p_ttl_seconds" integer
+) RETURNS boolean
+    LANGUAGE "plpgsql"
+    AS $$
+BEGIN
+    INSERT INTO public.job_leases AS l (job_name, holder, expires_at, acquired_at)
+    VALUES (p_job_name, p_holder, now() + make_interval(secs => p_ttl_seconds), now())
+    ON CONFLICT (job_name) DO UPDATE
+    SET holder = excluded.holder,
+        expires_at = excluded.expires_at,
+        acquired_at = excluded.acquired_at
+    WHERE l.expires_at < now();
+    RETURN FOUND;
+END;
+$$;
+
+ALTER FUNCTION "public"."try_acquire_job_lease"(text, text, integer) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."try_acquire_job_lease"(text, text, integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."try_acquire_job_lease"(text, text, integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."try_acquire_job_lease"(text, text, integer) TO "service_role";
+
+grant select on table "public"."job_leases" to "anon";
+
+grant select on table "public"."job_leases" to "authenticated";
+
+grant delete on table "public"."job_leases" to "service_role";
+
+grant insert on table "public"."job_leases" to "service_role";
+
+grant select on table "public"."job_leases" to "service_role";
+
+grant update on table "public"."job_leases" to "service_role";
@@ -0,0 +1,51 @@
+create table "public"."delivery_statuses" (
+    "status_id" uuid not null default gen_random_uuid(),
+    "wa_mid" character varying not null,
+    "status" character varying not null,
+    "status_timestamp" timestamp with time zone not null,
+    "received_at" timestamp with time zone not null default (now() AT TIME ZONE 'utc'::text),
+    "message_id" uuid,
+    "latency_seconds" double precision,
+    "error" text
+);
+
+alter table "public"."delivery_statuses" enable row level security;
+
+CREATE UNIQUE INDEX delivery_statuses_pkey ON public.delivery_statuses USING btree (status_id);
+
+-- WhatsApp retries status callbacks, every transition of a message is stored once
+CREATE UNIQUE INDEX delivery_statuses_wa_mid_status_key ON public.delivery_statuses USING btree (wa_mid, status);
+
+CREATE INDEX delivery_statuses_status_idx ON public.delivery_statuses USING btree (status, status_timestamp);
+
+alter table "public"."delivery_statuses" add constraint "delivery_statuses_pkey" PRIMARY KEY using index "delivery_statuses_pkey";
+
+alter table "public"."delivery_statuses" add constraint "delivery_statuses_wa_mid_status_key" UNIQUE using index "delivery_statuses_wa_mid_status_key";
+
+alter table "public"."delivery_statuses" add constraint "delivery_statuses_message_id_fkey" FOREIGN KEY (message_id) REFERENCES messages(message_id) ON DELETE CASCADE not valid;
+
+alter table "public"."delivery_statuses" validate constraint "delivery_statuses_message_id_fkey";
+
+grant delete on table "public"."delivery_statuses" to "anon";
+
+grant insert on table "public"."delivery_statuses" to "anon";
+
+grant select on table "public"."delivery_statuses" to "anon";
+
+grant update on table "public"."delivery_statuses" to "anon";
+
+grant delete on table "public"."delivery_statuses" to "authenticated";
+
+grant insert on table "public"."delivery_statuses" to "authenticated";
+
+grant select on table "public"."delivery_statuses" to "authenticated";
+
+grant update on table "public"."delivery_statuses" to "authenticated";
+
+grant delete on table "public"."delivery_statuses" to "service_role";
+
+grant insert on table "public"."delivery_statuses" to "service_role";
+
+grant select on table "public"."delivery_statuses" to "service_role";
+
+grant update on table "public"."delivery_statuses" to "service_role";
@@ -0,0 +1,94 @@
+create table "public"."outbox" (
+    "outbox_id" uuid not null default gen_random_uuid(),
+    "seq" bigint generated by default as identity,
+    "ref_message_id" uuid not null,
+    "messaging_platform" character varying not null,
+    "recipient" text not null,
+    "message_body" text not null,
+    "status" character varying not null default 'pending'::character varying,
+    "attempts" integer not null default 0,
+    "next_attempt_at" timestamp with time zone not null default now(),
+    "claimed_until" timestamp with time zone,
+    "created_at" timestamp with time zone not null default now(),
+    "sent_at" timestamp with time zone,
+    "last_error" text
+);
+
+alter table "public"."outbox" enable row level security;
+
+CREATE UNIQUE INDEX outbox_pkey ON public.outbox USING btree (outbox_id);
+
+CREATE INDEX outbox_open_idx ON public.outbox USING btree (recipient, seq) WHERE status IN ('pending', 'sending');
+
+alter table "public"."outbox" add constraint "outbox_pkey" PRIMARY KEY using index "outbox_pkey";
+
+alter table "public"."outbox" add constraint "outbox_ref_message_id_fkey" FOREIGN KEY (ref_message_id) REFERENCES messages(message_id) ON DELETE CASCADE not valid;
+
+alter table "public"."outbox" validate constraint "outbox_ref_message_id_fkey";
+
+-- Claims the next message of up to p_limit recipients. Only the oldest open message
+-- of a recipient can be claimed, so messages to one recipient are sent in order even
+-- while an earlier one waits for a retry. Claims expire after p_lease_seconds so that
+-- messages of a crashed worker are picked up again.
+CREATE OR REPLACE FUNCTION "public"."claim_outbox_messages"(
+    "p_limit" integer,
+    "p_lease_seconds" integer
+) RETURNS SETOF "public"."outbox"
+    LANGUAGE "plpgsql"
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH heads AS (
+        SELECT DISTINCT ON (o.recipient) o.outbox_id, o.status, o.next_attempt_at, o.claimed_until
+        FROM public.outbox o
+        WHERE o.status IN ('pending', 'sending')
+        ORDER BY o.recipient, o.seq
+    ), claimable AS (
+        SELECT h.outbox_id
+        FROM heads h
+        WHERE (h.status = 'pending' AND h.next_attempt_at <= now())
+           OR (h.status = 'sending' AND h.claimed_until < now())
+        LIMIT p_limit
+    )
+    UPDATE public.outbox o
+    SET status = 'sending',
+        attempts = o.attempts + 1,
+        claimed_until = now() + make_interval(secs => p_lease_seconds)
+    FROM claimable c
+    WHERE o.outbox_id = c.outbox_id
+      -- re-checked after waiting for a concurrent claim of the same row
+      AND ((o.status = 'pending' AND o.next_attempt_at <= now())
+           OR (o.status = 'sending' AND o.claimed_until < now()))
+    RETURNING o.*;
+END;
+$$;
+
+ALTER FUNCTION "public"."claim_outbox_messages"(integer, integer) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."claim_outbox_messages"(integer, integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."claim_outbox_messages"(integer, integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."claim_outbox_messages"(integer, integer) TO "service_role";
+
+grant delete on table "public"."outbox" to "anon";
+
+grant insert on table "public"."outbox" to "anon";
+
+grant select on table "public"."outbox" to "anon";
+
+grant update on table "public"."outbox" to "anon";
+
+grant delete on table "public"."outbox" to "authenticated";
+
+grant insert on table "public"."outbox" to "authenticated";
+
+grant select on table "public"."outbox" to "authenticated";
+
+grant update on table "public"."outbox" to "authenticated";
+
+grant delete on table "public"."outbox" to "service_role";
+
+grant insert on table "public"."outbox" to "service_role";
+
+grant select on table "public"."outbox" to "service_role";
+
+grant update on table "public"."outbox" to "service_role";
@@ -0,0 +1,73 @@
+create table "public"."broadcasts" (
+    "broadcast_id" character varying not null,
+    "message_identifier" character varying not null,
+    "status" character varying not null default 'running'::character varying,
+    "last_user_id" uuid,
+    "num_sent" integer not null default 0,
+    "num_failed" integer not null default 0,
+    "created_at" timestamp with time zone not null default now(),
+    "updated_at" timestamp with time zone not null default now(),
+    "completed_at" timestamp with time zone
+);
+
+alter table "public"."broadcasts" enable row level security;
+
+CREATE UNIQUE INDEX broadcasts_pkey ON public.broadcasts USING btree (broadcast_id);
+
+alter table "public"."broadcasts" add constraint "broadcasts_pkey" PRIMARY KEY using index "broadcasts_pkey";
+
+-- serves the lookup of the latest message of every user
+CREATE INDEX IF NOT EXISTS messages_user_id_timestamp_idx ON public.messages USING btree (user_id, "timestamp" DESC) WHERE sent_by = 'user';
+
+-- Returns the next p_limit users after p_after_user_id, ordered by their id, together
+-- with the latest message they sent us. The message tells on which platform and chat
+-- the user can be reached. Users who never sent a message are skipped.
+CREATE OR REPLACE FUNCTION "public"."get_broadcast_recipients"(
+    "p_after_user_id" uuid,
+    "p_limit" integer
+) RETURNS TABLE("user" jsonb, "ref_message" jsonb)
+    LANGUAGE "sql" STABLE
+    AS $$
+    SELECT to_jsonb(u), to_jsonb(msg)
+    FROM public.users u
+    CROSS JOIN LATERAL (
+        SELECT *
+        FROM public.messages mm
+        WHERE mm.user_id = u.user_id AND mm.sent_by = 'user'
+        ORDER BY mm."timestamp" DESC
+        LIMIT 1
+    ) msg
+    WHERE p_after_user_id IS NULL OR u.user_id > p_after_user_id
+    ORDER BY u.user_id
+    LIMIT p_limit;
+$$;
+
+ALTER FUNCTION "public"."get_broadcast_recipients"(uuid, integer) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."get_broadcast_recipients"(uuid, integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."get_broadcast_recipients"(uuid, integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."get_broadcast_recipients"(uuid, integer) TO "service_role";
+
+grant delete on table "public"."broadcasts" to "anon";
+
+grant insert on table "public"."broadcasts" to "anon";
+
+grant select on table "public"."broadcasts" to "anon";
+
+grant update on table "public"."broadcasts" to "anon";
+
+grant delete on table "public"."broadcasts" to "authenticated";
+
+grant insert on table "public"."broadcasts" to "authenticated";
+
+grant select on table "public"."broadcasts" to "authenticated";
+
+grant update on table "public"."broadcasts" to "authenticated";
+
+grant delete on table "public"."broadcasts" to "service_role";
+
+grant insert on table "public"."broadcasts" to "service_role";
+
+grant select on table "public"."broadcasts" to "service_role";
+
+grant update on table "public"."broadcasts" to "service_role";
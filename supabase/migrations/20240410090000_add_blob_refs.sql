@@ -0,0 +1,84 @@
+create table "public"."blob_refs" (
+    "blob_path" text not null,
+    "refcount" integer not null default 0,
+    "created_at" timestamp with time zone not null default now(),
+    "updated_at" timestamp with time zone not null default now()
+);
+
+alter table "public"."blob_refs" enable row level security;
+
+CREATE UNIQUE INDEX blob_refs_pkey ON public.blob_refs USING btree (blob_path);
+
+alter table "public"."blob_refs" add constraint "blob_refs_pkey" PRIMARY KEY using index "blob_refs_pkey";
+
+-- Adds a reference to a blob and returns the number of references it has now.
+CREATE OR REPLACE FUNCTION "public"."acquire_blob_ref"("p_blob_path" text) RETURNS integer
+    LANGUAGE "sql"
+    AS $$
+    INSERT INTO public.blob_refs (blob_path, refcount)
+    VALUES (p_blob_path, 1)
+    ON CONFLICT (blob_path) DO UPDATE
+    SET refcount = public.blob_refs.refcount + 1,
+        updated_at = now()
+    RETURNING refcount;
+$$;
+
+-- Removes a reference to a blob and returns the number of references left. The row of
+-- a blob without references is deleted, the caller then deletes the blob itself. Blobs
+-- stored before references were counted have no row and are not shared, so 0 is
+-- returned for them.
+CREATE OR REPLACE FUNCTION "public"."release_blob_ref"("p_blob_path" text) RETURNS integer
+    LANGUAGE "plpgsql"
+    AS $$
+DECLARE
+    v_refcount integer;
+BEGIN
+    UPDATE public.blob_refs
+    SET refcount = refcount - 1,
+        updated_at = now()
+    WHERE blob_path = p_blob_path
+    RETURNING refcount INTO v_refcount;
+
+    IF v_refcount IS NULL OR v_refcount <= 0 THEN
+        DELETE FROM public.blob_refs WHERE blob_path = p_blob_path;
+        RETURN 0;
+    END IF;
+    RETURN v_refcount;
+END;
+$$;
+
+ALTER FUNCTION "public"."acquire_blob_ref"(text) OWNER TO "postgres";
+
+ALTER FUNCTION "public"."release_blob_ref"(text) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."acquire_blob_ref"(text) TO "anon";
+GRANT ALL ON FUNCTION "public"."acquire_blob_ref"(text) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."acquire_blob_ref"(text) TO "service_role";
+
+GRANT ALL ON FUNCTION "public"."release_blob_ref"(text) TO "anon";
+GRANT ALL ON FUNCTION "public"."release_blob_ref"(text) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."release_blob_ref"(text) TO "service_role";
+
+grant delete on table "public"."blob_refs" to "anon";
+
+grant insert on table "public"."blob_refs" to "anon";
+
+grant select on table "public"."blob_refs" to "anon";
+
+grant update on table "public"."blob_refs" to "anon";
+
+grant delete on table "public"."blob_refs" to "authenticated";
+
+grant insert on table "public"."blob_refs" to "authenticated";
+
+grant select on table "public"."blob_refs" to "authenticated";
+
+grant update on table "public"."blob_refs" to "authenticated";
+
+grant delete on table "public"."blob_refs" to "service_role";
+
+grant insert on table "public"."blob_refs" to "service_role";
+
+grant select on table "public"."blob_refs" to "service_role";
+
+grant update on table "public"."blob_refs" to "service_role";
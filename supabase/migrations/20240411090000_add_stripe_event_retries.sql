@@ -0,0 +1,65 @@
+alter table "public"."stripe_events" add column "attempts" integer not null default 0;
+
+alter table "public"."stripe_events" add column "claimed_at" timestamp with time zone;
+
+alter table "public"."stripe_events" add column "next_attempt_at" timestamp with time zone;
+
+-- An event can be claimed if it was received, if it failed and its next attempt is
+-- due, or if the claim of a worker that crashed or was redeployed expired. Failed
+-- events without a next attempt were given up on.
+CREATE OR REPLACE FUNCTION "public"."stripe_event_is_due"(
+    "e" "public"."stripe_events",
+    "p_lease_seconds" integer
+) RETURNS boolean
+    LANGUAGE "sql" STABLE
+    AS $$
+    SELECT e.status = 'received'
+        OR (e.status = 'failed' AND e.next_attempt_at <= now())
+        OR (e.status = 'processing'
+            AND e.claimed_at < now() - make_interval(secs => p_lease_seconds));
+$$;
+
+CREATE OR REPLACE FUNCTION "public"."claim_stripe_event"(
+    "p_event_id" text,
+    "p_lease_seconds" integer
+) RETURNS SETOF "public"."stripe_events"
+    LANGUAGE "sql"
+    AS $$
+    UPDATE public.stripe_events e
+    SET status = 'processing',
+        attempts = e.attempts + 1,
+        claimed_at = now()
+    WHERE e.event_id = p_event_id
+      AND public.stripe_event_is_due(e, p_lease_seconds)
+    RETURNING e.*;
+$$;
+
+CREATE OR REPLACE FUNCTION "public"."get_due_stripe_events"(
+    "p_lease_seconds" integer
+) RETURNS SETOF "public"."stripe_events"
+    LANGUAGE "sql" STABLE
+    AS $$
+    SELECT e.*
+    FROM public.stripe_events e
+    WHERE e.status IN ('received', 'failed', 'processing')
+      AND public.stripe_event_is_due(e, p_lease_seconds)
+    ORDER BY e.received_at;
+$$;
+
+ALTER FUNCTION "public"."stripe_event_is_due"("public"."stripe_events", integer) OWNER TO "postgres";
+
+ALTER FUNCTION "public"."claim_stripe_event"(text, integer) OWNER TO "postgres";
+
+ALTER FUNCTION "public"."get_due_stripe_events"(integer) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."stripe_event_is_due"("public"."stripe_events", integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."stripe_event_is_due"("public"."stripe_events", integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."stripe_event_is_due"("public"."stripe_events", integer) TO "service_role";
+
+GRANT ALL ON FUNCTION "public"."claim_stripe_event"(text, integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."claim_stripe_event"(text, integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."claim_stripe_event"(text, integer) TO "service_role";
+
+GRANT ALL ON FUNCTION "public"."get_due_stripe_events"(integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."get_due_stripe_events"(integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."get_due_stripe_events"(integer) TO "service_role";
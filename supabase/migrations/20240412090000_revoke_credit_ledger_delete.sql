@@ -0,0 +1,4 @@
+-- The credit ledger is append-only, entries are only removed together with their user.
+-- Databases that applied the ledger migration before the grant was dropped from it
+-- still allow the service role to delete entries.
+revoke delete on table "public"."credit_ledger" from "service_role";
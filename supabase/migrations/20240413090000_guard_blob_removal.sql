@@ -0,0 +1,84 @@
+-- A blob whose last reference was released is removed from storage after the row was
+-- updated. A reference acquired in between used to upload the blob again, which the
+-- pending remove then deleted although it was referenced. Rows without references are
+-- now kept while their blob is removed, and references can only be acquired again once
+-- the removal finished or its lease expired.
+alter table "public"."blob_refs" add column "removing_until" timestamp with time zone;
+
+-- Adds a reference to a blob and returns the number of references it has now. Returns 0
+-- without adding a reference while the blob is removed along with its last reference,
+-- the caller retries then.
+CREATE OR REPLACE FUNCTION "public"."acquire_blob_ref"("p_blob_path" text) RETURNS integer
+    LANGUAGE "plpgsql"
+    AS $$
+DECLARE
+    v_refcount integer;
+BEGIN
+    INSERT INTO public.blob_refs AS r (blob_path, refcount)
+    VALUES (p_blob_path, 1)
+    ON CONFLICT (blob_path) DO UPDATE
+    SET refcount = r.refcount + 1,
+        removing_until = NULL,
+        updated_at = now()
+    WHERE r.removing_until IS NULL OR r.removing_until < now()
+    RETURNING refcount INTO v_refcount;
+    RETURN coalesce(v_refcount, 0);
+END;
+$$;
+
+-- Removes a reference to a blob and returns whether the caller has to remove the blob.
+-- That's the case if the last reference was released, the row is then kept with a
+-- lease of a minute until finish_blob_removal is called. Blobs stored before
+-- references were counted have no row and are not shared, so they are removed as well.
+DROP FUNCTION "public"."release_blob_ref"(text);
+
+CREATE FUNCTION "public"."release_blob_ref"("p_blob_path" text) RETURNS boolean
+    LANGUAGE "plpgsql"
+    AS $$
+DECLARE
+    v_refcount integer;
+BEGIN
+    SELECT refcount INTO v_refcount
+    FROM public.blob_refs
+    WHERE blob_path = p_blob_path
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN true;
+    END IF;
+    IF v_refcount <= 0 THEN
+        -- released more often than acquired, the blob is being removed already
+        RETURN false;
+    END IF;
+
+    UPDATE public.blob_refs
+    SET refcount = v_refcount - 1,
+        removing_until = CASE
+            WHEN v_refcount = 1 THEN now() + interval '1 minute'
+        END,
+        updated_at = now()
+    WHERE blob_path = p_blob_path;
+    RETURN v_refcount = 1;
+END;
+$$;
+
+-- Called after the blob was removed, so that references can be acquired again.
+CREATE OR REPLACE FUNCTION "public"."finish_blob_removal"("p_blob_path" text) RETURNS void
+    LANGUAGE "sql"
+    AS $$
+    DELETE FROM public.blob_refs WHERE blob_path = p_blob_path AND refcount = 0;
+$$;
+
+ALTER FUNCTION "public"."acquire_blob_ref"(text) OWNER TO "postgres";
+
+ALTER FUNCTION "public"."release_blob_ref"(text) OWNER TO "postgres";
+
+ALTER FUNCTION "public"."finish_blob_removal"(text) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."release_blob_ref"(text) TO "anon";
+GRANT ALL ON FUNCTION "public"."release_blob_ref"(text) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."release_blob_ref"(text) TO "service_role";
+
+GRANT ALL ON FUNCTION "public"."finish_blob_removal"(text) TO "anon";
+GRANT ALL ON FUNCTION "public"."finish_blob_removal"(text) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."finish_blob_removal"(text) TO "service_role";
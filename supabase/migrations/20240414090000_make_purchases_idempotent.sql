@@ -0,0 +1,70 @@
+-- Stripe events are retried after a failure or an expired lease, which dispatched the
+-- order again and credited the purchase once per attempt. Purchases now record the
+-- Stripe event they were paid with and are only credited for the first attempt.
+alter table "public"."credit_ledger" add column "stripe_event_id" text;
+
+CREATE UNIQUE INDEX credit_ledger_stripe_event_id_key ON public.credit_ledger USING btree (stripe_event_id);
+
+DROP FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer);
+
+CREATE FUNCTION "public"."transition_order_and_adjust_credits"(
+    "p_order_id" "uuid",
+    "p_from_status" character varying,
+    "p_to_status" character varying,
+    "p_credits_added" integer DEFAULT 0,
+    "p_credit_delta" integer DEFAULT 0,
+    "p_stripe_event_id" text DEFAULT NULL
+) RETURNS TABLE("transitioned" boolean, "user_id" "uuid", "num_letter_credits" bigint, "last_entry_id" bigint)
+    LANGUAGE "plpgsql"
+    AS $$
+DECLARE
+    v_user_id uuid;
+    v_balance bigint;
+    v_last_entry_id bigint;
+    v_entry_id bigint;
+    v_transitioned boolean := false;
+BEGIN
+    SELECT o.user_id INTO v_user_id FROM public.orders o WHERE o.order_id = p_order_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Order % not found', p_order_id;
+    END IF;
+
+    PERFORM 1 FROM public.users u WHERE u.user_id = v_user_id FOR UPDATE;
+    SELECT b.balance, b.last_entry_id INTO v_balance, v_last_entry_id
+    FROM public.get_credit_balance(v_user_id) b;
+
+    IF p_credits_added <> 0 THEN
+        -- a purchase credited by an earlier attempt of the same event is in the balance
+        INSERT INTO public.credit_ledger (user_id, delta, reason, order_id, stripe_event_id)
+        VALUES (v_user_id, p_credits_added, 'purchase', p_order_id, p_stripe_event_id)
+        ON CONFLICT (stripe_event_id) DO NOTHING
+        RETURNING entry_id INTO v_entry_id;
+        IF FOUND THEN
+            v_last_entry_id := v_entry_id;
+            v_balance := v_balance + p_credits_added;
+        END IF;
+    END IF;
+
+    IF v_balance + p_credit_delta >= 0 THEN
+        UPDATE public.orders o
+        SET status = p_to_status
+        WHERE o.order_id = p_order_id AND o.status = p_from_status;
+        v_transitioned := FOUND;
+    END IF;
+
+    IF v_transitioned AND p_credit_delta <> 0 THEN
+        INSERT INTO public.credit_ledger (user_id, delta, reason, order_id)
+        VALUES (v_user_id, p_credit_delta, 'order_' || p_to_status, p_order_id)
+        RETURNING entry_id INTO v_last_entry_id;
+        v_balance := v_balance + p_credit_delta;
+    END IF;
+
+    RETURN QUERY SELECT v_transitioned, v_user_id, v_balance, v_last_entry_id;
+END;
+$$;
+
+ALTER FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer, text) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer, text) TO "anon";
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer, text) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."transition_order_and_adjust_credits"("uuid", character varying, character varying, integer, integer, text) TO "service_role";
@@ -0,0 +1,10 @@
+-- Drafts and files are never deleted, so the references to their blobs were only ever
+-- acquired. Blobs are stored under the hash of their content and uploaded unless they
+-- are stored already, which needs no references.
+DROP FUNCTION "public"."acquire_blob_ref"(text);
+
+DROP FUNCTION "public"."release_blob_ref"(text);
+
+DROP FUNCTION "public"."finish_blob_removal"(text);
+
+DROP TABLE "public"."blob_refs";
@@ -0,0 +1,22 @@
+-- Extends the lease of a job that is still held by the caller, e.g. a broadcast that is
+-- running on this worker. Returns whether the lease was extended.
+CREATE OR REPLACE FUNCTION "public"."renew_job_lease"(
+    "p_job_name" text,
+    "p_holder" text,
+    "p_ttl_seconds" integer
+) RETURNS boolean
+    LANGUAGE "plpgsql"
+    AS $$
+BEGIN
+    UPDATE public.job_leases
+    SET expires_at = now() + make_interval(secs => p_ttl_seconds)
+    WHERE job_name = p_job_name AND holder = p_holder;
+    RETURN FOUND;
+END;
+$$;
+
+ALTER FUNCTION "public"."renew_job_lease"(text, text, integer) OWNER TO "postgres";
+
+GRANT ALL ON FUNCTION "public"."renew_job_lease"(text, text, integer) TO "anon";
+GRANT ALL ON FUNCTION "public"."renew_job_lease"(text, text, integer) TO "authenticated";
+GRANT ALL ON FUNCTION "public"."renew_job_lease"(text, text, integer) TO "service_role";